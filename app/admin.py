@@ -1,20 +1,89 @@
 # app/admin.py
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.db.models import Q
 from unfold.admin import ModelAdmin as UnfoldModelAdmin, TabularInline as UnfoldTabularInline
-from .models import Image, PointOfInterest, GeminiInteraction, SearchableObject, Comment
+from django.utils import timezone
+from .models import Image, PointOfInterest, GeminiInteraction, SearchableObject, Comment, Job
+from .fulltext import matching_ids
+
+
+class FulltextSearchMixin:
+    """
+    Поиск в списке по полнотекстовому индексу (app/fulltext.py) вместо icontains по
+    search_fields: они только перечисляют проиндексированные поля и включают строку поиска.
+    Индекс отдает не больше FULLTEXT_ADMIN_MAX лучших совпадений — если их больше,
+    админ видит предупреждение и может уточнить запрос.
+    fallback_search_fields — поля вне индекса (свои или связанных записей, вида 'image__name'):
+    по ним ищется обычным icontains, найденное добавляется к выдаче индекса.
+    """
+    fulltext_kind = None
+    fallback_search_fields = ()
+
+    def fallback_condition(self, search_term):
+        # Как в поиске админки: каждое слово — хотя бы в одном поле. Поле связанной записи
+        # проверяется подзапросом к ее таблице, а не JOIN-ом с условием OR по всему списку
+        condition = Q()
+        for term in search_term.split():
+            any_field = Q()
+            for field in self.fallback_search_fields:
+                if '__' not in field:
+                    any_field |= Q(**{f'{field}__icontains': term})
+                    continue
+                relation, lookup = field.split('__', 1)
+                related = self.model._meta.get_field(relation).related_model
+                matches = related._default_manager.filter(**{f'{lookup}__icontains': term}).values('pk')
+                any_field |= Q(**{f'{relation}__in': matches})
+            condition &= any_field
+        return condition
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        limit = settings.FULLTEXT_ADMIN_MAX
+        try:
+            # На одно больше предела: так видно, что совпадений больше, чем показано
+            ids = matching_ids(self.fulltext_kind, search_term, limit=limit + 1)
+        except ValueError:
+            # В запросе нет слов для индекса — остаются только поля вне него
+            ids = []
+        if len(ids) > limit:
+            ids = ids[:limit]
+            self.message_user(
+                request,
+                f'По индексу показаны {limit} лучших совпадений, остальные отброшены — уточните запрос.',
+                messages.WARNING,
+            )
+        found = Q(pk__in=ids)
+        if self.fallback_search_fields:
+            found |= self.fallback_condition(search_term)
+        return queryset.filter(found), False
+
 
 @admin.register(Image)
 class ImageAdmin(UnfoldModelAdmin):
-    list_display = ('name', 'source_file', 'status', 'max_zoom_level', 'uploaded_at')
-    readonly_fields = ('uploaded_at', 'status', 'max_zoom_level') 
+    list_display = ('name', 'source_file', 'status', 'progress_percent', 'tile_storage', 'max_zoom_level', 'uploaded_at')
+    readonly_fields = (
+        'uploaded_at', 'status', 'max_zoom_level', 'tiling_checkpoint', 'progress_percent', 'tiles_written',
+        'tiles_per_second', 'bytes_written', 'eta_seconds', 'progress_updated_at', 'tiles_skipped', 'tiles_deduped'
+    )
     search_fields = ('name', 'description')
     list_filter = ('status',)
     fieldsets = (
         (None, {
-            'fields': ('name', 'description', 'source_file')
+            'fields': ('name', 'description', 'source_file', 'tile_storage')
+        }),
+        ('Параметры тайлов', {
+            'fields': ('tile_format', 'tile_quality', 'skip_blank_tiles', 'dedup_tiles', 'tiles_skipped', 'tiles_deduped')
         }),
         ('Техническая информация', {
-            'fields': ('max_zoom_level', 'source_url', 'status', 'uploaded_at')
+            'fields': ('max_zoom_level', 'source_url', 'status', 'tiling_checkpoint', 'uploaded_at')
+        }),
+        ('Ход нарезки', {
+            'fields': (
+                'progress_percent', 'tiles_written', 'tiles_per_second', 'bytes_written', 'eta_seconds',
+                'progress_updated_at'
+            )
         }),
     )
 
@@ -25,11 +94,13 @@ class CommentInline(UnfoldTabularInline):
     readonly_fields = ('created_at',)
 
 @admin.register(PointOfInterest)
-class PointOfInterestAdmin(UnfoldModelAdmin):
+class PointOfInterestAdmin(FulltextSearchMixin, UnfoldModelAdmin):
     # Заменяем все упоминания 'owner' на 'owner_name'
     list_display = ('name', 'image', 'owner_name', 'created_at')
     list_filter = ('image', 'created_at')
-    search_fields = ('name', 'owner_name', 'image__name')
+    search_fields = ('name', 'description')
+    fulltext_kind = 'marker'
+    fallback_search_fields = ('owner_name', 'image__name')
     autocomplete_fields = ('image',) # Убираем 'owner'
     readonly_fields = ('created_at',)
     fieldsets = (
@@ -43,18 +114,38 @@ class PointOfInterestAdmin(UnfoldModelAdmin):
     inlines = [CommentInline]
 
 @admin.register(SearchableObject)
-class SearchableObjectAdmin(UnfoldModelAdmin):
+class SearchableObjectAdmin(FulltextSearchMixin, UnfoldModelAdmin):
     list_display = ('name', 'object_type', 'image', 'created_at')
+    search_fields = ('name', 'object_type', 'description')
+    fulltext_kind = 'object'
     readonly_fields = ('vector_id', 'created_at')
 
 @admin.register(GeminiInteraction)
 class GeminiInteractionAdmin(UnfoldModelAdmin):
-    list_display = ('user', 'point', 'timestamp')
+    list_display = ('user', 'point', 'cached', 'timestamp')
+    list_filter = ('cached',)
     readonly_fields = [f.name for f in GeminiInteraction._meta.fields]
 
 @admin.register(Comment)
-class CommentAdmin(UnfoldModelAdmin):
+class CommentAdmin(FulltextSearchMixin, UnfoldModelAdmin):
     list_display = ('author_name', 'point', 'created_at')
     list_filter = ('created_at',)
-    search_fields = ('text', 'author_name', 'point__name')
-    readonly_fields = ('created_at',)
\ No newline at end of file
+    search_fields = ('text', 'author_name')
+    fulltext_kind = 'comment'
+    fallback_search_fields = ('point__name',)
+    readonly_fields = ('created_at',)
+
+@admin.register(Job)
+class JobAdmin(UnfoldModelAdmin):
+    list_display = ('id', 'kind', 'image', 'status', 'attempts', 'max_attempts', 'run_after', 'worker', 'created_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('image__name', 'worker', 'last_error')
+    readonly_fields = ('attempts', 'worker', 'heartbeat_at', 'last_error', 'created_at', 'finished_at')
+    actions = ['requeue']
+
+    @admin.action(description='Повторить выбранные задачи')
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status='RUNNING').update(
+            status='QUEUED', attempts=0, run_after=timezone.now(), worker='', last_error=''
+        )
+        self.message_user(request, f'Поставлено в очередь задач: {updated}')
@@ -0,0 +1,181 @@
+# app/ai.py
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .models import GeminiInteraction
+
+# =====================================================================
+# Ответы AI о точке интереса
+# Вопрос о маркере уходит модели (AI_CLIENT) вместе с контекстом точки:
+# название и описание изображения и точки, ее положение. Ответ кэшируется
+# под ключом из модели, контекста и нормализованного вопроса (регистр,
+# пробелы и знаки в конце не важны): повтор того же вопроса о той же
+# точке в течение AI_CACHE_TTL секунд модель не вызывает, а правка
+# описания точки меняет ключ. Кэш — в памяти процесса, не больше
+# AI_CACHE_MAX_ENTRIES ответов, вытесняются давно не спрошенные (LRU).
+# Одинаковые вопросы, пришедшие, пока первый еще ждет модель, ждут его
+# ответа, а не вызывают модель сами. Каждый вопрос записывается в
+# GeminiInteraction с отметкой, был ли ответ взят из кэша.
+# =====================================================================
+
+TRAILING_PUNCTUATION = re.compile(r'[\s?!.…]+$')
+
+
+class GeminiClient:
+    """Модель Gemini AI_MODEL (ключ GEMINI_API_KEY)."""
+
+    def __init__(self):
+        import google.generativeai as genai
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.model = genai.GenerativeModel(settings.AI_MODEL)
+        self.name = f'gemini:{settings.AI_MODEL}'
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt, request_options={'timeout': settings.AI_REQUEST_TIMEOUT}).text
+
+
+class EchoClient:
+    """Локальная подделка модели (тесты, разработка): отвечает последней строкой запроса и считает вызовы."""
+    name = 'echo'
+    calls = 0
+    # Задержка "модели" в секундах — чтобы одинаковые вопросы успели прийти одновременно
+    delay = 0
+
+    def generate(self, prompt):
+        type(self).calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return f'Ответ: {prompt.splitlines()[-1]}'
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_ai_client():
+    with _clients_lock:
+        if settings.AI_CLIENT not in _clients:
+            _clients[settings.AI_CLIENT] = import_string(settings.AI_CLIENT)()
+        return _clients[settings.AI_CLIENT]
+
+
+class AnswerCache:
+    """
+    LRU с временем жизни записей и объединением одновременных промахов: первый
+    промах по ключу (лидер) вычисляет значение, остальные ждут его Future.
+    Ошибка лидера достается всем ждущим и не кэшируется.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    def get_or_compute(self, key, compute, timeout=None):
+        """(значение, исход): исход — 'hit', 'miss' (вызван compute) или 'coalesced'."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return entry[1], 'hit'
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+                self.counts['misses'] += 1
+            else:
+                self.counts['coalesced'] += 1
+        if not leader:
+            return future.result(timeout), 'coalesced'
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            del self.in_flight[key]
+        future.set_result(value)
+        return value, 'miss'
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            entries = len(self.entries)
+        total = sum(counts.values())
+        return {
+            **counts,
+            'entries': entries,
+            'hitRate': round(counts['hits'] / total, 3) if total else None,
+            # Вызовы модели, которых не было: ответ из кэша или общий с одновременным вопросом
+            'savedCalls': counts['hits'] + counts['coalesced'],
+        }
+
+    def clear(self, stats_only=False):
+        with self.lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+            if not stats_only:
+                self.entries.clear()
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(settings.AI_CACHE_MAX_ENTRIES, settings.AI_CACHE_TTL)
+        return _answer_cache
+
+
+def normalize_prompt(prompt):
+    return TRAILING_PUNCTUATION.sub('', ' '.join(prompt.casefold().split()))
+
+
+def point_context(point):
+    """Что модель знает о точке: изображение, сама точка и ее положение в долях размеров изображения."""
+    image = point.image
+    lines = [f'Изображение: {image.name}', image.description, f'Точка на изображении: {point.name}', point.description]
+    if image.width and image.height:
+        lines.append(f'Положение точки: x = {point.x / image.width:.3f}, y = {point.y / image.height:.3f} ширины и высоты')
+    return '\n'.join(line for line in lines if line)
+
+
+def answer_key(client, context, prompt):
+    return hashlib.sha256(f'{client.name}\n{context}\n{normalize_prompt(prompt)}'.encode()).hexdigest()
+
+
+def ask_about_point(point, prompt, user):
+    """
+    Ответ модели на вопрос prompt о точке point (изображение — point.image) от пользователя user.
+    Возвращает запись GeminiInteraction; ее атрибут cached — ответ без вызова модели.
+    Ошибки клиента модели пробрасываются.
+    """
+    client = get_ai_client()
+    context = point_context(point)
+    answer, outcome = get_answer_cache().get_or_compute(
+        answer_key(client, context, prompt),
+        lambda: client.generate(f'{context}\n\nВопрос: {prompt}'),
+        timeout=settings.AI_REQUEST_TIMEOUT,
+    )
+    return GeminiInteraction.objects.create(
+        point=point, user=user, prompt=prompt, response=answer, cached=outcome != 'miss'
+    )
@@ -0,0 +1,218 @@
+# app/bulk_import.py
+
+import csv
+import io
+import json
+import time
+from django.conf import settings
+from django.db import transaction
+from .clusters import add_point, rebuild_clusters
+from .models import Image, PointOfInterest, SearchableObject
+from .spatial import cell_for
+from .embeddings import enqueue_embedding
+from .fulltext import index_documents, rebuild_documents
+from .versions import touch
+
+# =====================================================================
+# Массовый импорт маркеров и объектов поиска
+# Строки CSV (с заголовком) или NDJSON (объект JSON на строку) читаются
+# потоком, проверяются по размерам изображения и пишутся bulk_create
+# пачками по BULK_IMPORT_BATCH_SIZE, каждая пачка — своя транзакция.
+# bulk_create не вызывает save() и сигналы, поэтому ячейку индекса
+# считаем здесь, документы поиска пишем вместе с каждой пачкой, а кластеры
+# и версию изображения обновляем один раз в конце.
+# =====================================================================
+
+IMPORT_KINDS = ['markers', 'objects']
+COORDINATE_MODES = ['pixel', 'normalized']
+IMPORT_FORMATS = ['csv', 'ndjson']
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Текстовый поток -> (номер строки, словарь полей)."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, None
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f'Неизвестный формат: {fmt}')
+
+
+def format_for(filename, default='csv'):
+    """Формат по расширению файла: .ndjson/.jsonl — NDJSON, остальное — default."""
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def text_stream(binary):
+    """Бинарный файл (загрузка, sys.stdin.buffer) -> текст UTF-8; BOM из Excel отбрасывается."""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def pick(row, *names, default=''):
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ''):
+            return value
+    return default
+
+
+def pixel_coordinates(row, image, coords):
+    """Координаты строки в пикселях изображения; RowError, если их нет или они вне изображения."""
+    try:
+        x = float(row['x'])
+        y = float(row['y'])
+    except (KeyError, TypeError, ValueError):
+        raise RowError('нужны числовые x и y')
+    if coords == 'normalized':
+        if not (0 <= x <= 1 and 0 <= y <= 1):
+            raise RowError(f'нормированные координаты ({x}, {y}) вне [0, 1]')
+        # Как в MarkerCreateSerializer, но правый/нижний край — последний пиксель
+        return min(int(x * image.width), image.width - 1), min(int(y * image.height), image.height - 1)
+    if not (0 <= x < image.width and 0 <= y < image.height):
+        raise RowError(f'точка ({x}, {y}) вне изображения {image.width}x{image.height}')
+    return int(x), int(y)
+
+
+def build_marker(row, image, coords):
+    x, y = pixel_coordinates(row, image, coords)
+    name = str(pick(row, 'title', 'name'))
+    if not name:
+        raise RowError('нужно название (title или name)')
+    return PointOfInterest(
+        image=image,
+        x=x,
+        y=y,
+        cell=cell_for(x, y, image.width, image.height),
+        name=name[:255],
+        description=str(pick(row, 'description')),
+        owner_name=str(pick(row, 'user', 'owner_name'))[:80] or None,
+    )
+
+
+def build_object(row, image, coords):
+    x, y = pixel_coordinates(row, image, coords)
+    name = str(pick(row, 'name', 'title'))
+    if not name:
+        raise RowError('нужно название (name или title)')
+    try:
+        width = int(float(pick(row, 'width', default=0))) or None
+        height = int(float(pick(row, 'height', default=0))) or None
+    except ValueError:
+        raise RowError('width и height — числа')
+    return SearchableObject(
+        image=image,
+        x=x,
+        y=y,
+        cell=cell_for(x, y, image.width, image.height),
+        name=name[:255],
+        description=str(pick(row, 'description')),
+        object_type=str(pick(row, 'object_type', 'type'))[:50],
+        width=width,
+        height=height,
+    )
+
+
+# Небольшой импорт в большое изображение дешевле учесть в кластерах по точке
+# (add_point, ~11 уровней на точку), чем пересчитывать все кластеры: пересчет
+# стоит примерно как CLUSTER_REBUILD_RATIO инкрементальных добавлений на точку изображения
+INCREMENTAL_CLUSTERS_MAX = 1000
+CLUSTER_REBUILD_RATIO = 200
+
+BUILDERS = {'markers': build_marker, 'objects': build_object}
+MODELS = {'markers': PointOfInterest, 'objects': SearchableObject}
+FULLTEXT_KINDS = {'markers': 'marker', 'objects': 'object'}
+
+
+def import_rows(image, stream, kind='markers', fmt='csv', coords='pixel', batch_size=None, log=print):
+    """
+    Импортирует строки из текстового потока в image. Неверные строки пропускаются
+    (первые BULK_IMPORT_MAX_ERRORS попадают в отчет). Возвращает словарь:
+    rows, created, invalid, errors, seconds, rows_per_second.
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f'Неизвестный тип импорта: {kind}')
+    if coords not in COORDINATE_MODES:
+        raise ValueError(f'Неизвестные координаты: {coords}')
+    if not image.width or not image.height:
+        raise ValueError('Размеры изображения не определены. Обработка еще не завершена.')
+
+    build = BUILDERS[kind]
+    model = MODELS[kind]
+    batch_size = batch_size or settings.BULK_IMPORT_BATCH_SIZE
+    started = time.monotonic()
+    stats = {'rows': 0, 'created': 0, 'invalid': 0, 'errors': []}
+    batch = []
+    # Созданные точки — пока их мало, чтобы учесть в кластерах по одной (None — будет пересчет)
+    new_points = [] if kind == 'markers' else None
+
+    # База не вернула id созданных точек: документы поиска — пересозданием в конце
+    reindex = False
+
+    def flush():
+        nonlocal new_points, reindex
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=batch_size)
+            if batch[0].pk is not None:
+                index_documents(FULLTEXT_KINDS[kind], batch)
+            else:
+                reindex = True
+        stats['created'] += len(batch)
+        if new_points is not None:
+            new_points.extend(batch)
+            if len(new_points) > INCREMENTAL_CLUSTERS_MAX or new_points[0].id is None:
+                new_points = None
+        elapsed = time.monotonic() - started
+        log(f'Импортировано {stats["created"]} строк ({stats["created"] / elapsed:.0f} строк/с)')
+        batch.clear()
+
+    for line_number, row in read_rows(stream, fmt):
+        stats['rows'] += 1
+        try:
+            if not isinstance(row, dict):
+                raise RowError('строка не является объектом JSON')
+            batch.append(build(row, image, coords))
+        except RowError as e:
+            stats['invalid'] += 1
+            if len(stats['errors']) < settings.BULK_IMPORT_MAX_ERRORS:
+                stats['errors'].append({'line': line_number, 'error': str(e)})
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if kind == 'markers' and stats['created']:
+        # Кластеры и версия изображения — один раз на весь импорт, а не сигналами на каждую точку
+        if new_points is not None and len(new_points) * CLUSTER_REBUILD_RATIO < image.points.count():
+            for point in new_points:
+                add_point(point)
+        else:
+            rebuild_clusters(image.id)
+        touch(Image, image.id)
+    if reindex:
+        rebuild_documents([image.id])
+    if kind == 'objects' and stats['created']:
+        # bulk_create не вызывает сигналы: эмбеддинги всех новых объектов — одной задачей
+        enqueue_embedding(image)
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    stats['rows_per_second'] = round(stats['rows'] / stats['seconds'], 1) if stats['seconds'] else None
+    return stats
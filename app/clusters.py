@@ -0,0 +1,146 @@
+# app/clusters.py
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from .models import MarkerCluster, PointOfInterest
+from .spatial import GRID_BITS, THINNING_CELLS_PER_VIEW_BITS, bbox_cell_ranges
+
+# =====================================================================
+# Кластеры маркеров по уровням масштаба
+# На уровне сетки L изображение делится на 2^L x 2^L ячеек, ячейка уровня
+# L — это старшие 2L бит ячейки точки (PointOfInterest.cell). Для каждой
+# непустой ячейки хранится MarkerCluster: число точек, суммы координат
+# (центр = сумма / число) и точка-представитель — точка ячейки с
+# наименьшим id, одинаково при приращениях и при пересчете. Агрегаты
+# обновляются приращениями при добавлении/удалении/перемещении точки,
+# поэтому запрос кластеров — это чтение готовых строк в пределах видимой
+# области.
+# =====================================================================
+
+
+def cluster_levels():
+    return range(settings.MARKER_CLUSTER_MAX_LEVEL + 1)
+
+
+def level_for_zoom(zoom):
+    """Уровень сетки для масштаба zoom: ячейка — 1/16 ширины экрана, как при прореживании маркеров."""
+    return zoom + THINNING_CELLS_PER_VIEW_BITS
+
+
+def level_cell(cell, level):
+    return cell >> (2 * (GRID_BITS - level))
+
+
+def point_clusters(image_id, point_cell):
+    """Условие на ячейки всех уровней, в которые попадает точка."""
+    cells = Q()
+    for level in cluster_levels():
+        cells |= Q(level=level, cell=level_cell(point_cell, level))
+    return MarkerCluster.objects.filter(cells, image_id=image_id)
+
+
+@transaction.atomic
+def add_point(point):
+    """
+    Учитывает точку во всех уровнях кластеров: один UPDATE для уже существующих
+    ячеек и вставка недостающих — несколько запросов на точку, а не по два на уровень.
+    """
+    if point.cell is None:
+        return
+    clusters = point_clusters(point.image_id, point.cell)
+    increment = {
+        'count': F('count') + 1, 'sum_x': F('sum_x') + point.x, 'sum_y': F('sum_y') + point.y,
+        # Точка, перенесенная в ячейку из другой, может быть старше нынешнего представителя
+        'representative_id': Case(
+            When(Q(representative__isnull=True) | Q(representative_id__gt=point.id), then=Value(point.id)),
+            default=F('representative_id'),
+            output_field=BigIntegerField(),
+        ),
+    }
+    updated = clusters.update(**increment)
+    if updated == len(cluster_levels()):
+        return
+    existing = set(clusters.values_list('level', flat=True))
+    missing = [
+        MarkerCluster(image_id=point.image_id, level=level, cell=level_cell(point.cell, level),
+                      count=1, sum_x=point.x, sum_y=point.y, representative_id=point.id)
+        for level in cluster_levels() if level not in existing
+    ]
+    try:
+        with transaction.atomic():
+            MarkerCluster.objects.bulk_create(missing)
+    except IntegrityError:
+        # Часть ячеек только что создал параллельный запрос — добавляем по одной
+        for cluster in missing:
+            key = {'image_id': cluster.image_id, 'level': cluster.level, 'cell': cluster.cell}
+            try:
+                with transaction.atomic():
+                    MarkerCluster.objects.create(count=1, sum_x=point.x, sum_y=point.y, representative_id=point.id, **key)
+            except IntegrityError:
+                MarkerCluster.objects.filter(**key).update(**increment)
+
+
+@transaction.atomic
+def remove_point(image_id, point_id, x, y, point_cell):
+    """Вычитает точку (по ее прежним координатам) из всех уровней кластеров."""
+    if point_cell is None:
+        return
+    clusters = point_clusters(image_id, point_cell)
+    clusters.update(count=F('count') - 1, sum_x=F('sum_x') - x, sum_y=F('sum_y') - y)
+    clusters.filter(count__lte=0).delete()
+    # Точка была представителем ячейки (при удалении ссылка уже обнулена) — берем другую из той же ячейки
+    orphaned = clusters.filter(Q(representative_id=point_id) | Q(representative__isnull=True))
+    for cluster in orphaned:
+        shift = 2 * (GRID_BITS - cluster.level)
+        cluster.representative_id = (
+            PointOfInterest.objects
+            .filter(image_id=image_id, cell__gte=cluster.cell << shift, cell__lt=(cluster.cell + 1) << shift)
+            .exclude(id=point_id)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        cluster.save(update_fields=['representative'])
+
+
+def rebuild_clusters(image_id):
+    """
+    Пересчитывает кластеры изображения с нуля (первичное заполнение, массовый
+    импорт, починка). Всё считается в самой БД через INSERT ... SELECT ... GROUP BY:
+    самый мелкий уровень — из точек, каждый следующий — из кластеров предыдущего
+    (ячейка уровня L - 1 — это четыре ячейки уровня L), так что сотни тысяч
+    кластеров не проходят через объекты Python и точки читаются один раз.
+    """
+    clusters_table = connection.ops.quote_name(MarkerCluster._meta.db_table)
+    points_table = connection.ops.quote_name(PointOfInterest._meta.db_table)
+    insert = f'INSERT INTO {clusters_table} (image_id, level, cell, count, sum_x, sum_y, representative_id) '
+    levels = list(cluster_levels())
+    finest = levels[-1]
+    created = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        MarkerCluster.objects.filter(image_id=image_id).delete()
+        # Целочисленное деление: cell и делитель — целые и в SQLite, и в PostgreSQL
+        cursor.execute(
+            insert + f'SELECT image_id, %s, cell / %s, COUNT(*), SUM(x), SUM(y), MIN(id) FROM {points_table} '
+            f'WHERE image_id = %s AND cell IS NOT NULL GROUP BY image_id, cell / %s',
+            [finest, 1 << (2 * (GRID_BITS - finest)), image_id, 1 << (2 * (GRID_BITS - finest))],
+        )
+        created += cursor.rowcount
+        for level in reversed(levels[:-1]):
+            cursor.execute(
+                insert + f'SELECT image_id, %s, cell / 4, SUM(count), SUM(sum_x), SUM(sum_y), MIN(representative_id) '
+                f'FROM {clusters_table} WHERE image_id = %s AND level = %s GROUP BY image_id, cell / 4',
+                [level, image_id, level + 1],
+            )
+            created += cursor.rowcount
+    return created
+
+
+def clusters_in_bbox(image, level, bbox):
+    """Готовые кластеры уровня level, чьи ячейки пересекают нормированный bbox."""
+    shift = 2 * (GRID_BITS - level)
+    ranges = Q()
+    for start, end in bbox_cell_ranges(*bbox):
+        ranges |= Q(image=image, level=level, cell__gte=start >> shift, cell__lte=(end - 1) >> shift)
+    return MarkerCluster.objects.filter(ranges)
@@ -0,0 +1,179 @@
+# app/embeddings.py
+
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .models import Job, SearchableObject
+from .vectors import get_vector_index, normalize
+
+# =====================================================================
+# Конвейер эмбеддингов объектов поиска
+# Эмбеддер (EMBEDDER) превращает тексты в вектора VECTOR_DIMENSIONS:
+# HashingEmbedder — локальный и детерминированный (тесты, разработка),
+# GeminiEmbedder — модель эмбеддингов Gemini. У объекта хранится
+# embedding_hash — хэш текста и эмбеддера, по которым посчитан его
+# вектор в индексе (app/vectors.py). embed_objects пересчитывает только
+# объекты, у которых хэш не совпадает с текущим, пачками по
+# EMBEDDING_BATCH_SIZE и до EMBEDDING_CONCURRENCY пачек одновременно:
+# после правки нескольких описаний в огромном каталоге к модели уходят
+# только они. Сохранения объектов ставят в очередь задачу embed_objects
+# (ее выполняют воркеры manage.py run_workers).
+# =====================================================================
+
+# Объектов, читаемых из базы за один запрос при сверке хэшей
+SCAN_CHUNK_SIZE = 2000
+
+WORD = re.compile(r'\w+')
+
+
+def text_features(text):
+    for word in WORD.findall(text.lower()):
+        yield word
+        padded = f'<{word}>'
+        for start in range(len(padded) - 2):
+            yield padded[start:start + 3]
+
+
+class HashingEmbedder:
+    """
+    Хэширование признаков: слова и их триграммы символов, знак — из старшего бита хэша.
+    Без сети и всегда одинаково; однокоренные слова ("туманность", "туманности")
+    получают близкие вектора за счет общих триграмм.
+    """
+    name = 'hashing-v1'
+
+    def __init__(self, dimensions=None):
+        self.dimensions = dimensions or settings.VECTOR_DIMENSIONS
+
+    def embed(self, texts, query=False):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in text_features(text):
+                value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+                matrix[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return normalize(matrix)
+
+
+class GeminiEmbedder:
+    """Модель эмбеддингов Gemini (EMBEDDING_MODEL, ключ GEMINI_API_KEY); одна пачка — один запрос."""
+
+    def __init__(self):
+        import google.generativeai as genai
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.genai = genai
+        self.dimensions = settings.VECTOR_DIMENSIONS
+        self.name = f'gemini:{settings.EMBEDDING_MODEL}'
+
+    def embed(self, texts, query=False):
+        result = self.genai.embed_content(
+            model=settings.EMBEDDING_MODEL,
+            content=list(texts),
+            task_type='retrieval_query' if query else 'retrieval_document',
+            output_dimensionality=self.dimensions,
+        )
+        return normalize(result['embedding'])
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder():
+    with _embedders_lock:
+        if settings.EMBEDDER not in _embedders:
+            _embedders[settings.EMBEDDER] = import_string(settings.EMBEDDER)()
+        return _embedders[settings.EMBEDDER]
+
+
+def object_text(name, object_type, description):
+    """Текст объекта для эмбеддинга: название, тип и описание."""
+    return '\n'.join(part for part in (name, object_type, description) if part)
+
+
+def content_hash(text, embedder):
+    # Смена эмбеддера или размерности тоже делает вектор устаревшим
+    return hashlib.sha256(f'{embedder.name}:{embedder.dimensions}\n{text}'.encode()).hexdigest()
+
+
+def needs_embedding(obj):
+    return obj.embedding_hash != content_hash(object_text(obj.name, obj.object_type, obj.description), get_embedder())
+
+
+def enqueue_embedding(image):
+    """Ставит задачу embed_objects для объектов изображения, если такая еще не ждет в очереди."""
+    # jobs импортирует этот модуль ради обработчика задачи
+    from .jobs import enqueue_job
+    if not Job.objects.filter(kind='embed_objects', image=image, status='QUEUED').exists():
+        enqueue_job('embed_objects', image=image)
+
+
+def embed_objects(queryset=None, batch_size=None, concurrency=None, force=False, log=print):
+    """
+    Пересчитывает вектора объектов queryset (по умолчанию всех), у которых изменился
+    хэш текста (force — всех). Пачки эмбеддятся в пуле потоков; хэш записывается
+    только после того, как вектор пачки попал в индекс, поэтому прерванный прогон
+    просто доделывается следующим. Возвращает словарь: objects, embedded, skipped, seconds.
+    """
+    embedder = get_embedder()
+    index = get_vector_index()
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    concurrency = concurrency or settings.EMBEDDING_CONCURRENCY
+    queryset = (SearchableObject.objects.all() if queryset is None else queryset).order_by('vector_id')
+    started = time.monotonic()
+    stats = {'objects': 0, 'embedded': 0, 'skipped': 0}
+
+    def embed_batch(batch):
+        # Поток пула не трогает базу: только модель и индекс
+        vectors = embedder.embed([text for vector_id, text, digest in batch])
+        index.upsert(zip([vector_id for vector_id, text, digest in batch], vectors))
+        return batch
+
+    def record(done):
+        for future in done:
+            batch = future.result()
+            SearchableObject.objects.bulk_update(
+                [SearchableObject(vector_id=vector_id, embedding_hash=digest) for vector_id, text, digest in batch],
+                ['embedding_hash'],
+            )
+            stats['embedded'] += len(batch)
+        log(f'Эмбеддинги: {stats["embedded"]} пересчитано, {stats["skipped"]} без изменений')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        running = set()
+        pending = []
+        last_id = None
+        while True:
+            # Постранично по ключу: между чтениями идут записи хэшей, открытого курсора нет
+            chunk = queryset if last_id is None else queryset.filter(vector_id__gt=last_id)
+            rows = list(chunk.values_list('vector_id', 'name', 'object_type', 'description', 'embedding_hash')[
+                :SCAN_CHUNK_SIZE
+            ])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for vector_id, name, object_type, description, stored_hash in rows:
+                stats['objects'] += 1
+                text = object_text(name, object_type, description)
+                digest = content_hash(text, embedder)
+                if digest == stored_hash and not force:
+                    stats['skipped'] += 1
+                    continue
+                pending.append((vector_id, text, digest))
+                if len(pending) >= batch_size:
+                    if len(running) >= concurrency:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        record(done)
+                    running.add(pool.submit(embed_batch, pending))
+                    pending = []
+        if pending:
+            running.add(pool.submit(embed_batch, pending))
+        done, running = wait(running)
+        record(done)
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return stats
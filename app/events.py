@@ -0,0 +1,235 @@
+# app/events.py
+
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.module_loading import import_string
+from .pagination import encode_cursor, keyset_page
+
+# =====================================================================
+# Живые события (Server-Sent Events)
+# Вместо опроса /api/markers/<id>/ клиент держит открытым поток
+# text/event-stream, а сигналы (app/signals.py) после коммита публикуют
+# в него новые сообщения чата (канал marker:<id>) и новые маркеры
+# (канал image:<id>). Публикация идет через брокер: LocalBroker раздает
+# события подписчикам своего процесса, RedisBroker пересылает их через
+# Redis во все процессы и на все машины (EVENTS_BACKEND).
+# Id события — курсор записи (app/pagination.py), поэтому после обрыва
+# браузер переподключается с Last-Event-ID и получает все пропущенное.
+# Потоки асинхронные и требуют ASGI-сервера (uvicorn/daphne app.asgi:application).
+# =====================================================================
+
+# Подписчик не успевает читать: поток закрывается, клиент переподключится и догонит по Last-Event-ID
+OVERFLOW = object()
+
+
+def marker_channel(marker_id):
+    return f'marker:{marker_id}'
+
+
+def image_channel(image_id):
+    return f'image:{image_id}'
+
+
+class LocalBroker:
+    """Подписчики текущего процесса: у каждого своя asyncio.Queue в своем цикле событий."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, event):
+        self.deliver(channel, event)
+
+    def deliver(self, channel, event):
+        # Публикуют синхронные представления из потоков, поэтому в очередь кладем через call_soon_threadsafe
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(offer, queue, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт, подписчик уходит
+                continue
+
+    def disconnect_all(self):
+        """Закрывает потоки всех подписчиков: клиенты переподключатся и догонят по Last-Event-ID."""
+        with self.lock:
+            subscribers = [subscriber for channel in self.subscribers.values() for subscriber in channel]
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(offer, queue, OVERFLOW)
+            except RuntimeError:
+                continue
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.subscribers[channel].add(subscriber)
+        try:
+            yield queue
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+
+def offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # Место под маркер переполнения: освобождаем одно и закрываем поток
+        queue.get_nowait()
+        queue.put_nowait(OVERFLOW)
+
+
+class RedisBroker(LocalBroker):
+    """
+    События всех процессов через Redis pub/sub (EVENTS_REDIS_URL): публикация уходит в Redis,
+    а фоновый поток каждого процесса получает все события и раздает своим подписчикам.
+    """
+    REDIS_CHANNEL = 'app-events'
+    # Пауза перед переподключением к Redis: удваивается при каждой неудаче подряд
+    RECONNECT_DELAY = 0.5
+    RECONNECT_DELAY_MAX = 30
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+        self.listener = None
+
+    def publish(self, channel, event):
+        self.redis.publish(self.REDIS_CHANNEL, json.dumps({'channel': channel, 'event': event}))
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, daemon=True)
+                self.listener.start()
+        return super().subscribe(channel)
+
+    def listen(self):
+        # Поток живет, пока жив процесс: при обрыве связи с Redis переподключается
+        # с растущей паузой. События, опубликованные за время обрыва, потеряны,
+        # поэтому потоки подписчиков закрываются — клиенты догонят по Last-Event-ID
+        delay = self.RECONNECT_DELAY
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                try:
+                    pubsub.subscribe(self.REDIS_CHANNEL)
+                    delay = self.RECONNECT_DELAY
+                    for message in pubsub.listen():
+                        data = json.loads(message['data'])
+                        self.deliver(data['channel'], data['event'])
+                finally:
+                    pubsub.close()
+            except Exception as e:
+                print(f'Подписка на события Redis оборвалась, повтор через {delay} с: {e}')
+            self.disconnect_all()
+            time.sleep(delay)
+            delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BACKEND)()
+        return _broker
+
+
+def publish(channel, event):
+    get_broker().publish(channel, event)
+
+
+# ---------------------------------------------------------------------
+# События: {'id': курсор, 'type': ..., 'data': то же, что отдает REST API}
+# ---------------------------------------------------------------------
+
+def comment_event(comment):
+    from .serializers import ChatMessageSerializer
+    return {'id': encode_cursor(comment), 'type': 'comment', 'data': ChatMessageSerializer(comment).data}
+
+
+def marker_event(point, image):
+    # Поля и нормировка — как в serialize_markers
+    marker = {
+        'id': point.id,
+        'x': point.x / image.width if image.width else None,
+        'y': point.y / image.height if image.height else None,
+        'title': point.name,
+    }
+    return {'id': encode_cursor(point), 'type': 'marker', 'data': marker}
+
+
+def format_event(event):
+    data = json.dumps(event['data'], ensure_ascii=False, separators=(',', ':'), default=str)
+    return f'id: {event["id"]}\nevent: {event["type"]}\ndata: {data}\n\n'
+
+
+async def event_stream(channel, missed_events):
+    """
+    Поток SSE: сначала подписка (чтобы ничего не потерять), затем пропущенное
+    с Last-Event-ID, затем живые события. Раз в EVENTS_KEEPALIVE секунд —
+    комментарий-пинг для прокси; через EVENTS_STREAM_TIMEOUT поток закрывается,
+    и браузер сам переподключается (с Last-Event-ID), так что соединения не копятся.
+    """
+    loop = asyncio.get_running_loop()
+    async with get_broker().subscribe(channel) as queue:
+        yield f'retry: {settings.EVENTS_RETRY_MS}\n\n'
+        sent = set()
+        for event in await sync_to_async(missed_events)():
+            sent.add(event['id'])
+            yield format_event(event)
+        deadline = loop.time() + settings.EVENTS_STREAM_TIMEOUT
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), min(settings.EVENTS_KEEPALIVE, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is OVERFLOW:
+                break
+            # Событие могло прийти и в очередь, и в пропущенные, пока те читались
+            if event['id'] in sent:
+                continue
+            yield format_event(event)
+
+
+def missed_page(queryset, last_event_id, to_event):
+    """Пропущенные после курсора last_event_id записи (не больше страницы чата) в виде событий."""
+    def load():
+        if not last_event_id:
+            return []
+        try:
+            page = keyset_page(queryset, since=last_event_id, limit=settings.CHAT_PAGE_MAX_SIZE)
+        except ValueError:
+            return []
+        return [to_event(obj) for obj in page['items']]
+    return load
+
+
+def sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,230 @@
+# app/fulltext.py
+
+import re
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from .models import Comment, PointOfInterest, SearchableObject, SearchDocument
+
+# =====================================================================
+# Полнотекстовый поиск по маркерам, сообщениям чата и объектам
+# Текст каждой записи хранится документом SearchDocument (название —
+# заголовок, остальное — текст), а инвертированный индекс над ними
+# строит сама база: FTS5 в SQLite (ранжирование BM25), tsvector с
+# GIN-индексом и морфологией 'russian' в PostgreSQL (ts_rank_cd).
+# Документы обновляются сигналами (app/signals.py) в той же транзакции,
+# что и запись, и bulk_import — пачками. Слова запроса ищутся по
+# началу ("туман" найдет "туманность"), все слова обязательны.
+# Ту же выдачу использует поиск в админке (FulltextSearchMixin).
+# =====================================================================
+
+WORD = re.compile(r'\w+')
+# Больше слов в запросе не нужно человеку и только удлиняет разбор индекса
+MAX_QUERY_TERMS = 16
+KINDS = [value for value, label in SearchDocument.KIND_CHOICES]
+
+
+def normalize_text(text):
+    # Токенизатор FTS5 не считает "ё" вариантом "е": приводим и документы, и запрос
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def query_terms(text):
+    """Слова запроса в нижнем регистре; ValueError, если слов нет."""
+    terms = WORD.findall(normalize_text(text).lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        raise ValueError('Запрос не содержит слов.')
+    return terms
+
+
+# ---------------------------------------------------------------------
+# Документы
+# ---------------------------------------------------------------------
+
+def marker_document(point):
+    return SearchDocument(
+        kind='marker', object_id=str(point.id), image_id=point.image_id,
+        title=normalize_text(point.name), body=normalize_text(point.description),
+    )
+
+
+def comment_document(comment):
+    return SearchDocument(
+        kind='comment', object_id=str(comment.id), image_id=comment.point.image_id,
+        title=normalize_text(comment.author_name), body=normalize_text(comment.text),
+    )
+
+
+def object_document(obj):
+    return SearchDocument(
+        kind='object', object_id=str(obj.vector_id), image_id=obj.image_id,
+        title=normalize_text(obj.name), body=normalize_text('\n'.join(filter(None, (obj.object_type, obj.description)))),
+    )
+
+
+DOCUMENT_BUILDERS = {'marker': marker_document, 'comment': comment_document, 'object': object_document}
+
+
+def index_documents(kind, objects):
+    """Добавляет или обновляет документы записей objects одного типа kind (один запрос на пачку)."""
+    documents = [DOCUMENT_BUILDERS[kind](obj) for obj in objects]
+    SearchDocument.objects.bulk_create(
+        documents, update_conflicts=True, unique_fields=['kind', 'object_id'], update_fields=['image', 'title', 'body']
+    )
+
+
+def unindex_documents(kind, object_ids):
+    SearchDocument.objects.filter(kind=kind, object_id__in=[str(object_id) for object_id in object_ids]).delete()
+
+
+def rebuild_documents(image_ids=None, chunk_size=2000):
+    """Пересоздает документы изображений image_ids (по умолчанию всех); возвращает их число."""
+    sources = {
+        'marker': PointOfInterest.objects.only('id', 'image_id', 'name', 'description'),
+        'comment': Comment.objects.select_related('point').only('id', 'author_name', 'text', 'point__image_id'),
+        'object': SearchableObject.objects.only('vector_id', 'image_id', 'name', 'object_type', 'description'),
+    }
+    documents = SearchDocument.objects.all()
+    if image_ids is not None:
+        documents = documents.filter(image_id__in=image_ids)
+        sources['marker'] = sources['marker'].filter(image_id__in=image_ids)
+        sources['comment'] = sources['comment'].filter(point__image_id__in=image_ids)
+        sources['object'] = sources['object'].filter(image_id__in=image_ids)
+    documents.delete()
+    count = 0
+    for kind, queryset in sources.items():
+        batch = []
+        for obj in queryset.order_by().iterator(chunk_size=chunk_size):
+            batch.append(obj)
+            if len(batch) >= chunk_size:
+                index_documents(kind, batch)
+                count += len(batch)
+                batch = []
+        index_documents(kind, batch)
+        count += len(batch)
+    return count
+
+
+# ---------------------------------------------------------------------
+# Поиск: один SQL-запрос, SearchDocument с атрибутом score (больше — лучше)
+# ---------------------------------------------------------------------
+
+class SqliteFulltext:
+    """FTS5 app_fulltext (kind, image_id, title, body) — внешний индекс над app_searchdocument."""
+
+    def search(self, terms, image_id=None, kinds=None, limit=20, offset=0):
+        # Слова — только \w, в кавычках они всегда фраза, а не синтаксис FTS5
+        match = '{title body} : (' + ' '.join(f'"{term}"*' for term in terms) + ')'
+        # Тип и изображение тоже в индексе: их отбирает сам FTS5, поэтому страница
+        # режется до соединения с документами, а не после
+        if kinds:
+            match = 'kind : (' + ' OR '.join(f'"{kind}"' for kind in kinds) + f') AND {match}'
+        if image_id is not None:
+            match = f'image_id : "{int(image_id)}" AND {match}'
+        return SearchDocument.objects.raw(
+            '''
+            SELECT d.id, d.kind, d.object_id, d.image_id, d.title, d.body, found.score
+            FROM (
+                SELECT rowid, -bm25(app_fulltext, 0.0, 0.0, 10.0, 1.0) AS score
+                FROM app_fulltext WHERE app_fulltext MATCH %s
+                ORDER BY score DESC, rowid LIMIT %s OFFSET %s
+            ) found JOIN app_searchdocument d ON d.id = found.rowid
+            ORDER BY found.score DESC, d.id
+            ''',
+            [match, limit, offset],
+        )
+
+
+class PostgresFulltext:
+    """Столбец document (tsvector: заголовок с весом A, текст — B) с GIN-индексом."""
+    CONFIG = 'russian'
+
+    def search(self, terms, image_id=None, kinds=None, limit=20, offset=0):
+        params = [self.CONFIG, ' & '.join(f'{term}:*' for term in terms)]
+        filters = ''
+        if image_id is not None:
+            filters += ' AND d.image_id = %s'
+            params.append(image_id)
+        if kinds:
+            filters += ' AND d.kind = ANY(%s)'
+            params.append(list(kinds))
+        return SearchDocument.objects.raw(
+            f'''
+            SELECT d.id, d.kind, d.object_id, d.image_id, d.title, d.body,
+                   ts_rank_cd(d.document, query) AS score
+            FROM app_searchdocument d, to_tsquery(%s, %s) query
+            WHERE d.document @@ query {filters}
+            ORDER BY score DESC, d.id
+            LIMIT %s OFFSET %s
+            ''',
+            params + [limit, offset],
+        )
+
+
+BACKENDS = {'sqlite': SqliteFulltext, 'postgresql': PostgresFulltext}
+
+
+def get_fulltext():
+    if connection.vendor not in BACKENDS:
+        raise ImproperlyConfigured(f'Полнотекстовый поиск не поддерживает базу {connection.vendor}.')
+    return BACKENDS[connection.vendor]()
+
+
+def search_documents(text, image_id=None, kinds=None, limit=20, offset=0):
+    """
+    Документы, содержащие все слова text (по началу), от лучших к худшим.
+    ValueError — в запросе нет слов или неизвестный тип записи.
+    """
+    terms = query_terms(text)
+    unknown = set(kinds or ()) - set(KINDS)
+    if unknown:
+        raise ValueError(f'type — из {KINDS}.')
+    return list(get_fulltext().search(terms, image_id, kinds, limit, offset))
+
+
+def matching_ids(kind, text, limit=None):
+    """ID записей типа kind, найденных по text (лучшие FULLTEXT_ADMIN_MAX) — для поиска в админке."""
+    documents = search_documents(text, kinds=[kind], limit=limit or settings.FULLTEXT_ADMIN_MAX)
+    return [document.object_id for document in documents]
+
+
+def locate_documents(documents):
+    """
+    Проставляет документам marker_id (маркер или маркер сообщения) и x, y в пикселях —
+    не больше запроса на тип записи. Документы, чьих записей уже нет, отбрасываются.
+    """
+    ids = {kind: [document.object_id for document in documents if document.kind == kind] for kind in KINDS}
+    places = {}
+    if ids['marker']:
+        for point_id, x, y in PointOfInterest.objects.filter(id__in=ids['marker']).values_list('id', 'x', 'y'):
+            places['marker', str(point_id)] = (point_id, x, y)
+    if ids['comment']:
+        comments = Comment.objects.filter(id__in=ids['comment']).values_list('id', 'point_id', 'point__x', 'point__y')
+        for comment_id, point_id, x, y in comments:
+            places['comment', str(comment_id)] = (point_id, x, y)
+    if ids['object']:
+        objects = SearchableObject.objects.filter(vector_id__in=ids['object']).values_list('vector_id', 'x', 'y')
+        for vector_id, x, y in objects:
+            places['object', str(vector_id)] = (None, x, y)
+    located = []
+    for document in documents:
+        place = places.get((document.kind, document.object_id))
+        if place is not None:
+            document.marker_id, document.x, document.y = place
+            located.append(document)
+    return located
+
+
+def snippet(text, terms, words=None):
+    """Фрагмент text длиной до words слов вокруг первого найденного слова запроса."""
+    words = words or settings.FULLTEXT_SNIPPET_WORDS
+    tokens = list(WORD.finditer(text))
+    if len(tokens) <= words:
+        return text
+    first = next(
+        (position for position, token in enumerate(tokens) if token.group().lower().startswith(tuple(terms))), 0
+    )
+    start = max(min(first - words // 4, len(tokens) - words), 0)
+    end = start + words - 1
+    fragment = text[tokens[start].start():tokens[end].end()]
+    return ('…' if start else '') + fragment + ('…' if end < len(tokens) - 1 else '')
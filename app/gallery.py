@@ -0,0 +1,68 @@
+# app/gallery.py
+
+from django.conf import settings
+from .models import Image
+from .pagination import newest_first_page, page_size
+from .response_cache import api_cache
+
+# =====================================================================
+# Галерея страницами
+# /api/gallery/ отдает изображения от новых к старым страницами по
+# курсору (-uploaded_at, id): страница — один запрос по индексу
+# (status, -uploaded_at) на любой глубине архива. Фильтры: ?status=
+# (по умолчанию COMPLETED) и ?name= — начало названия.
+# Общее число изображений — оценка: COUNT(*) считается раз в
+# GALLERY_TOTAL_TTL секунд на набор фильтров и хранится в кэше API,
+# а не пересчитывается на каждой странице.
+# =====================================================================
+
+GALLERY_STATUSES = [value for value, label in Image.STATUS_CHOICES]
+TOTAL_KEY = 'gallery-total:{status}:{name}'
+
+
+def gallery_filters(request):
+    """(status, name) из параметров запроса; ValueError при неизвестном статусе."""
+    status = request.GET.get('status') or 'COMPLETED'
+    if status not in GALLERY_STATUSES:
+        raise ValueError(f'status — одно из {GALLERY_STATUSES}.')
+    return status, request.GET.get('name', '').strip()
+
+
+def gallery_queryset(status, name=''):
+    images = Image.objects.filter(status=status)
+    if name:
+        images = images.filter(name__istartswith=name)
+    return images
+
+
+def gallery_total(status, name=''):
+    """Оценка числа изображений с фильтрами: устаревает не больше чем на GALLERY_TOTAL_TTL секунд."""
+    cache = api_cache()
+    # Название может быть любым: в ключ — его hex, чтобы не упереться в ограничения memcached на символы
+    key = TOTAL_KEY.format(status=status, name=name.encode().hex())
+    total = cache.get(key)
+    if total is None:
+        total = gallery_queryset(status, name).count()
+        cache.set(key, total, timeout=settings.GALLERY_TOTAL_TTL)
+    return total
+
+
+def gallery_page(request):
+    """
+    Страница галереи для запроса: items, next, has_more, total. Считается один раз
+    на запрос — ее же используют ETag (app/versions.py) и представление.
+    ValueError — неверный курсор, limit или фильтр.
+    """
+    if '_gallery_page' not in request.__dict__:
+        status, name = gallery_filters(request)
+        page = newest_first_page(
+            gallery_queryset(status, name).only('id', 'name', 'thumbnail', 'uploaded_at', 'version', 'modified_at'),
+            after=request.GET.get('cursor') or None,
+            limit=page_size(
+                request.GET.get('limit'), settings.GALLERY_PAGE_SIZE, settings.GALLERY_PAGE_MAX_SIZE
+            ),
+            field='uploaded_at',
+        )
+        page['total'] = gallery_total(status, name)
+        request.__dict__['_gallery_page'] = page
+    return request.__dict__['_gallery_page']
@@ -0,0 +1,230 @@
+# app/jobs.py
+
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from .embeddings import embed_objects
+from .models import Image, Job, SearchableObject
+from .tiling import tile_region
+from .versions import version_bump
+
+
+# =====================================================================
+# Постановка задач в очередь
+# =====================================================================
+def enqueue_job(kind, image=None, payload=None, max_attempts=None):
+    """Создает задачу в очереди. Ее подхватит первый свободный воркер."""
+    return Job.objects.create(
+        kind=kind,
+        image=image,
+        payload=payload or {},
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повтором: base, 2*base, 4*base... (не больше максимума)."""
+    delay = settings.JOB_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    return min(delay, settings.JOB_RETRY_BACKOFF_MAX)
+
+
+# =====================================================================
+# Обработчики задач по типам
+# Обработчик получает задачу и бросает исключение, если она не удалась.
+# =====================================================================
+def handle_process_image(job):
+    # Та же логика, что и у `manage.py process_image`, но в уже запущенном процессе:
+    # Django, sentry и pyvips не инициализируются заново для каждой задачи.
+    # Повторная попытка продолжает нарезку с контрольной точки, а не с нуля.
+    options = dict(job.payload)
+    if job.attempts > 1:
+        options.setdefault('resume', True)
+    call_command('process_image', job.image_id, **options)
+
+
+def handle_tile_region(job):
+    # Одна область распределенной нарезки (см. process_image --distributed).
+    # Итог пишется в payload: по нему координатор считает прогресс
+    payload = job.payload
+    tiles, written_bytes = tile_region(
+        job.image.source_file.path, payload['output_prefix'], payload['region'], **payload['dz_options']
+    )
+    Job.objects.filter(id=job.id).update(payload={**payload, 'tiles': tiles, 'bytes': written_bytes})
+
+
+def handle_embed_objects(job):
+    # Вектора объектов изображения (или всех объектов, если изображение не задано), у которых
+    # изменился текст; повтор после сбоя пересчитывает только то, что не успело попасть в индекс
+    objects = SearchableObject.objects.all()
+    if job.image_id:
+        objects = objects.filter(image_id=job.image_id)
+    options = {key: job.payload[key] for key in ('batch_size', 'concurrency', 'force') if key in job.payload}
+    stats = embed_objects(objects, log=lambda message: None, **options)
+    Job.objects.filter(id=job.id).update(payload={**job.payload, 'stats': stats})
+
+
+JOB_HANDLERS = {
+    'process_image': handle_process_image,
+    'tile_region': handle_tile_region,
+    'embed_objects': handle_embed_objects,
+}
+
+
+# =====================================================================
+# Разбор очереди воркерами
+# =====================================================================
+def requeue_stale_jobs():
+    """
+    Возвращает в очередь задачи, воркер которых перестал подавать сигналы
+    (процесс убит, сервер перезагружен). Это такая же неудачная попытка, как
+    исключение в обработчике: повтор — с той же задержкой, а задача, исчерпавшая
+    попытки (например, раз за разом убиваемая OOM), проваливается окончательно.
+    Возвращает число возвращенных в очередь задач.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status='RUNNING', heartbeat_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    requeued = 0
+    for job in stale.only('id', 'kind', 'image_id', 'attempts', 'max_attempts'):
+        error = f'Воркер перестал подавать сигналы (попытка {job.attempts}/{job.max_attempts})'
+        # Условие на статус и heartbeat — задачу могли уже вернуть или она ожила
+        current = stale.filter(id=job.id)
+        if job.attempts < job.max_attempts:
+            if current.update(status='QUEUED', worker='', last_error=error,
+                              run_after=now + timedelta(seconds=retry_delay(job.attempts))):
+                requeued += 1
+        elif current.update(status='FAILED', last_error=error, finished_at=now):
+            if job.kind == 'process_image' and job.image_id:
+                Image.objects.filter(id=job.image_id).update(status='FAILED', **version_bump())
+            print(f'Задача #{job.id} окончательно провалена после {job.attempts} попыток: {error}')
+    return requeued
+
+
+def claim_next_job(worker_id, **filters):
+    """
+    Забирает следующую готовую к запуску задачу (filters — дополнительные условия отбора).
+    Захват делается условным UPDATE, поэтому одну задачу не возьмут два воркера
+    даже на SQLite, где нет SELECT ... FOR UPDATE.
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(status='QUEUED', run_after__lte=now, **filters)
+        .order_by('run_after', 'id')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = Job.objects.filter(id=job_id, status='QUEUED').update(
+            status='RUNNING',
+            worker=worker_id,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+class Heartbeat:
+    """Фоновый поток, который периодически отмечает, что задача еще выполняется."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                Job.objects.filter(id=self.job_id, status='RUNNING').update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(job):
+    """Выполняет задачу и фиксирует результат: готово, повтор с задержкой или окончательная ошибка."""
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f'Неизвестный тип задачи: {job.kind}')
+        with Heartbeat(job.id):
+            handler(job)
+    except Exception as e:
+        error = f'{e}\n{traceback.format_exc()}'
+        if job.attempts < job.max_attempts:
+            delay = retry_delay(job.attempts)
+            Job.objects.filter(id=job.id).update(
+                status='QUEUED',
+                worker='',
+                last_error=error,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+            if job.kind == 'process_image' and job.image_id:
+                Image.objects.filter(id=job.image_id).update(status='PENDING', **version_bump())
+            print(f'Задача #{job.id} упала (попытка {job.attempts}/{job.max_attempts}), повтор через {delay} с: {e}')
+        else:
+            Job.objects.filter(id=job.id).update(status='FAILED', last_error=error, finished_at=timezone.now())
+            if job.kind == 'process_image' and job.image_id:
+                Image.objects.filter(id=job.image_id).update(status='FAILED', **version_bump())
+            print(f'Задача #{job.id} окончательно провалена после {job.attempts} попыток: {e}')
+        return False
+
+    Job.objects.filter(id=job.id).update(status='DONE', last_error='', finished_at=timezone.now())
+    return True
+
+
+def wait_for_jobs(job_ids, worker_id, on_done=None, poll_interval=None):
+    """
+    Ждет выполнения задач job_ids; on_done(job) вызывается для каждой готовой.
+    Ожидающий не простаивает: пока среди них есть задачи в очереди, выполняет их сам,
+    поэтому работа не встанет, даже если других свободных воркеров нет.
+    Бросает исключение, если какая-то задача провалилась окончательно.
+    """
+    poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+    pending = set(job_ids)
+    while pending:
+        requeue_stale_jobs()
+        job = claim_next_job(worker_id, id__in=pending)
+        if job is not None:
+            run_job(job)
+        for finished in Job.objects.filter(id__in=pending, status__in=['DONE', 'FAILED']):
+            if finished.status == 'FAILED':
+                raise RuntimeError(f'Задача #{finished.id} ({finished.kind}) провалена: {finished.last_error}')
+            pending.discard(finished.id)
+            if on_done:
+                on_done(finished)
+        if pending and job is None:
+            time.sleep(poll_interval)
+
+
+def make_worker_id(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def worker_loop(worker_id, stop_event=None, poll_interval=None):
+    """Основной цикл долгоживущего воркера: берет задачи одну за другой, пока не попросят остановиться."""
+    poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+    print(f'Воркер {worker_id} запущен.')
+    while not (stop_event and stop_event.is_set()):
+        requeue_stale_jobs()
+        job = claim_next_job(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print(f'Воркер {worker_id} взял задачу #{job.id} ({job.kind}), попытка {job.attempts}.')
+        run_job(job)
+    print(f'Воркер {worker_id} остановлен.')
@@ -0,0 +1,81 @@
+# app/management/commands/benchmark_markers.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from app.models import Image, PointOfInterest
+from app.fast_json import render_markers
+from app.serializers import MarkerSerializer, serialize_markers
+
+# =====================================================================
+# Микробенчмарк сериализации маркеров
+# Сравнивает MarkerSerializer(many=True) + JSONRenderer с быстрым путем
+# serialize_markers + render_markers (как в MarkerViewportView) на синтетических
+# точках: выборка из БД, сериализация и рендеринг JSON; ответы должны совпасть.
+# Все создается внутри транзакции, которая в конце откатывается.
+# =====================================================================
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает MarkerSerializer и быстрый путь serialize_markers/render_markers на 1k/10k/100k маркеров.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Числа маркеров через запятую')
+        parser.add_argument('--repeat', type=int, default=3, help='Сколько раз повторить замер (берется лучший)')
+
+    def handle(self, *args, **options):
+        sizes = [int(value) for value in options['sizes'].split(',')]
+        renderer = JSONRenderer()
+        with transaction.atomic():
+            image = Image.objects.create(name=f'benchmark-markers-{time.time_ns()}', width=123_457, height=98_765)
+            created = 0
+            for size in sizes:
+                # Добавляем точки до нужного числа; координаты — псевдослучайные, имена с кириллицей
+                PointOfInterest.objects.bulk_create(
+                    [
+                        PointOfInterest(
+                            image=image, x=(i * 7919) % image.width, y=(i * 104729) % image.height,
+                            name=f'Точка {i}'
+                        )
+                        for i in range(created, size)
+                    ],
+                    batch_size=5000,
+                )
+                created = max(created, size)
+                # Не через image.points: менеджер связи читает image_id у каждой точки, а .only() его откладывает
+                points = PointOfInterest.objects.filter(image=image)[:size]
+                context = {'image_width': image.width, 'image_height': image.height}
+
+                old_time, old_bytes = best_time(
+                    lambda: renderer.render({
+                        'markers': MarkerSerializer(points.only('id', 'x', 'y', 'name'), many=True, context=context).data,
+                        'truncated': False,
+                    }),
+                    options['repeat'],
+                )
+                new_time, new_bytes = best_time(
+                    lambda: render_markers({
+                        'markers': serialize_markers(points, image.width, image.height),
+                        'truncated': False,
+                    }),
+                    options['repeat'],
+                )
+                if old_bytes != new_bytes:
+                    raise CommandError(f'{size} маркеров: ответы быстрого и прежнего пути различаются')
+                self.stdout.write(
+                    f'{size} маркеров: MarkerSerializer {old_time * 1000:.1f} мс, '
+                    f'быстрый путь {new_time * 1000:.1f} мс, ускорение x{old_time / new_time:.1f}, '
+                    f'{len(new_bytes) / 1024:.0f} КБ JSON (совпадает)'
+                )
+            transaction.set_rollback(True)
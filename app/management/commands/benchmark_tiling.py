@@ -0,0 +1,247 @@
+# app/management/commands/benchmark_tiling.py
+
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# =====================================================================
+# Бенчмарк нарезки на синтетических TIFF
+# Генерирует набор файлов (размеры, 8/16 бит, тайловые/полосовые,
+# пирамидальные/плоские), режет каждый выбранными путями нарезки
+# в отдельном процессе и пишет результаты в JSON. С --compare сравнивает
+# с прошлым прогоном и падает, если что-то заметно замедлилось.
+# =====================================================================
+
+BENCHMARK_MODES = ['auto', 'stream', 'copy', 'checkpointed']
+
+
+def directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def make_synthetic_tiff(path, size, bits, layout, pyramid):
+    """
+    Тестовое изображение: плавный градиент с шумом и фигурами, чтобы JPEG-тайлы
+    имели реалистичный размер (чистый шум и однотонная заливка дают крайности).
+    """
+    import pyvips
+    x = pyvips.Image.xyz(size, size)
+    gradient = (x[0] + x[1]) * (255 / (2 * size))
+    noise = pyvips.Image.gaussnoise(size, size, sigma=12)
+    image = (gradient + noise).bandjoin([255 - gradient + noise, gradient * 0.5 + noise])
+    scale = 257 if bits == 16 else 1
+    image = (image * scale).cast('ushort' if bits == 16 else 'uchar')
+    for i in range(1, 6):
+        ink = [40 * i * scale, (255 - 40 * i) * scale, 128 * scale]
+        image = image.draw_circle(ink, size * i // 7, size * i // 7, size // (4 * i), fill=True)
+    options = {'compression': 'lzw'}
+    if layout == 'tiled':
+        options.update(tile=True, tile_width=256, tile_height=256)
+    if pyramid:
+        options.update(pyramid=True, subifd=False)
+    image.tiffsave(path, **options)
+
+
+def run_case(source_path, mode, work_dir, connection):
+    """Выполняется в отдельном процессе: одна нарезка, замер времени, памяти и диска."""
+    import django
+    django.setup()
+    from app.tiling import count_tiles, peak_rss_mb, tile_resumable, tile_source
+    import pyvips
+
+    output_dir = os.path.join(work_dir, 'out')
+    scratch_dir = os.path.join(work_dir, 'scratch')
+    os.makedirs(output_dir)
+    os.makedirs(scratch_dir)
+    settings.TILING_SCRATCH_DIR = scratch_dir
+    output_prefix = os.path.join(output_dir, 'image')
+
+    # Временные файлы живут недолго, поэтому пик занятого места ловим опросом в фоне
+    peak_scratch = 0
+    stop = threading.Event()
+
+    def watch_scratch():
+        nonlocal peak_scratch
+        while not stop.wait(0.2):
+            used = directory_size(scratch_dir) + directory_size(f'{output_prefix}_partial')
+            peak_scratch = max(peak_scratch, used)
+
+    watcher = threading.Thread(target=watch_scratch, daemon=True)
+    watcher.start()
+    header = pyvips.Image.new_from_file(source_path)
+    started = time.monotonic()
+    try:
+        if mode == 'checkpointed':
+            tile_resumable(source_path, output_prefix, log=lambda message: None, suffix='.jpeg')
+            used = mode
+        else:
+            stats = tile_source(source_path, output_prefix, mode=mode, log=lambda message: None, suffix='.jpeg')
+            used = stats['mode']
+        wall_time = time.monotonic() - started
+    except Exception as e:
+        connection.send({'error': str(e)})
+        return
+    finally:
+        stop.set()
+        watcher.join()
+
+    tiles = count_tiles(header.width, header.height)
+    connection.send({
+        'path': used,
+        'wall_time': round(wall_time, 3),
+        'tiles': tiles,
+        'tiles_per_second': round(tiles / wall_time, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'peak_scratch_bytes': peak_scratch,
+        'output_bytes': directory_size(output_dir),
+    })
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк нарезки на синтетических TIFF: время, тайлы/с, пиковый RSS, временный диск, размер результата.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2048,8192', help='Стороны тестовых изображений через запятую')
+        parser.add_argument('--bits', default='8,16', help='Разрядность: 8 и/или 16')
+        parser.add_argument('--layouts', default='tiled,striped', help='Раскладка TIFF: tiled и/или striped')
+        parser.add_argument('--pyramids', default='flat,pyramid', help='flat и/или pyramid (только для tiled)')
+        parser.add_argument(
+            '--modes', default='auto',
+            help=f'Пути нарезки через запятую: {", ".join(BENCHMARK_MODES)}'
+        )
+        parser.add_argument('--repeat', type=int, default=1, help='Сколько раз повторить каждый случай (берется лучший)')
+        parser.add_argument('--work-dir', default=None, help='Каталог для тестовых файлов (по умолчанию временный)')
+        parser.add_argument('--output', default=None, help='Куда записать JSON с результатами')
+        parser.add_argument('--compare', default=None, help='JSON прошлого прогона для сравнения')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0,
+            help='Замедление (в процентах) относительно --compare, которое считается регрессией'
+        )
+
+    def handle(self, *args, **options):
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(BENCHMARK_MODES)
+        if unknown:
+            raise CommandError(f'Неизвестные пути нарезки: {", ".join(sorted(unknown))}')
+
+        cases = []
+        for size in (int(value) for value in options['sizes'].split(',')):
+            for bits in (int(value) for value in options['bits'].split(',')):
+                for layout in options['layouts'].split(','):
+                    for pyramid in options['pyramids'].split(','):
+                        # Пирамида в TIFF бывает только у тайлового файла
+                        if pyramid == 'pyramid' and layout != 'tiled':
+                            continue
+                        cases.append({'size': size, 'bits': bits, 'layout': layout, 'pyramid': pyramid == 'pyramid'})
+
+        work_dir = options['work_dir'] or tempfile.mkdtemp(prefix='tiling_benchmark_')
+        os.makedirs(work_dir, exist_ok=True)
+        context = multiprocessing.get_context('spawn')
+        results = []
+        try:
+            for case in cases:
+                name = f'{case["size"]}px_{case["bits"]}bit_{case["layout"]}_{"pyramid" if case["pyramid"] else "flat"}'
+                source_path = os.path.join(work_dir, f'{name}.tif')
+                if not os.path.exists(source_path):
+                    self.stdout.write(f'Генерирую {source_path}')
+                    make_synthetic_tiff(source_path, **case)
+                for mode in modes:
+                    runs = []
+                    for attempt in range(options['repeat']):
+                        run_dir = tempfile.mkdtemp(prefix='run_', dir=work_dir)
+                        try:
+                            # Отдельный процесс: пиковый RSS и кэши libvips не тянутся от прошлых случаев
+                            receiver, sender = context.Pipe(duplex=False)
+                            process = context.Process(target=run_case, args=(source_path, mode, run_dir, sender))
+                            process.start()
+                            sender.close()
+                            metrics = receiver.recv()
+                            process.join()
+                        except EOFError:
+                            metrics = {'error': f'процесс завершился с кодом {process.exitcode}'}
+                        finally:
+                            shutil.rmtree(run_dir, ignore_errors=True)
+                        runs.append(metrics)
+                    ok_runs = [run for run in runs if 'error' not in run]
+                    metrics = min(ok_runs, key=lambda run: run['wall_time']) if ok_runs else runs[0]
+                    result = {'case': name, 'mode': mode, 'source_bytes': os.path.getsize(source_path), **case, **metrics}
+                    results.append(result)
+                    self.report(result)
+        finally:
+            if not options['work_dir']:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        document = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'environment': self.environment(),
+            'results': results,
+        }
+        output = options['output'] or f'tiling_benchmark_{datetime.now():%Y%m%d_%H%M%S}.json'
+        with open(output, 'w') as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f'Результаты записаны в {output}'))
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def report(self, result):
+        if 'error' in result:
+            self.stdout.write(self.style.ERROR(f'{result["case"]} [{result["mode"]}]: ошибка — {result["error"]}'))
+            return
+        self.stdout.write(
+            f'{result["case"]} [{result["mode"]} -> {result["path"]}]: {result["wall_time"]:.2f} с, '
+            f'{result["tiles_per_second"]:.0f} тайлов/с, RSS {result["peak_rss_mb"]:.0f} МБ, '
+            f'временный диск {result["peak_scratch_bytes"] / 1024 / 1024:.0f} МБ, '
+            f'результат {result["output_bytes"] / 1024 / 1024:.1f} МБ'
+        )
+
+    def environment(self):
+        import pyvips
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True
+            ).stdout.strip()
+        except OSError:
+            commit = ''
+        return {
+            'host': platform.node(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'libvips': f'{pyvips.version(0)}.{pyvips.version(1)}.{pyvips.version(2)}',
+            'git_commit': commit,
+        }
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = {(result['case'], result['mode']): result for result in json.load(f)['results']}
+        regressions = []
+        for result in results:
+            previous = baseline.get((result['case'], result['mode']))
+            if not previous or 'error' in previous or 'error' in result:
+                continue
+            change = (result['wall_time'] / previous['wall_time'] - 1) * 100
+            rss_change = (result['peak_rss_mb'] / previous['peak_rss_mb'] - 1) * 100
+            line = f'{result["case"]} [{result["mode"]}]: время {change:+.1f}%, RSS {rss_change:+.1f}%'
+            if change > threshold or rss_change > threshold:
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Регрессий относительно {baseline_path}: {len(regressions)}')
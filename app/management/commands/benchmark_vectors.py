@@ -0,0 +1,76 @@
+# app/management/commands/benchmark_vectors.py
+
+import tempfile
+import time
+import uuid
+import numpy as np
+from django.core.management.base import BaseCommand
+from app.vectors import LocalVectorIndex
+
+# =====================================================================
+# Бенчмарк локального векторного индекса
+# Синтетический каталог — смесь гауссовых облаков (как тематические
+# группы описаний) — загружается пачками в LocalVectorIndex во временном
+# каталоге. Для запросов (зашумленных векторов каталога) сравниваются
+# точный перебор и IVF с разным nprobe: полнота top-k относительно
+# точного ответа и задержка поиска (медиана и 95-й процентиль).
+# =====================================================================
+
+
+def latencies(search, queries):
+    times = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        times.append(time.perf_counter() - started)
+    times = np.array(times) * 1000
+    return results, np.percentile(times, 50), np.percentile(times, 95)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает точный поиск и IVF локального векторного индекса: полнота top-k и задержка.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200_000, help='Векторов в каталоге')
+        parser.add_argument('--dimensions', type=int, default=256)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--lists', type=int, help='Списков IVF (по умолчанию — корень из size)')
+        parser.add_argument('--nprobe', default='1,4,8,16,32', help='Значения nprobe через запятую')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Векторов в одном upsert')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        size, dimensions, k = options['size'], options['dimensions'], options['k']
+        groups = max(1, size // 500)
+        centers = rng.standard_normal((groups, dimensions)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as path:
+            index = LocalVectorIndex(path, dimensions)
+            started = time.monotonic()
+            for start in range(0, size, options['batch_size']):
+                count = min(options['batch_size'], size - start)
+                vectors = centers[rng.integers(groups, size=count)] + 0.6 * rng.standard_normal((count, dimensions))
+                index.upsert(zip([uuid.uuid4() for _ in range(count)], vectors))
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Загрузка {size} векторов: {elapsed:.1f} с ({size / elapsed:.0f} векторов/с)')
+
+            state = index.refresh()
+            picks = rng.integers(size, size=options['queries'])
+            queries = np.asarray(state['vectors'][picks]) + 0.3 * rng.standard_normal((len(picks), dimensions))
+            exact, p50, p95 = latencies(lambda query: index.search(query, k, exact=True), queries)
+            self.stdout.write(f'Точный поиск: медиана {p50:.2f} мс, p95 {p95:.2f} мс')
+
+            started = time.monotonic()
+            lists = index.train(lists=options['lists'])
+            self.stdout.write(f'Обучение IVF: {lists} списков за {time.monotonic() - started:.1f} с')
+            truth = [{vector_id for vector_id, score in result} for result in exact]
+            for nprobe in [int(value) for value in options['nprobe'].split(',')]:
+                approximate, p50, p95 = latencies(lambda query: index.search(query, k, nprobe=nprobe), queries)
+                recall = np.mean([
+                    len(expected & {vector_id for vector_id, score in result}) / len(expected)
+                    for expected, result in zip(truth, approximate)
+                ])
+                self.stdout.write(
+                    f'IVF nprobe={nprobe}: полнота@{k} {recall:.3f}, медиана {p50:.2f} мс, p95 {p95:.2f} мс'
+                )
@@ -0,0 +1,48 @@
+# app/management/commands/bulk_import.py
+
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.bulk_import import COORDINATE_MODES, IMPORT_FORMATS, IMPORT_KINDS, format_for, import_rows, text_stream
+from app.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт маркеров или объектов поиска из CSV/NDJSON в изображение.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_id', type=int, help='ID изображения')
+        parser.add_argument('path', help='Файл CSV/NDJSON ("-" — стандартный ввод)')
+        parser.add_argument('--kind', choices=IMPORT_KINDS, default='markers', help='Что импортировать')
+        parser.add_argument(
+            '--coords', choices=COORDINATE_MODES, default='pixel',
+            help='Координаты в пикселях изображения или нормированные 0..1'
+        )
+        parser.add_argument('--format', choices=IMPORT_FORMATS, default=None, help='По умолчанию — по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=None, help='Строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        try:
+            image = Image.objects.get(id=options['image_id'])
+        except Image.DoesNotExist:
+            raise CommandError(f'Изображение {options["image_id"]} не найдено')
+
+        path = options['path']
+        fmt = options['format'] or format_for(path)
+        binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            stats = import_rows(
+                image, text_stream(binary), kind=options['kind'], fmt=fmt, coords=options['coords'],
+                batch_size=options['batch_size'], log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if binary is not sys.stdin.buffer:
+                binary.close()
+
+        for error in stats['errors']:
+            self.stdout.write(self.style.WARNING(f'Строка {error["line"]}: {error["error"]}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {stats["created"]} из {stats["rows"]} строк за {stats["seconds"]:.1f} с '
+            f'({stats["rows_per_second"] or 0:.0f} строк/с), пропущено {stats["invalid"]}.'
+        ))
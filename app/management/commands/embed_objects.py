@@ -0,0 +1,32 @@
+# app/management/commands/embed_objects.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.embeddings import embed_objects
+from app.models import SearchableObject
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает эмбеддинги объектов поиска, у которых изменился текст (или все с --force).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_ids', nargs='*', type=int, help='ID изображений (по умолчанию все объекты)')
+        parser.add_argument('--batch-size', type=int, help='Текстов в одном запросе к эмбеддеру (EMBEDDING_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, help='Пачек одновременно (EMBEDDING_CONCURRENCY)')
+        parser.add_argument('--force', action='store_true', help='Пересчитать все, не сверяя хэши')
+
+    def handle(self, *args, **options):
+        objects = SearchableObject.objects.all()
+        if options['image_ids']:
+            objects = objects.filter(image_id__in=options['image_ids'])
+        stats = embed_objects(
+            objects,
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            force=options['force'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Объектов: {stats["objects"]}, пересчитано: {stats["embedded"]}, '
+            f'без изменений: {stats["skipped"]} ({settings.EMBEDDER}, {stats["seconds"]} с).'
+        ))
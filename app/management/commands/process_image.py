@@ -3,16 +3,45 @@
 import os
 import pyvips
 import math
-import tempfile
-from django.core.management.base import BaseCommand
+import time
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from app.models import Image
+from app.jobs import enqueue_job, make_worker_id, wait_for_jobs
+from app.models import Image, Job
+from app.progress import EMPTY_PROGRESS, PROGRESS_FIELDS, ProgressRecorder, save_progress
+from app.tile_dedup import dedup_tile_tree
+from app.tile_pack import build_pack_index, dedup_pack, pack_path_for
+from app.tiling import (
+    TILING_MODES, TilingProgress, clear_tiles, count_tile_files, count_tiles, make_thumbnail, output_bytes_probe,
+    merge_regions, peak_rss_mb, tiff_pyramid_levels, tile_options, tile_resumable, tile_source, tiling_regions
+)
 
 class Command(BaseCommand):
-    help = 'Нарезает исходное изображение на тайлы, создавая промежуточный файл для стабильности.'
+    help = 'Нарезает исходное изображение на тайлы (потоково или через промежуточный файл .v).'
 
     def add_arguments(self, parser):
         parser.add_argument('image_id', type=int, help='ID объекта Image в базе данных')
+        parser.add_argument(
+            '--mode', choices=TILING_MODES, default=settings.TILING_MODE,
+            help='stream — за один проход без копии, copy — через временный файл .v, auto — stream с откатом на copy'
+        )
+        parser.add_argument(
+            '--no-reuse-pyramid', dest='reuse_pyramid', action='store_false', default=settings.TILING_REUSE_PYRAMID,
+            help='Не использовать готовые обзоры пирамидального TIFF, считать все уровни из полного разрешения'
+        )
+        parser.add_argument(
+            '--distributed', action='store_true',
+            help='Разделить верхний уровень на области и раздать их воркерам очереди (run_workers)'
+        )
+        parser.add_argument(
+            '--region-tiles', type=int, default=settings.TILING_REGION_TILES,
+            help='Сторона области распределенной нарезки, в тайлах'
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить прерванную нарезку с контрольной точки (уже записанные и целые тайлы пропускаются)'
+        )
 
     def handle(self, *args, **options):
         image_id = options['image_id']
@@ -28,9 +57,9 @@ class Command(BaseCommand):
         self.stdout.write(self.style.WARNING(f'Статус изображения "{image_instance.name}" изменен на PROCESSING.'))
 
         source_path = image_instance.source_file.path
-        temp_vips_file = None
 
         try:
+            # Читаем только заголовок: пиксели декодируются позже, при нарезке
             image = pyvips.Image.new_from_file(source_path)
 
             image_width = image.width
@@ -42,8 +71,7 @@ class Command(BaseCommand):
             os.makedirs(thumbnail_dir, exist_ok=True)
             thumbnail_filename = f'image_{image_instance.id}_thumb.jpeg'
             thumbnail_path = os.path.join(thumbnail_dir, thumbnail_filename)
-            thumbnail_image = image.thumbnail_image(512, height=512, crop='centre')
-            thumbnail_image.write_to_file(thumbnail_path)
+            make_thumbnail(source_path, thumbnail_path)
             image_instance.thumbnail = os.path.join('thumbnails', thumbnail_filename)
             self.stdout.write(self.style.SUCCESS(f'Превью сохранено в {thumbnail_path}'))
 
@@ -52,33 +80,110 @@ class Command(BaseCommand):
             max_zoom_level = math.ceil(math.log2(max_dimension / 256))
             self.stdout.write(self.style.SUCCESS(f'Размеры: {image_width}x{image_height}. Макс. зум: {max_zoom_level}'))
 
-            # --- "Нормализация" изображения ---
-            fd, temp_vips_file = tempfile.mkstemp(suffix='.v')
-            os.close(fd)
-            self.stdout.write(f'Создаю временный файл для нормализации: {temp_vips_file}')
-            image.write_to_file(temp_vips_file)
-            image = pyvips.Image.new_from_file(temp_vips_file)
-
-            # =================================================================
-            # --- ИСПРАВЛЕНИЕ ЗДЕСЬ: Нарезка на тайлы с правильным путем ---
-            # =================================================================
-            # 1. Создаем целевую директорию
-            output_dir = os.path.join(settings.MEDIA_ROOT, 'tiles', f'image_{image_instance.id}')
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # 2. Создаем ПОЛНЫЙ ПУТЬ-ПРЕФИКС для dzsave
-            # Например: /path/to/media/tiles/image_11/image_11
-            output_path_prefix = os.path.join(output_dir, f'image_{image_instance.id}')
+            if image_instance.tile_storage == 'dynamic':
+                # Тайлы будет рендерить DziView по запросу, заранее ничего не нарезаем
+                self.stdout.write('Хранение "по запросу": нарезка пропущена.')
+            else:
+                # =================================================================
+                # --- Нарезка на тайлы ---
+                # =================================================================
+                # 1. Создаем ПОЛНЫЙ ПУТЬ-ПРЕФИКС для dzsave
+                # Например: /path/to/media/tiles/image_11/image_11
+                # Для упакованного хранения dzsave пишет один архив: /path/to/media/tiles/image_11.zip
+                packed = image_instance.tile_storage == 'pack'
+                if packed:
+                    output_path_prefix = pack_path_for(image_instance.id)
+                    output_dir = os.path.dirname(output_path_prefix)
+                else:
+                    output_dir = os.path.join(settings.MEDIA_ROOT, 'tiles', f'image_{image_instance.id}')
+                    output_path_prefix = os.path.join(output_dir, f'image_{image_instance.id}')
+
+                # 2. Создаем целевую директорию
+                os.makedirs(output_dir, exist_ok=True)
             
-            self.stdout.write(f'Начинаю нарезку на тайлы с префиксом: {output_path_prefix}')
+                self.stdout.write(f'Начинаю нарезку на тайлы с префиксом: {output_path_prefix}')
+                # Формат и качество тайлов, пропуск пустых — настройки конкретного изображения
+                dz_options = tile_options(
+                    image_instance.tile_format, image_instance.tile_quality, image_instance.skip_blank_tiles
+                )
             
-            # 3. Вызываем dzsave с этим префиксом и УБИРАЕМ `basename`
-            image.dzsave(
-                output_path_prefix,
-                suffix='.jpeg'
-            )
-            self.stdout.write(self.style.SUCCESS('Нарезка на тайлы завершена.'))
-            # =================================================================
+                # 3. Огромные изображения режем распределенно: области раздаются воркерам очереди.
+                # Большие — полосами с контрольными точками, чтобы после падения продолжить
+                # с места остановки. Остальные — потоково или через копию .v
+                pixels = image_width * image_height
+                distributed = not packed and (
+                    options['distributed']
+                    or 0 < settings.TILING_DISTRIBUTED_MIN_PIXELS <= pixels
+                    or 'region_jobs' in image_instance.tiling_checkpoint and options['resume']
+                )
+                # --resume сам по себе полосную нарезку не включает: она продолжается, только
+                # если прошлая попытка успела оставить контрольную точку полос
+                checkpointed = not packed and not distributed and (
+                    pixels >= settings.TILING_CHECKPOINT_MIN_PIXELS
+                    or options['resume'] and 'rows_done' in image_instance.tiling_checkpoint
+                )
+                # Ход нарезки (процент, тайлы/с, ETA) периодически пишется в Image, его видно в админке
+                # и в /api/images/<id>/status/. Полосная нарезка считает тайлы и байты точно,
+                # для dzsave процент берется из сигнала eval libvips, а байты — приблизительно
+                total_tiles = count_tiles(image_width, image_height)
+                if checkpointed or distributed:
+                    progress = TilingProgress(total_tiles)
+                else:
+                    save_progress(image_instance.id, EMPTY_PROGRESS)
+                    progress = TilingProgress(total_tiles, bytes_probe=output_bytes_probe(output_path_prefix))
+                with ProgressRecorder(image_instance.id, progress):
+                    if distributed:
+                        stats = self.tile_distributed(
+                            image_instance, source_path, output_path_prefix, (image_width, image_height),
+                            options, progress, dz_options
+                        )
+                    elif checkpointed:
+                        stats = self.tile_with_checkpoints(
+                            image_instance, source_path, output_path_prefix, options, progress, dz_options
+                        )
+                    else:
+                        # Старые тайлы могут быть жесткими ссылками на общие файлы дедупликации:
+                        # dzsave писал бы прямо в них и портил тайлы других изображений
+                        clear_tiles(output_path_prefix)
+                        stats = tile_source(
+                            source_path,
+                            output_path_prefix,
+                            mode=options['mode'],
+                            reuse_pyramid=options['reuse_pyramid'],
+                            log=self.stdout.write,
+                            progress=progress,
+                            **dz_options
+                        )
+                    progress.finish()
+                self.stdout.write(self.style.SUCCESS(
+                    f'Нарезка на тайлы завершена (режим {stats["mode"]}): '
+                    f'{stats["wall_time"]:.1f} с, пиковый RSS {stats["peak_rss_mb"]:.0f} МБ.'
+                ))
+
+                # 4. Дедупликация: одинаковые тайлы хранятся один раз. Каталоги тайлов ссылаются
+                # на общее хранилище (в том числе между изображениями), архив — только внутри себя
+                tiles_deduped = 0
+                if image_instance.dedup_tiles:
+                    if packed:
+                        tiles_deduped = dedup_pack(output_path_prefix)
+                    else:
+                        tiles_deduped = dedup_tile_tree(f'{output_path_prefix}_files', settings.TILE_DEDUP_DIR)
+
+                # 5. Индекс смещений для архива: по нему PackedTileView читает тайл одним pread
+                if packed:
+                    tiles_count = build_pack_index(output_path_prefix)
+                    self.stdout.write(self.style.SUCCESS(f'Архив проиндексирован: {tiles_count} тайлов.'))
+                else:
+                    tiles_count = count_tile_files(f'{output_path_prefix}_files')
+
+                # 6. Отчет: сколько пустых тайлов не записано и сколько оказались дубликатами
+                image_instance.tiles_skipped = max(total_tiles - tiles_count, 0)
+                image_instance.tiles_deduped = tiles_deduped
+                self.stdout.write(self.style.SUCCESS(
+                    f'Тайлов: {tiles_count} из {total_tiles}, пропущено пустых: {image_instance.tiles_skipped}, '
+                    f'дубликатов: {tiles_deduped}.'
+                ))
+                # =================================================================
 
             # --- Финальное сохранение ---
             image_instance.status = 'COMPLETED'
@@ -86,17 +191,93 @@ class Command(BaseCommand):
             # СОХРАНЯЕМ РАЗМЕРЫ В БАЗУ ДАННЫХ
             image_instance.width = image_width
             image_instance.height = image_height
+            image_instance.tiling_checkpoint = {}
+            # Прогресс писал ProgressRecorder в обход image_instance: берем итог из БД, чтобы не затереть
+            image_instance.refresh_from_db(fields=PROGRESS_FIELDS)
+            image_instance.progress_percent = 100
+            image_instance.eta_seconds = None
             image_instance.save()
             
             self.stdout.write(self.style.SUCCESS(f'Работа с "{image_instance.name}" полностью завершена. Статус: COMPLETED.'))
         except Exception as e:
             image_instance.status = 'FAILED'
-            image_instance.save()
+            # Только статус: контрольная точка в БД новее, чем в image_instance, ее нельзя затирать
+            image_instance.save(update_fields=['status'])
             self.stdout.write(self.style.ERROR(f'Произошла критическая ошибка: {e}'))
             self.stdout.write(self.style.ERROR(f'Статус "{image_instance.name}" изменен на FAILED.'))
-        
-        finally:
-            # --- Очистка ---
-            if temp_vips_file and os.path.exists(temp_vips_file):
-                os.remove(temp_vips_file)
-                self.stdout.write(f'Временный файл {temp_vips_file} удален.')
\ No newline at end of file
+            # Пробрасываем ошибку дальше, чтобы очередь задач могла повторить попытку
+            raise CommandError(f'Нарезка изображения {image_id} не удалась: {e}') from e
+
+    def tile_with_checkpoints(self, image_instance, source_path, output_path_prefix, options, progress, dz_options):
+        checkpoint = image_instance.tiling_checkpoint if options['resume'] else {}
+        if checkpoint:
+            self.stdout.write(self.style.WARNING(f'Продолжаю нарезку с контрольной точки: {checkpoint}'))
+            if progress:
+                # Байты, записанные прошлыми попытками (по последнему сохраненному снимку)
+                progress.add(0, image_instance.bytes_written)
+        else:
+            # Начинаем с нуля: убираем остатки прошлых попыток
+            clear_tiles(output_path_prefix)
+            save_progress(image_instance.id, EMPTY_PROGRESS)
+
+        def save_checkpoint(state):
+            Image.objects.filter(id=image_instance.id).update(tiling_checkpoint=state)
+
+        levels = tiff_pyramid_levels(source_path) if options['reuse_pyramid'] else []
+        started = time.monotonic()
+        tile_resumable(
+            source_path,
+            output_path_prefix,
+            checkpoint=checkpoint,
+            on_checkpoint=save_checkpoint,
+            levels=levels,
+            log=self.stdout.write,
+            progress=progress,
+            **dz_options
+        )
+        return {'mode': 'checkpointed', 'wall_time': time.monotonic() - started, 'peak_rss_mb': peak_rss_mb()}
+
+    def tile_distributed(self, image_instance, source_path, output_path_prefix, size, options, progress, dz_options):
+        started = time.monotonic()
+        checkpoint = image_instance.tiling_checkpoint if options['resume'] else {}
+        job_ids = checkpoint.get('region_jobs')
+        if job_ids:
+            # Повторная попытка: готовые области не трогаем, окончательно упавшие — снова в очередь
+            self.stdout.write(self.style.WARNING(f'Продолжаю распределенную нарезку: {len(job_ids)} областей.'))
+            Job.objects.filter(id__in=job_ids, status='FAILED').update(
+                status='QUEUED', attempts=0, worker='', run_after=timezone.now()
+            )
+        else:
+            clear_tiles(output_path_prefix)
+            save_progress(image_instance.id, EMPTY_PROGRESS)
+            # Области от брошенных прошлых попыток больше не нужны
+            Job.objects.filter(image=image_instance, kind='tile_region', status='QUEUED').delete()
+            regions = tiling_regions(*size, options['region_tiles'])
+            job_ids = [
+                enqueue_job('tile_region', image=image_instance, payload={
+                    'output_prefix': output_path_prefix, 'region': region, 'dz_options': dz_options,
+                }).id
+                for region in regions
+            ]
+            Image.objects.filter(id=image_instance.id).update(tiling_checkpoint={'region_jobs': job_ids})
+        self.stdout.write(
+            f'Верхний уровень разделен на {len(job_ids)} областей, их разбирают воркеры очереди (run_workers).'
+        )
+
+        # Пока ждем, сами режем оставшиеся в очереди области
+        regions = []
+
+        def region_done(job):
+            regions.append(job.payload['region'])
+            progress.add(job.payload.get('tiles', 0), job.payload.get('bytes', 0))
+
+        wait_for_jobs(job_ids, make_worker_id('tiling'), on_done=region_done)
+        merge_regions(
+            output_path_prefix,
+            *size,
+            regions,
+            log=self.stdout.write,
+            progress=progress,
+            **dz_options
+        )
+        return {'mode': 'distributed', 'wall_time': time.monotonic() - started, 'peak_rss_mb': peak_rss_mb()}
@@ -0,0 +1,13 @@
+# app/management/commands/prune_tile_blobs.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.tile_dedup import prune_blobs
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища дедупликации тайлы, на которые больше не ссылается ни одно изображение.'
+
+    def handle(self, *args, **options):
+        freed = prune_blobs(settings.TILE_DEDUP_DIR)
+        self.stdout.write(self.style.SUCCESS(f'Освобождено {freed / 1024 / 1024:.1f} МБ.'))
@@ -0,0 +1,15 @@
+# app/management/commands/rebuild_fulltext.py
+
+from django.core.management.base import BaseCommand
+from app.fulltext import rebuild_documents
+
+
+class Command(BaseCommand):
+    help = 'Пересоздает документы полнотекстового поиска (после правок данных в обход сигналов или для починки).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_ids', nargs='*', type=int, help='ID изображений (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        count = rebuild_documents(options['image_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Документов поиска: {count}.'))
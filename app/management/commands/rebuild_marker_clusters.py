@@ -0,0 +1,18 @@
+# app/management/commands/rebuild_marker_clusters.py
+
+from django.core.management.base import BaseCommand
+from app.clusters import rebuild_clusters
+from app.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает кластеры маркеров с нуля (после массового импорта точек или для починки).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_ids', nargs='*', type=int, help='ID изображений (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        image_ids = options['image_ids'] or Image.objects.values_list('id', flat=True)
+        for image_id in image_ids:
+            clusters = rebuild_clusters(image_id)
+            self.stdout.write(self.style.SUCCESS(f'Изображение {image_id}: {clusters} кластеров.'))
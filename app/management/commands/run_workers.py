@@ -0,0 +1,67 @@
+# app/management/commands/run_workers.py
+
+import multiprocessing
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _worker_main(index, stop_event, poll_interval):
+    # Процесс запускается через spawn, поэтому Django нужно поднять заново (один раз на воркер)
+    import django
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from app.jobs import make_worker_id, worker_loop
+    worker_loop(make_worker_id(index), stop_event=stop_event, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Запускает пул долгоживущих воркеров, которые разбирают очередь фоновых задач (нарезка изображений и т.п.).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='Сколько задач выполнять одновременно (по умолчанию JOB_WORKER_CONCURRENCY)'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help='Пауза между опросами пустой очереди, в секундах'
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency'] or settings.JOB_WORKER_CONCURRENCY
+        poll_interval = options['poll_interval'] or settings.JOB_POLL_INTERVAL
+
+        # spawn, а не fork: libvips и соединения с БД не переживают fork корректно
+        ctx = multiprocessing.get_context('spawn')
+        stop_event = ctx.Event()
+
+        def start_worker(index):
+            process = ctx.Process(target=_worker_main, args=(index, stop_event, poll_interval), daemon=False)
+            process.start()
+            return process
+
+        def request_stop(signum, frame):
+            self.stdout.write(self.style.WARNING('Получен сигнал остановки. Дожидаюсь завершения текущих задач...'))
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        workers = {index: start_worker(index) for index in range(concurrency)}
+        self.stdout.write(self.style.SUCCESS(f'Запущено воркеров: {concurrency}.'))
+
+        # Следим за воркерами и перезапускаем упавшие (например, убитые OOM)
+        while not stop_event.is_set():
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    self.stdout.write(self.style.ERROR(
+                        f'Воркер {index} завершился с кодом {process.exitcode}. Перезапускаю.'
+                    ))
+                    workers[index] = start_worker(index)
+            time.sleep(1)
+
+        for process in workers.values():
+            process.join()
+        self.stdout.write(self.style.SUCCESS('Все воркеры остановлены.'))
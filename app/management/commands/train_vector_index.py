@@ -0,0 +1,24 @@
+# app/management/commands/train_vector_index.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from app.vectors import get_vector_index
+
+
+class Command(BaseCommand):
+    help = 'Обучает IVF векторного индекса объектов (списки по ближайшему центру) для быстрого приближенного поиска.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lists', type=int, help='Число списков (по умолчанию — корень из числа векторов)')
+        parser.add_argument('--iterations', type=int, default=10, help='Итераций k-means')
+
+    def handle(self, *args, **options):
+        index = get_vector_index()
+        started = time.monotonic()
+        try:
+            lists = index.train(lists=options['lists'], iterations=options['iterations'])
+        except (NotImplementedError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'IVF обучен: {lists} списков на {len(index)} векторах за {time.monotonic() - started:.1f} с.'
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_image_tile_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='tile_storage',
+            field=models.CharField(choices=[('files', 'Отдельные файлы'), ('pack', 'Единый архив с индексом'), ('dynamic', 'По запросу, без нарезки')], default='files', max_length=10, verbose_name='Хранение тайлов'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_alter_image_tile_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='tiling_checkpoint',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Контрольная точка нарезки'),
+        ),
+    ]
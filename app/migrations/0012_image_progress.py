@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_image_tiling_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='bytes_written',
+            field=models.BigIntegerField(default=0, verbose_name='Записано байт'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='eta_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Осталось, с'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='progress_percent',
+            field=models.FloatField(default=0, verbose_name='Готово, %'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='progress_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Прогресс обновлен'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tiles_per_second',
+            field=models.FloatField(blank=True, null=True, verbose_name='Тайлов в секунду'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tiles_written',
+            field=models.BigIntegerField(default=0, verbose_name='Записано тайлов'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_image_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='dedup_tiles',
+            field=models.BooleanField(default=False, verbose_name='Дедупликация тайлов'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='skip_blank_tiles',
+            field=models.BooleanField(default=False, verbose_name='Пропускать пустые тайлы'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tile_format',
+            field=models.CharField(choices=[('jpeg', 'JPEG'), ('webp', 'WebP'), ('avif', 'AVIF')], default='jpeg', max_length=10, verbose_name='Формат тайлов'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tile_quality',
+            field=models.PositiveSmallIntegerField(default=75, verbose_name='Качество тайлов (Q)'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tiles_deduped',
+            field=models.BigIntegerField(default=0, verbose_name='Тайлов-дубликатов'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tiles_skipped',
+            field=models.BigIntegerField(default=0, verbose_name='Пропущено пустых тайлов'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_image_tile_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('process_image', 'Нарезка изображения'), ('tile_region', 'Нарезка области изображения')], max_length=50, verbose_name='Тип задачи'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+# Сетка ячеек на момент миграции (app/spatial.py): 2^16 x 2^16, ячейка — код Мортона.
+# Скопировано, а не импортировано: миграция должна давать те же ячейки и после смены сетки
+GRID_BITS = 16
+
+
+def spread_bits(value):
+    value &= 0xFFFF
+    value = (value | (value << 8)) & 0x00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F
+    value = (value | (value << 2)) & 0x33333333
+    value = (value | (value << 1)) & 0x55555555
+    return value
+
+
+def quantize(value):
+    size = 1 << GRID_BITS
+    return min(max(int(value * size), 0), size - 1)
+
+
+def cell_for(x, y, width, height):
+    if not width or not height:
+        return None
+    return spread_bits(quantize(x / width)) | (spread_bits(quantize(y / height)) << 1)
+
+
+def fill_cells(apps, schema_editor):
+    PointOfInterest = apps.get_model('app', 'PointOfInterest')
+    points = PointOfInterest.objects.select_related('image').only('x', 'y', 'image__width', 'image__height')
+    batch = []
+    for point in points.iterator(chunk_size=2000):
+        point.cell = cell_for(point.x, point.y, point.image.width, point.image.height)
+        batch.append(point)
+        if len(batch) >= 2000:
+            PointOfInterest.objects.bulk_update(batch, ['cell'])
+            batch = []
+    PointOfInterest.objects.bulk_update(batch, ['cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_alter_job_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pointofinterest',
+            name='cell',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='Ячейка сетки'),
+        ),
+        migrations.AddIndex(
+            model_name='pointofinterest',
+            index=models.Index(fields=['image', 'cell'], name='poi_image_cell_idx'),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Сетка ячеек на момент миграции (app/spatial.py): 2^16 x 2^16, ячейка — Morton-код
+GRID_BITS = 16
+
+
+def fill_clusters(apps, schema_editor):
+    # Тот же расчет, что у app.clusters.rebuild_clusters, но над историческими таблицами
+    # и без импорта живого кода: самый мелкий уровень — из точек, остальные — из предыдущего
+    quote = schema_editor.connection.ops.quote_name
+    clusters_table = quote(apps.get_model('app', 'MarkerCluster')._meta.db_table)
+    points_table = quote(apps.get_model('app', 'PointOfInterest')._meta.db_table)
+    insert = f'INSERT INTO {clusters_table} (image_id, level, cell, count, sum_x, sum_y, representative_id) '
+    finest = settings.MARKER_CLUSTER_MAX_LEVEL
+    bucket = 1 << (2 * (GRID_BITS - finest))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            insert + f'SELECT image_id, %s, cell / %s, COUNT(*), SUM(x), SUM(y), MIN(id) FROM {points_table} '
+            f'WHERE cell IS NOT NULL GROUP BY image_id, cell / %s',
+            [finest, bucket, bucket],
+        )
+        for level in reversed(range(finest)):
+            cursor.execute(
+                insert + f'SELECT image_id, %s, cell / 4, SUM(count), SUM(sum_x), SUM(sum_y), MIN(representative_id) '
+                f'FROM {clusters_table} WHERE level = %s GROUP BY image_id, cell / 4',
+                [level, level + 1],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_pointofinterest_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarkerCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField(verbose_name='Уровень сетки')),
+                ('cell', models.BigIntegerField(verbose_name='Ячейка')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Число точек')),
+                ('sum_x', models.BigIntegerField(default=0)),
+                ('sum_y', models.BigIntegerField(default=0)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='marker_clusters', to='app.image', verbose_name='Изображение')),
+                ('representative', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.pointofinterest', verbose_name='Точка-представитель')),
+            ],
+            options={
+                'verbose_name': 'Кластер маркеров',
+                'verbose_name_plural': 'Кластеры маркеров',
+                'constraints': [models.UniqueConstraint(fields=('image', 'level', 'cell'), name='marker_cluster_cell_unique')],
+            },
+        ),
+        migrations.RunPython(fill_clusters, migrations.RunPython.noop),
+    ]
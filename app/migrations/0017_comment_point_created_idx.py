@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_markercluster'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['point', 'created_at', 'id'], name='comment_point_created_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_version_stamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['status', '-uploaded_at'], name='image_status_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointofinterest',
+            index=models.Index(fields=['image', '-created_at'], name='poi_image_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchableobject',
+            name='embedding_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Хэш эмбеддинга'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('process_image', 'Нарезка изображения'), ('tile_region', 'Нарезка области изображения'), ('embed_objects', 'Эмбеддинги объектов поиска')], max_length=50, verbose_name='Тип задачи'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:48
+
+from django.db import migrations, models
+
+# Ячейки объектов — на той же сетке, что у точек в 0015 (копия app/spatial.py того времени)
+GRID_BITS = 16
+
+
+def spread_bits(value):
+    value &= 0xFFFF
+    value = (value | (value << 8)) & 0x00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F
+    value = (value | (value << 2)) & 0x33333333
+    value = (value | (value << 1)) & 0x55555555
+    return value
+
+
+def quantize(value):
+    size = 1 << GRID_BITS
+    return min(max(int(value * size), 0), size - 1)
+
+
+def cell_for(x, y, width, height):
+    if not width or not height:
+        return None
+    return spread_bits(quantize(x / width)) | (spread_bits(quantize(y / height)) << 1)
+
+
+def fill_cells(apps, schema_editor):
+    SearchableObject = apps.get_model('app', 'SearchableObject')
+    objects = SearchableObject.objects.select_related('image').only('x', 'y', 'image__width', 'image__height')
+    batch = []
+    for obj in objects.iterator(chunk_size=2000):
+        obj.cell = cell_for(obj.x, obj.y, obj.image.width, obj.image.height)
+        batch.append(obj)
+        if len(batch) >= 2000:
+            SearchableObject.objects.bulk_update(batch, ['cell'])
+            batch = []
+    SearchableObject.objects.bulk_update(batch, ['cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_embedding_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchableobject',
+            name='cell',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='Ячейка сетки'),
+        ),
+        migrations.AddIndex(
+            model_name='searchableobject',
+            index=models.Index(fields=['image', 'cell'], name='object_image_cell_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchableobject',
+            index=models.Index(fields=['image', 'width'], name='object_image_width_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchableobject',
+            index=models.Index(fields=['image', 'height'], name='object_image_height_idx'),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Инвертированный индекс над app_searchdocument — своими средствами каждой базы.
+# SQLite: внешняя таблица FTS5 и триггеры, которые держат ее в согласии с документами
+# (при пересоздании app_searchdocument миграцией триггеры нужно создать заново).
+SQLITE_CREATE = [
+    '''CREATE VIRTUAL TABLE app_fulltext USING fts5(
+        kind, image_id, title, body, content='app_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''',
+    '''CREATE TRIGGER app_fulltext_insert AFTER INSERT ON app_searchdocument BEGIN
+        INSERT INTO app_fulltext(rowid, kind, image_id, title, body)
+        VALUES (new.id, new.kind, new.image_id, new.title, new.body);
+    END''',
+    '''CREATE TRIGGER app_fulltext_delete AFTER DELETE ON app_searchdocument BEGIN
+        INSERT INTO app_fulltext(app_fulltext, rowid, kind, image_id, title, body)
+        VALUES ('delete', old.id, old.kind, old.image_id, old.title, old.body);
+    END''',
+    '''CREATE TRIGGER app_fulltext_update AFTER UPDATE ON app_searchdocument BEGIN
+        INSERT INTO app_fulltext(app_fulltext, rowid, kind, image_id, title, body)
+        VALUES ('delete', old.id, old.kind, old.image_id, old.title, old.body);
+        INSERT INTO app_fulltext(rowid, kind, image_id, title, body)
+        VALUES (new.id, new.kind, new.image_id, new.title, new.body);
+    END''',
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS app_fulltext_update',
+    'DROP TRIGGER IF EXISTS app_fulltext_delete',
+    'DROP TRIGGER IF EXISTS app_fulltext_insert',
+    'DROP TABLE IF EXISTS app_fulltext',
+]
+# PostgreSQL: вычисляемый столбец tsvector (морфология 'russian') и GIN-индекс
+POSTGRES_CREATE = [
+    '''ALTER TABLE app_searchdocument ADD COLUMN document tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', title), 'A') || setweight(to_tsvector('russian', body), 'B')
+    ) STORED''',
+    'CREATE INDEX search_document_gin_idx ON app_searchdocument USING GIN (document)',
+]
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS search_document_gin_idx',
+    'ALTER TABLE app_searchdocument DROP COLUMN IF EXISTS document',
+]
+
+
+def run_statements(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_fulltext(apps, schema_editor):
+    run_statements(schema_editor, {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE})
+
+
+def drop_fulltext(apps, schema_editor):
+    run_statements(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
+
+
+def normalize_text(text):
+    # Копия app.fulltext.normalize_text на момент миграции: FTS5 не считает "ё" вариантом "е"
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def fill_documents(apps, schema_editor):
+    SearchDocument = apps.get_model('app', 'SearchDocument')
+    sources = [
+        ('marker', apps.get_model('app', 'PointOfInterest').objects.values_list('id', 'image_id', 'name', 'description')),
+        ('comment', apps.get_model('app', 'Comment').objects.values_list('id', 'point__image_id', 'author_name', 'text')),
+        ('object', apps.get_model('app', 'SearchableObject').objects.values_list(
+            'vector_id', 'image_id', 'name', 'object_type', 'description'
+        )),
+    ]
+    # Как в app/fulltext.py: название — заголовок, остальное через перевод строки — текст
+    for kind, rows in sources:
+        batch = []
+        for object_id, image_id, title, *body in rows.order_by().iterator(chunk_size=2000):
+            batch.append(SearchDocument(
+                kind=kind, object_id=str(object_id), image_id=image_id,
+                title=normalize_text(title), body=normalize_text('\n'.join(filter(None, body))),
+            ))
+            if len(batch) >= 2000:
+                SearchDocument.objects.bulk_create(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_searchable_object_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('marker', 'Маркер'), ('comment', 'Сообщение чата'), ('object', 'Объект поиска')], max_length=20, verbose_name='Тип записи')),
+                ('object_id', models.CharField(max_length=64, verbose_name='ID записи')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='Заголовок')),
+                ('body', models.TextField(blank=True, verbose_name='Текст')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='app.image', verbose_name='Изображение')),
+            ],
+            options={
+                'verbose_name': 'Документ поиска',
+                'verbose_name_plural': 'Документы поиска',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_document_key')],
+            },
+        ),
+        migrations.RunPython(create_fulltext, drop_fulltext),
+        migrations.RunPython(fill_documents, migrations.RunPython.noop),
+    ]
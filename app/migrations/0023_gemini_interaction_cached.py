@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geminiinteraction',
+            name='cached',
+            field=models.BooleanField(default=False, verbose_name='Из кэша'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from .spatial import cell_for
 
 # =====================================================================
 # Модель 1: Изображения
@@ -16,6 +18,18 @@ class Image(models.Model):
         ('FAILED', 'Ошибка нарезки'),
     ]
 
+    TILE_STORAGE_CHOICES = [
+        ('files', 'Отдельные файлы'),
+        ('pack', 'Единый архив с индексом'),
+        ('dynamic', 'По запросу, без нарезки'),
+    ]
+
+    TILE_FORMAT_CHOICES = [
+        ('jpeg', 'JPEG'),
+        ('webp', 'WebP'),
+        ('avif', 'AVIF'),
+    ]
+
     name = models.CharField(max_length=255, unique=True, verbose_name="Название")
     description = models.TextField(blank=True, verbose_name="Описание")
     
@@ -40,8 +54,41 @@ class Image(models.Model):
     source_file = models.FileField(upload_to='images/', verbose_name="Файл изображения (.tif)", null=True, blank=True)
     
     max_zoom_level = models.PositiveIntegerField(verbose_name="Максимальный уровень зума", null=True, blank=True)
+    # 'pack' — все тайлы в одном файле MEDIA_ROOT/tiles/image_<id>.zip, отдаются через PackedTileView
+    # 'dynamic' — тайлы не нарезаются заранее, DziView рендерит их из исходника по запросу
+    tile_storage = models.CharField(
+        max_length=10,
+        choices=TILE_STORAGE_CHOICES,
+        default='files',
+        verbose_name="Хранение тайлов"
+    )
+    tile_format = models.CharField(
+        max_length=10,
+        choices=TILE_FORMAT_CHOICES,
+        default='jpeg',
+        verbose_name="Формат тайлов"
+    )
+    tile_quality = models.PositiveSmallIntegerField(default=75, verbose_name="Качество тайлов (Q)")
+    # Пустые (фон/нет данных) тайлы не записываются: вьювер на их месте показывает родительский уровень
+    skip_blank_tiles = models.BooleanField(default=False, verbose_name="Пропускать пустые тайлы")
+    # Одинаковые тайлы (в том числе из разных изображений) хранятся один раз, см. app/tile_dedup.py
+    dedup_tiles = models.BooleanField(default=False, verbose_name="Дедупликация тайлов")
+    tiles_skipped = models.BigIntegerField(default=0, verbose_name="Пропущено пустых тайлов")
+    tiles_deduped = models.BigIntegerField(default=0, verbose_name="Тайлов-дубликатов")
+    # Докуда дошла возобновляемая нарезка: {'rows_total', 'rows_done', 'levels_done'}; пусто — нечего продолжать
+    tiling_checkpoint = models.JSONField(default=dict, blank=True, verbose_name="Контрольная точка нарезки")
+    # Ход нарезки; пишется из process_image не чаще раза в TILING_PROGRESS_INTERVAL секунд
+    progress_percent = models.FloatField(default=0, verbose_name="Готово, %")
+    tiles_written = models.BigIntegerField(default=0, verbose_name="Записано тайлов")
+    tiles_per_second = models.FloatField(null=True, blank=True, verbose_name="Тайлов в секунду")
+    bytes_written = models.BigIntegerField(default=0, verbose_name="Записано байт")
+    eta_seconds = models.PositiveIntegerField(null=True, blank=True, verbose_name="Осталось, с")
+    progress_updated_at = models.DateTimeField(null=True, blank=True, verbose_name="Прогресс обновлен")
     source_url = models.URLField(max_length=512, blank=True, verbose_name="URL источника")
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
+    # Штамп версии для ETag/Last-Modified; растет при изменении изображения и его маркеров (app/versions.py)
+    version = models.PositiveIntegerField(default=0, editable=False, verbose_name="Версия")
+    modified_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Изменено")
 
     def __str__(self):
         return self.name
@@ -50,6 +97,10 @@ class Image(models.Model):
         verbose_name = "Изображение"
         verbose_name_plural = "Изображения"
         ordering = ['-uploaded_at']
+        indexes = [
+            # Галерея: готовые изображения, новые сверху
+            models.Index(fields=['status', '-uploaded_at'], name='image_status_uploaded_idx'),
+        ]
 
 # =====================================================================
 # Модель 2: Точки Интереса (Points of Interest - POI)
@@ -60,20 +111,67 @@ class PointOfInterest(models.Model):
     owner_name = models.CharField(max_length=80, verbose_name="Имя автора", blank=True, null=True)
     x = models.BigIntegerField(verbose_name="Координата X")
     y = models.BigIntegerField(verbose_name="Координата Y")
+    # Ячейка пространственного индекса (код Мортона нормированных x/y, см. app/spatial.py);
+    # заполняется при сохранении, по ней маркеры выбираются по видимой области
+    cell = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name="Ячейка сетки")
     name = models.CharField(max_length=255, verbose_name="Название точки")
     
     # Поле для простой заметки/описания
     description = models.TextField(blank=True, verbose_name="Заметка")
     
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    # Штамп версии для ETag/Last-Modified; растет при изменении точки и ее чата (app/versions.py)
+    version = models.PositiveIntegerField(default=0, editable=False, verbose_name="Версия")
+    modified_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Изменено")
 
     def __str__(self):
         return f'"{self.name}" на изображении "{self.image.name}"'
 
+    def save(self, *args, **kwargs):
+        self.cell = cell_for(self.x, self.y, self.image.width, self.image.height)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Точка интереса"
         verbose_name_plural = "Точки интереса"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['image', 'cell'], name='poi_image_cell_idx'),
+            # Маркеры изображения в порядке Meta.ordering (встраиваемые в детали изображения)
+            models.Index(fields=['image', '-created_at'], name='poi_image_created_idx'),
+        ]
+
+# =====================================================================
+# Кластеры точек интереса
+# Готовые агрегаты для отображения маркеров на мелком масштабе: одна строка
+# на непустую ячейку сетки уровня level (см. app/clusters.py).
+# =====================================================================
+class MarkerCluster(models.Model):
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='marker_clusters', verbose_name="Изображение")
+    level = models.PositiveSmallIntegerField(verbose_name="Уровень сетки")
+    cell = models.BigIntegerField(verbose_name="Ячейка")
+    count = models.PositiveIntegerField(default=0, verbose_name="Число точек")
+    # Суммы пиксельных координат: центр кластера = сумма / count
+    sum_x = models.BigIntegerField(default=0)
+    sum_y = models.BigIntegerField(default=0)
+    representative = models.ForeignKey(
+        PointOfInterest,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Точка-представитель"
+    )
+
+    def __str__(self):
+        return f'Кластер {self.level}/{self.cell} изображения {self.image_id}: {self.count}'
+
+    class Meta:
+        verbose_name = "Кластер маркеров"
+        verbose_name_plural = "Кластеры маркеров"
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'level', 'cell'], name='marker_cluster_cell_unique'),
+        ]
 
 # =====================================================================
 # Модель 3: Комментарии
@@ -121,6 +219,10 @@ class Comment(models.Model):
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
         ordering = ['created_at']
+        indexes = [
+            # Постраничный вывод чата по курсору (created_at, id), см. app/pagination.py
+            models.Index(fields=['point', 'created_at', 'id'], name='comment_point_created_idx'),
+        ]
 
 # =====================================================================
 # Модель 4: Взаимодействия с Gemini AI
@@ -145,6 +247,11 @@ class GeminiInteraction(models.Model):
     response = models.TextField(
         verbose_name="Ответ (Response)"
     )
+    # Ответ взят из кэша ответов (app/ai.py), модель не вызывалась
+    cached = models.BooleanField(
+        default=False,
+        verbose_name="Из кэша"
+    )
     timestamp = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Время"
@@ -160,8 +267,8 @@ class GeminiInteraction(models.Model):
 
 # =====================================================================
 # Модель 5: Объекты для векторного поиска
-# Хранит метаданные объектов, чьи эмбеддинги загружены в Upstash Vector.
-# Связывает ID вектора в Upstash с данными в PostgreSQL.
+# Хранит метаданные объектов, чьи эмбеддинги загружены в векторный индекс
+# (app/vectors.py: локальный или Upstash Vector). vector_id — ключ вектора в индексе.
 # =====================================================================
 class SearchableObject(models.Model):
     vector_id = models.UUIDField(
@@ -208,13 +315,127 @@ class SearchableObject(models.Model):
         auto_now_add=True,
         verbose_name="Дата добавления"
     )
+    # Ячейка сетки центра объекта (app/spatial.py) — для поиска в видимой области
+    cell = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name="Ячейка сетки")
+    # Хэш текста и эмбеддера, по которым посчитан вектор в индексе (app/embeddings.py);
+    # пустой — вектора еще нет
+    embedding_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        verbose_name="Хэш эмбеддинга"
+    )
 
     def __str__(self):
         return f'{self.name} ({self.object_type}) на изображении "{self.image.name}"'
 
+    def save(self, *args, **kwargs):
+        self.cell = cell_for(self.x, self.y, self.image.width, self.image.height)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Объект для поиска"
         verbose_name_plural = "Объекты для поиска"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['image', 'cell'], name='object_image_cell_idx'),
+            # Самые большие объекты изображения — запас для поиска по видимой области
+            models.Index(fields=['image', 'width'], name='object_image_width_idx'),
+            models.Index(fields=['image', 'height'], name='object_image_height_idx'),
+        ]
+
+
+# =====================================================================
+# Модель 6: Фоновые задачи
+# Очередь задач в базе данных (нарезка изображений и т.п.).
+# Задачи разбирают долгоживущие воркеры (manage.py run_workers),
+# поэтому статус и число попыток переживают перезапуск сервера.
+# =====================================================================
+class Job(models.Model):
+
+    KIND_CHOICES = [
+        ('process_image', 'Нарезка изображения'),
+        ('tile_region', 'Нарезка области изображения'),
+        ('embed_objects', 'Эмбеддинги объектов поиска'),
+    ]
+
+    STATUS_CHOICES = [
+        ('QUEUED', 'В очереди'),
+        ('RUNNING', 'Выполняется'),
+        ('DONE', 'Выполнена'),
+        ('FAILED', 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES, verbose_name="Тип задачи")
+    image = models.ForeignKey(
+        Image,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        null=True,
+        blank=True,
+        verbose_name="Изображение"
+    )
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='QUEUED',
+        verbose_name="Статус"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток сделано")
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name="Максимум попыток")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Не раньше")
+    worker = models.CharField(max_length=255, blank=True, verbose_name="Воркер")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний сигнал воркера")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.id} ({self.status})'
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+
+# =====================================================================
+# Модель 7: Документы полнотекстового поиска
+# Текст маркеров, сообщений чата и объектов поиска в одной таблице
+# (app/fulltext.py). Инвертированный индекс над ней — средствами базы:
+# в SQLite это таблица FTS5 app_fulltext, которую синхронизируют
+# триггеры, в PostgreSQL — столбец tsvector с GIN-индексом
+# (оба создаются миграцией 0022).
+# =====================================================================
+class SearchDocument(models.Model):
+
+    KIND_CHOICES = [
+        ('marker', 'Маркер'),
+        ('comment', 'Сообщение чата'),
+        ('object', 'Объект поиска'),
+    ]
 
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип записи")
+    object_id = models.CharField(max_length=64, verbose_name="ID записи")
+    image = models.ForeignKey(
+        Image,
+        on_delete=models.CASCADE,
+        related_name='search_documents',
+        verbose_name="Изображение"
+    )
+    title = models.CharField(max_length=255, blank=True, verbose_name="Заголовок")
+    body = models.TextField(blank=True, verbose_name="Текст")
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.object_id}: {self.title or self.body[:50]}'
 
+    class Meta:
+        verbose_name = "Документ поиска"
+        verbose_name_plural = "Документы поиска"
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_document_key'),
+        ]
@@ -0,0 +1,49 @@
+# app/object_search.py
+
+from django.conf import settings
+from .embeddings import get_embedder
+from .models import SearchableObject
+from .spatial import objects_in_bbox, objects_overlapping
+from .vectors import get_vector_index
+
+# =====================================================================
+# Гибридный поиск: видимая область + смысл описания
+# "Объекты, похожие на туманность, в этой части изображения N": сначала
+# по пространственному индексу (app/spatial.py) выбираются объекты,
+# пересекающие bbox, и только их вектора сравниваются с эмбеддингом
+# запроса (app/vectors.py) — стоимость растет с числом объектов в области,
+# а не в каталоге. Если область захватывает больше
+# OBJECT_SEARCH_PREFILTER_MAX объектов (почти все изображение), дешевле
+# обратный порядок: приближенный поиск по всему индексу с запасом
+# (x OBJECT_SEARCH_OVERFETCH) и отсев найденного по области.
+# =====================================================================
+
+
+def search_objects(image, bbox, text, limit):
+    """
+    Объекты изображения image в нормированном bbox, ближайшие по смыслу к text.
+    Возвращает словарь: objects (с атрибутом score, по убыванию), candidates
+    (объектов в области, не больше OBJECT_SEARCH_PREFILTER_MAX + 1), prefiltered.
+    """
+    query = get_embedder().embed([text], query=True)[0]
+    index = get_vector_index()
+    in_view = objects_in_bbox(image, bbox).order_by()
+    candidates = list(in_view.values_list('vector_id', flat=True)[:settings.OBJECT_SEARCH_PREFILTER_MAX + 1])
+    prefiltered = len(candidates) <= settings.OBJECT_SEARCH_PREFILTER_MAX
+    if prefiltered:
+        results = index.search(query, k=limit, candidates=candidates) if candidates else []
+    else:
+        results = index.search(query, k=limit * settings.OBJECT_SEARCH_OVERFETCH)
+    # Найденные читаются по первичному ключу (условие на image увело бы SQLite на индекс
+    # изображения); после поиска по всему индексу отсеиваются объекты вне области
+    # и других изображений
+    found = SearchableObject.objects.filter(vector_id__in=[vector_id for vector_id, score in results]).order_by()
+    if not prefiltered:
+        found = objects_overlapping(found, image, bbox)
+    found = {obj.vector_id: obj for obj in found if obj.image_id == image.id}
+    objects = []
+    for vector_id, score in results:
+        if vector_id in found:
+            found[vector_id].score = score
+            objects.append(found[vector_id])
+    return {'objects': objects[:limit], 'candidates': len(candidates), 'prefiltered': prefiltered}
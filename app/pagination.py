@@ -0,0 +1,103 @@
+# app/pagination.py
+
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+
+# =====================================================================
+# Постраничный вывод по ключу (keyset)
+# Страница задается не смещением, а курсором — парой (created_at, id)
+# крайней записи предыдущей страницы. Запрос "записи до/после курсора"
+# идет по индексу (владелец, created_at, id) и стоит одинаково на любой
+# глубине треда, а новые сообщения не сдвигают страницы, как при OFFSET.
+# =====================================================================
+
+
+def encode_cursor(obj, field='created_at'):
+    """Непрозрачный курсор записи: base64 от "<field>|id" (field — поле даты, по которому идут страницы)."""
+    raw = f'{getattr(obj, field).isoformat()}|{obj.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """Курсор -> (дата, id); ValueError, если курсор испорчен."""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        created_at, obj_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(obj_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор.')
+
+
+def page_size(value=None, default=None, maximum=None):
+    """
+    Размер страницы из параметра запроса, ограниченный maximum; ValueError при ошибке.
+    По умолчанию — размеры страниц чата (CHAT_PAGE_SIZE, CHAT_PAGE_MAX_SIZE).
+    """
+    if value in (None, ''):
+        return default or settings.CHAT_PAGE_SIZE
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValueError('limit — целое число.')
+    if size < 1:
+        raise ValueError('limit должен быть положительным.')
+    return min(size, maximum or settings.CHAT_PAGE_MAX_SIZE)
+
+
+def keyset_page(queryset, before=None, since=None, limit=None):
+    """
+    Страница записей queryset (с полями created_at и id) в хронологическом порядке.
+    before — курсор: записи старше него (прокрутка треда назад);
+    since — курсор: только записи новее него (дозагрузка новых сообщений, важнее before);
+    без курсоров — последние limit записей.
+    Возвращает словарь: items, before (курсор для следующей страницы старых),
+    since (курсор для опроса новых), has_more (в выбранном направлении есть еще записи).
+    """
+    limit = limit or settings.CHAT_PAGE_SIZE
+    queryset = queryset.order_by()
+    if since is not None:
+        created_at, obj_id = decode_cursor(since)
+        rows = list(
+            queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=obj_id))
+            .order_by('created_at', 'id')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        items = rows[:limit]
+    else:
+        if before is not None:
+            created_at, obj_id = decode_cursor(before)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=obj_id))
+        # С конца треда: берем limit + 1 самых новых и разворачиваем
+        rows = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+        has_more = len(rows) > limit
+        items = rows[:limit][::-1]
+    return {
+        'items': items,
+        'before': encode_cursor(items[0]) if items else before,
+        'since': encode_cursor(items[-1]) if items else since,
+        'has_more': has_more,
+    }
+
+
+def newest_first_page(queryset, after=None, limit=None, field='created_at'):
+    """
+    Страница записей queryset от новых к старым: порядок (-field, id).
+    after — курсор последней записи предыдущей страницы (next из прошлого ответа).
+    Возвращает словарь: items, next (курсор следующей страницы или None), has_more.
+    """
+    limit = limit or settings.CHAT_PAGE_SIZE
+    if after is not None:
+        value, obj_id = decode_cursor(after)
+        # Диапазон по field идет поиском по индексу; из записей с той же датой
+        # отбрасываем уже отданные (id не больше курсора)
+        queryset = queryset.filter(**{f'{field}__lte': value}).exclude(**{field: value, 'id__lte': obj_id})
+    rows = list(queryset.order_by(f'-{field}', 'id')[:limit + 1])
+    items = rows[:limit]
+    has_more = len(rows) > limit
+    return {
+        'items': items,
+        'next': encode_cursor(items[-1], field) if has_more else None,
+        'has_more': has_more,
+    }
@@ -0,0 +1,57 @@
+# app/progress.py
+
+import threading
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import Image
+
+# =====================================================================
+# Запись прогресса нарезки в БД
+# Счетчики TilingProgress меняются в потоках libvips тысячи раз в секунду,
+# а в базу снимок уходит из отдельного потока не чаще раза в interval
+# секунд — ради пары чисел в админке БД не нагружается.
+# =====================================================================
+
+PROGRESS_FIELDS = [
+    'progress_percent', 'tiles_written', 'tiles_per_second', 'bytes_written', 'eta_seconds', 'progress_updated_at'
+]
+
+EMPTY_PROGRESS = {
+    'progress_percent': 0,
+    'tiles_written': 0,
+    'tiles_per_second': None,
+    'bytes_written': 0,
+    'eta_seconds': None,
+}
+
+
+def save_progress(image_id, state):
+    Image.objects.filter(id=image_id).update(progress_updated_at=timezone.now(), **state)
+
+
+class ProgressRecorder:
+    """Фоновый поток, который периодически сохраняет progress.state() в Image; при выходе — финальный снимок."""
+
+    def __init__(self, image_id, progress, interval=None):
+        self.image_id = image_id
+        self.progress = progress
+        self.interval = interval or settings.TILING_PROGRESS_INTERVAL
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                save_progress(self.image_id, self.progress.state())
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        save_progress(self.image_id, self.progress.state())
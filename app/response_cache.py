@@ -0,0 +1,82 @@
+# app/response_cache.py
+
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+# =====================================================================
+# Кэш ответов API чтения
+# В ключ входит штамп версии из app/versions.py (тот же, что в ETag),
+# поэтому ничего не нужно удалять: изменение маркера или сообщения чата
+# увеличивает версию изображения/маркера, и следующий запрос просто
+# промахивается мимо старой записи, а та вытесняется по MAX_ENTRIES.
+# Хранятся данные до рендеринга (response.data), так что один ответ
+# годится и для JSON, и для browsable API. Бэкенд — кэш API_CACHE_ALIAS
+# (по умолчанию locmem, см. settings.CACHES; Redis — общий на все процессы).
+# =====================================================================
+
+STATS_KEY = 'api-cache-stats:{name}:{kind}'
+# Имена кэшируемых ответов (для статистики): детали изображения и детали маркера.
+# Страницы галереи не кэшируются: каждая — один запрос по индексу (app/gallery.py)
+CACHED_RESPONSES = ['image', 'marker']
+
+
+def api_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def count(name, kind):
+    """Счетчик попаданий/промахов живет в том же кэше: в Redis он общий для всех воркеров."""
+    cache = api_cache()
+    key = STATS_KEY.format(name=name, kind=kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Счетчика еще нет (или он вытеснен); add не затрет значение, созданное параллельно
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cache_stats(names=CACHED_RESPONSES):
+    cache = api_cache()
+    stats = {}
+    for name in names:
+        hits = cache.get(STATS_KEY.format(name=name, kind='hits'), 0)
+        misses = cache.get(STATS_KEY.format(name=name, kind='misses'), 0)
+        total = hits + misses
+        stats[name] = {'hits': hits, 'misses': misses, 'hitRate': round(hits / total, 3) if total else None}
+    return stats
+
+
+def reset_stats(names=CACHED_RESPONSES):
+    api_cache().delete_many([STATS_KEY.format(name=name, kind=kind) for name in names for kind in ('hits', 'misses')])
+
+
+def cached_response(name, etag_func):
+    """
+    Декоратор get() представления (через method_decorator): ответ 200 кэшируется
+    под ключом из имени, ETag текущей версии, хоста и полного пути запроса.
+    etag_func — функция из app/versions.py; None (записи нет) — без кэша.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = etag_func(request, *args, **kwargs)
+            if etag is None or not settings.API_CACHE_ENABLED:
+                return view(request, *args, **kwargs)
+            # Хост в ключе: в ответах абсолютные URL (tileSource, markersUrl)
+            version = etag.strip('"')
+            key = f'api:{name}:{version}:{request.get_host()}:{request.get_full_path()}'
+            cache = api_cache()
+            data = cache.get(key)
+            if data is not None:
+                count(name, 'hits')
+                return Response(data)
+            count(name, 'misses')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data)
+            return response
+        return wrapper
+    return decorator
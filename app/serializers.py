@@ -1,18 +1,22 @@
 # app/serializers.py
 
+import numpy as np
 import pyvips
 from rest_framework import serializers
 from django.urls import reverse
 from django.conf import settings
-from .models import Image, PointOfInterest, Comment
+from .fulltext import snippet
+from .pagination import keyset_page
+from .models import Image, PointOfInterest, Comment, MarkerCluster, SearchableObject, GeminiInteraction
 
 # --- Сериализаторы для Чатов (Комментариев) ---
 
 class ChatMessageSerializer(serializers.ModelSerializer):
     user = serializers.CharField(source='author_name', read_only=True)
+    createdAt = serializers.DateTimeField(source='created_at', read_only=True)
     class Meta:
         model = Comment
-        fields = ['user', 'text']
+        fields = ['id', 'user', 'text', 'createdAt']
 
 class ChatMessageCreateSerializer(serializers.ModelSerializer):
     user = serializers.CharField(max_length=80, source='author_name')
@@ -41,12 +45,119 @@ class MarkerSerializer(serializers.ModelSerializer):
         if height: return obj.y / height
         return None
 
+def serialize_markers(queryset, width, height):
+    """
+    Быстрый путь для списков маркеров: то же, что MarkerSerializer(many=True).data,
+    но без объектов модели и полей DRF на каждую точку. Строки берутся одним
+    values_list, координаты нормируются векторно; деление в float64 то же, что
+    obj.x / width в get_x, поэтому JSON совпадает с прежним байт в байт.
+    """
+    rows = list(queryset.values_list('id', 'x', 'y', 'name'))
+    if not rows:
+        return []
+    ids, xs, ys, names = zip(*rows)
+    xs = (np.array(xs, dtype=np.float64) / width).tolist() if width else [None] * len(rows)
+    ys = (np.array(ys, dtype=np.float64) / height).tolist() if height else [None] * len(rows)
+    return [{'id': i, 'x': x, 'y': y, 'title': title} for i, x, y, title in zip(ids, xs, ys, names)]
+
+# --- Вопросы AI о маркере ---
+
+class PointQuestionSerializer(serializers.Serializer):
+    prompt = serializers.CharField(max_length=settings.AI_PROMPT_MAX_LENGTH)
+
+class GeminiInteractionSerializer(serializers.ModelSerializer):
+    answer = serializers.CharField(source='response')
+    createdAt = serializers.DateTimeField(source='timestamp')
+    class Meta:
+        model = GeminiInteraction
+        fields = ['id', 'prompt', 'answer', 'cached', 'createdAt']
+
+def serialize_search_results(documents, image, terms):
+    """
+    Результаты полнотекстового поиска (документы после app.fulltext.locate_documents):
+    тип и id записи, маркер (для маркера и сообщения чата), нормированные x, y,
+    заголовок, фрагмент текста вокруг найденного слова и оценка.
+    """
+    return [
+        {
+            'type': document.kind,
+            'id': document.object_id,
+            'markerId': document.marker_id,
+            'x': document.x / image.width if image.width else None,
+            'y': document.y / image.height if image.height else None,
+            'title': document.title,
+            'snippet': snippet(document.body, terms),
+            'score': document.score,
+        }
+        for document in documents
+    ]
+
+# Результат поиска объектов: координаты и размеры нормированы, как у MarkerSerializer
+class ObjectSearchResultSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(source='vector_id')
+    type = serializers.CharField(source='object_type')
+    x = serializers.SerializerMethodField()
+    y = serializers.SerializerMethodField()
+    width = serializers.SerializerMethodField()
+    height = serializers.SerializerMethodField()
+    score = serializers.FloatField()
+    class Meta:
+        model = SearchableObject
+        fields = ['id', 'name', 'type', 'description', 'x', 'y', 'width', 'height', 'score']
+    def get_x(self, obj):
+        return obj.x / self.context['image_width']
+    def get_y(self, obj):
+        return obj.y / self.context['image_height']
+    def get_width(self, obj):
+        return obj.width / self.context['image_width'] if obj.width else None
+    def get_height(self, obj):
+        return obj.height / self.context['image_height'] if obj.height else None
+
+class MarkerClusterSerializer(serializers.ModelSerializer):
+    x = serializers.SerializerMethodField()
+    y = serializers.SerializerMethodField()
+    marker = serializers.SerializerMethodField()
+    class Meta:
+        model = MarkerCluster
+        fields = ['x', 'y', 'count', 'marker']
+    # Центр кластера в нормированных координатах
+    def get_x(self, obj):
+        return obj.sum_x / obj.count / self.context['image_width']
+    def get_y(self, obj):
+        return obj.sum_y / obj.count / self.context['image_height']
+    def get_marker(self, obj):
+        if obj.representative is None:
+            return None
+        return MarkerSerializer(obj.representative, context=self.context).data
+
 class MarkerDetailSerializer(serializers.ModelSerializer):
     title = serializers.CharField(source='name')
-    chat = ChatMessageSerializer(many=True, source='comments', read_only=True)
+    chat = serializers.SerializerMethodField()
+    chatPage = serializers.SerializerMethodField()
     class Meta:
         model = PointOfInterest
-        fields = ['title', 'description', 'chat']
+        fields = ['title', 'description', 'chat', 'chatPage']
+
+    # В деталях маркера — только последняя страница чата; более старые сообщения
+    # и новые с момента открытия клиент запрашивает по курсорам через chatPage.url
+    def latest_chat_page(self, obj):
+        if getattr(self, '_chat_page', (None,))[0] != obj.id:
+            self._chat_page = (obj.id, keyset_page(obj.comments.all()))
+        return self._chat_page[1]
+
+    def get_chat(self, obj):
+        return ChatMessageSerializer(self.latest_chat_page(obj)['items'], many=True).data
+
+    def get_chatPage(self, obj):
+        page = self.latest_chat_page(obj)
+        request = self.context.get('request')
+        url = reverse('chat-message-create', kwargs={'marker_id': obj.id})
+        return {
+            'before': page['before'],
+            'since': page['since'],
+            'hasOlder': page['has_more'],
+            'url': request.build_absolute_uri(url) if request else url,
+        }
 
 # --- Сериализаторы для Изображений ---
 
@@ -58,23 +169,47 @@ class GalleryImageSerializer(serializers.ModelSerializer):
 class ImageDetailSerializer(serializers.ModelSerializer):
     tileSource = serializers.SerializerMethodField()
     markers = serializers.SerializerMethodField()
+    markersTotal = serializers.SerializerMethodField()
+    markersUrl = serializers.SerializerMethodField()
     class Meta:
         model = Image
-        fields = ['id', 'name', 'tileSource', 'markers']
+        fields = ['id', 'name', 'tileSource', 'markers', 'markersTotal', 'markersUrl']
 
     def get_tileSource(self, obj):
         request = self.context.get('request')
+        if obj.tile_storage == 'dynamic' or obj.status != 'COMPLETED':
+            # Нарезки нет (или она еще идет): тайлы рендерятся по запросу в DziView
+            dzi_url = reverse('dzi-view', kwargs={'image_id': obj.id})
+            return request.build_absolute_uri(dzi_url) if request else dzi_url
+        if obj.tile_storage == 'pack':
+            # Тайлы лежат в одном архиве и отдаются через PackedTileView
+            dzi_url = reverse('packed-dzi', kwargs={'image_id': obj.id})
+            return request.build_absolute_uri(dzi_url) if request else dzi_url
         dzi_filename = f'tiles/image_{obj.id}/image_{obj.id}.dzi'
         if request:
             return request.build_absolute_uri(f'{settings.MEDIA_URL}{dzi_filename}')
         return f'{settings.MEDIA_URL}{dzi_filename}'
 
     def get_markers(self, obj):
-        width = obj.width
-        height = obj.height
-        context = self.context
-        context.update({'image_width': width, 'image_height': height})
-        return MarkerSerializer(obj.points.all(), many=True, context=context).data
+        # Встраиваем только последние MARKERS_EMBED_LIMIT маркеров; остальные клиент
+        # запрашивает по видимой области через markersUrl
+        return serialize_markers(obj.points.all()[:settings.MARKERS_EMBED_LIMIT], obj.width, obj.height)
+
+    def get_markersTotal(self, obj):
+        return obj.points.count()
+
+    def get_markersUrl(self, obj):
+        request = self.context.get('request')
+        url = reverse('marker-viewport', kwargs={'image_id': obj.id})
+        return request.build_absolute_uri(url) if request else url
+
+class ImageStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Image
+        fields = [
+            'id', 'status', 'progress_percent', 'tiles_written', 'tiles_per_second',
+            'bytes_written', 'eta_seconds', 'progress_updated_at'
+        ]
 
 # --- ФИНАЛЬНАЯ ВЕРСИЯ СЕРИАЛИЗАТОРА ДЛЯ СОЗДАНИЯ МАРКЕРА ---
 
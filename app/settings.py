@@ -198,6 +198,181 @@ CLOUDFLARE_BUCKET = os.getenv("CLOUDFLARE_BUCKET")
 UPSTASH_VECTOR_REST_URL = os.getenv("UPSTASH_VECTOR_REST_URL")
 UPSTASH_VECTOR_REST_TOKEN = os.getenv("UPSTASH_VECTOR_REST_TOKEN")
 
+######################################################################
+# Background jobs (manage.py run_workers)
+######################################################################
+# Сколько задач (нарезок) выполняется одновременно
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+# Сколько раз пробовать задачу, прежде чем пометить ее FAILED
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Задержка перед повтором в секундах; удваивается с каждой попыткой
+JOB_RETRY_BACKOFF = int(os.getenv("JOB_RETRY_BACKOFF", 60))
+JOB_RETRY_BACKOFF_MAX = int(os.getenv("JOB_RETRY_BACKOFF_MAX", 3600))
+# Как часто воркер отмечается в задаче и через сколько молчания задача считается брошенной
+JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", 30))
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", 300))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+
+######################################################################
+# Tiling
+######################################################################
+# auto — потоковая нарезка без копии, с откатом на временный .v для неподходящих форматов;
+# stream / copy — принудительно один из путей
+TILING_MODE = os.getenv("TILING_MODE", "auto")
+# Где создавать временные файлы .v (None — системный каталог tmp)
+TILING_SCRATCH_DIR = os.getenv("TILING_SCRATCH_DIR") or None
+# Строить нижние уровни DZI из готовых обзоров пирамидальных TIFF / COG
+TILING_REUSE_PYRAMID = os.getenv("TILING_REUSE_PYRAMID", "1") == "1"
+# Изображения от этого размера (в пикселях) режутся полосами с контрольными точками,
+# чтобы после падения продолжить, а не начинать заново
+TILING_CHECKPOINT_MIN_PIXELS = int(os.getenv("TILING_CHECKPOINT_MIN_PIXELS", 1_000_000_000))
+# Пропуск пустых тайлов (Image.skip_blank_tiles): тайл считается пустым, если все его
+# пиксели отличаются от цвета фона не больше чем на порог
+TILING_BLANK_BACKGROUND = int(os.getenv("TILING_BLANK_BACKGROUND", 0))
+TILING_BLANK_THRESHOLD = int(os.getenv("TILING_BLANK_THRESHOLD", 5))
+# Общее хранилище уникальных тайлов для дедупликации (Image.dedup_tiles); тайлы
+# изображений — жесткие ссылки на файлы отсюда, поэтому оно на той же ФС, что и MEDIA_ROOT
+TILE_DEDUP_DIR = os.getenv("TILE_DEDUP_DIR", str(MEDIA_ROOT / "tiles" / "_blobs"))
+# Изображения от этого размера (в пикселях) режутся распределенно: верхний уровень делится
+# на области по TILING_REGION_TILES x TILING_REGION_TILES тайлов, которые разбирают все воркеры
+# очереди (в том числе на других машинах с общим MEDIA_ROOT). 0 — выключено
+TILING_DISTRIBUTED_MIN_PIXELS = int(os.getenv("TILING_DISTRIBUTED_MIN_PIXELS", 0))
+TILING_REGION_TILES = int(os.getenv("TILING_REGION_TILES", 32))
+# Как часто (в секундах) записывать в БД прогресс нарезки
+TILING_PROGRESS_INTERVAL = float(os.getenv("TILING_PROGRESS_INTERVAL", 5))
+
+# Тайлы "на лету" (DziView): изображение доступно в API сразу после загрузки,
+# еще до окончания нарезки
+TILES_ON_DEMAND = os.getenv("TILES_ON_DEMAND", "1") == "1"
+# Кэш отрендеренных тайлов: в памяти каждого процесса и общий на диске
+TILE_CACHE_MEMORY_BYTES = int(os.getenv("TILE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+TILE_CACHE_DISK_BYTES = int(os.getenv("TILE_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", str(BASE_DIR / "tile_cache"))
+
+######################################################################
+# Cache
+######################################################################
+# Кэш ответов API чтения (app/response_cache.py). По умолчанию — в памяти процесса;
+# для общего кэша на все воркеры: API_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# и API_CACHE_LOCATION=redis://host:6379/1 (размер тогда ограничивает maxmemory Redis)
+# или файловый django.core.cache.backends.filebased.FileBasedCache с каталогом в LOCATION
+API_CACHE_ENABLED = os.getenv("API_CACHE_ENABLED", "1") == "1"
+API_CACHE_ALIAS = "api"
+API_CACHE_BACKEND = os.getenv("API_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache")
+# Сколько ответов держать в locmem/файловом кэше; при переполнении вытесняется
+# 1/API_CACHE_CULL_FREQUENCY записей (в locmem — самые давно не читанные)
+API_CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", 5000))
+API_CACHE_CULL_FREQUENCY = int(os.getenv("API_CACHE_CULL_FREQUENCY", 4))
+# Ключи версионные, устаревшие записи не читаются, поэтому срок жизни может быть большим
+API_CACHE_TIMEOUT = int(os.getenv("API_CACHE_TIMEOUT", 24 * 3600))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    API_CACHE_ALIAS: {
+        "BACKEND": API_CACHE_BACKEND,
+        "LOCATION": os.getenv("API_CACHE_LOCATION", "api-responses"),
+        "TIMEOUT": API_CACHE_TIMEOUT,
+    },
+}
+if API_CACHE_BACKEND.endswith(("LocMemCache", "FileBasedCache")):
+    CACHES[API_CACHE_ALIAS]["OPTIONS"] = {
+        "MAX_ENTRIES": API_CACHE_MAX_ENTRIES,
+        "CULL_FREQUENCY": API_CACHE_CULL_FREQUENCY,
+    }
+
+######################################################################
+# Markers
+######################################################################
+# Сколько маркеров встраивать в ответ /api/images/<id>/ (остальные — через запрос по видимой области)
+MARKERS_EMBED_LIMIT = int(os.getenv("MARKERS_EMBED_LIMIT", 200))
+# Максимум маркеров в одном ответе /api/images/<id>/markers/viewport/
+MARKERS_VIEWPORT_LIMIT = int(os.getenv("MARKERS_VIEWPORT_LIMIT", 1000))
+# Кластеры маркеров хранятся для уровней сетки 0..MARKER_CLUSTER_MAX_LEVEL (zoom до MAX_LEVEL - 4);
+# на более крупном масштабе /clusters/ отдает сами маркеры
+MARKER_CLUSTER_MAX_LEVEL = int(os.getenv("MARKER_CLUSTER_MAX_LEVEL", 10))
+# Максимум кластеров в одном ответе /api/images/<id>/markers/clusters/
+MARKER_CLUSTERS_VIEWPORT_LIMIT = int(os.getenv("MARKER_CLUSTERS_VIEWPORT_LIMIT", 1000))
+# Чат маркера отдается страницами по курсору: размер страницы по умолчанию
+# (и в /api/markers/<id>/) и наибольший, который можно запросить через ?limit=
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", 50))
+CHAT_PAGE_MAX_SIZE = int(os.getenv("CHAT_PAGE_MAX_SIZE", 200))
+# Галерея /api/gallery/ отдается страницами по курсору: размер страницы по умолчанию,
+# наибольший через ?limit= и сколько секунд кэшируется оценка общего числа изображений
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", 24))
+GALLERY_PAGE_MAX_SIZE = int(os.getenv("GALLERY_PAGE_MAX_SIZE", 100))
+GALLERY_TOTAL_TTL = int(os.getenv("GALLERY_TOTAL_TTL", 60))
+# Массовый импорт маркеров/объектов (manage.py bulk_import, /api/images/<id>/import/):
+# строк в одной транзакции и сколько ошибок в строках возвращать в отчете
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", 5000))
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", 100))
+
+######################################################################
+# Vector search (app/vectors.py)
+######################################################################
+# app.vectors.LocalVectorIndex — вектора в файлах VECTOR_INDEX_DIR, отображенных в память
+# (без сети, годится для тестов и разработки); app.vectors.UpstashVectorIndex — Upstash Vector
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "app.vectors.LocalVectorIndex")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", str(BASE_DIR / "vector_index"))
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", 256))
+# Сколько ближайших списков IVF просматривает поиск (больше — точнее и медленнее);
+# действует, только если индекс обучен (manage.py train_vector_index)
+VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", 8))
+# Поиск объектов в видимой области (/api/images/<id>/objects/search/): результатов по умолчанию
+# и наибольшее число через ?limit=; до OBJECT_SEARCH_PREFILTER_MAX объектов в области оцениваются
+# только их вектора, при большем — поиск по всему индексу с запасом x OBJECT_SEARCH_OVERFETCH
+OBJECT_SEARCH_LIMIT = int(os.getenv("OBJECT_SEARCH_LIMIT", 20))
+OBJECT_SEARCH_MAX_LIMIT = int(os.getenv("OBJECT_SEARCH_MAX_LIMIT", 100))
+OBJECT_SEARCH_PREFILTER_MAX = int(os.getenv("OBJECT_SEARCH_PREFILTER_MAX", 5000))
+OBJECT_SEARCH_OVERFETCH = int(os.getenv("OBJECT_SEARCH_OVERFETCH", 10))
+# Эмбеддер описаний объектов (app/embeddings.py): app.embeddings.HashingEmbedder — локальный
+# и детерминированный (тесты, разработка); app.embeddings.GeminiEmbedder — модель EMBEDDING_MODEL
+EMBEDDER = os.getenv("EMBEDDER", "app.embeddings.HashingEmbedder")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Текстов в одном запросе к эмбеддеру и сколько таких запросов идет одновременно
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+
+######################################################################
+# Full-text search (app/fulltext.py; FTS5 в SQLite, tsvector в PostgreSQL)
+######################################################################
+# /api/images/<id>/search/: результатов на странице по умолчанию и наибольшее число через ?limit=
+FULLTEXT_PAGE_SIZE = int(os.getenv("FULLTEXT_PAGE_SIZE", 20))
+FULLTEXT_PAGE_MAX_SIZE = int(os.getenv("FULLTEXT_PAGE_MAX_SIZE", 100))
+# Слов во фрагменте текста вокруг найденного и сколько лучших совпадений показывает поиск в админке
+FULLTEXT_SNIPPET_WORDS = int(os.getenv("FULLTEXT_SNIPPET_WORDS", 24))
+FULLTEXT_ADMIN_MAX = int(os.getenv("FULLTEXT_ADMIN_MAX", 1000))
+
+######################################################################
+# AI answers (app/ai.py, /api/markers/<id>/ask/)
+######################################################################
+# app.ai.GeminiClient — модель AI_MODEL (ключ GEMINI_API_KEY);
+# app.ai.EchoClient — локальная подделка без сети (тесты, разработка)
+AI_CLIENT = os.getenv("AI_CLIENT", "app.ai.GeminiClient")
+AI_MODEL = os.getenv("AI_MODEL", "gemini-1.5-flash")
+# Сколько секунд ждать модель (и одинаковый вопрос, который уже ждет ее) и наибольшая длина вопроса
+AI_REQUEST_TIMEOUT = int(os.getenv("AI_REQUEST_TIMEOUT", 60))
+AI_PROMPT_MAX_LENGTH = int(os.getenv("AI_PROMPT_MAX_LENGTH", 2000))
+# Кэш ответов в памяти процесса: сколько секунд ответ годен и сколько ответов хранится (LRU)
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 3600))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", 1000))
+
+######################################################################
+# Live events (SSE, app/events.py; нужен ASGI-сервер)
+######################################################################
+# app.events.LocalBroker — события видны только в своем процессе (один процесс ASGI);
+# app.events.RedisBroker — через Redis pub/sub для нескольких процессов/машин
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "app.events.LocalBroker")
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", "redis://localhost:6379/0")
+# Очередь одного подписчика; при переполнении поток закрывается, клиент догоняет по Last-Event-ID
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+# Пинг для прокси, время жизни одного потока (потом браузер переподключается) и пауза перед переподключением
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", 15))
+EVENTS_STREAM_TIMEOUT = float(os.getenv("EVENTS_STREAM_TIMEOUT", 300))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+
 # google_creds_path_str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", str(BASE_DIR / "secrets/lovinad-53c3a36409cd.json"))
 # if Path(google_creds_path_str).exists():
 #     os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = google_creds_path_str
@@ -225,6 +400,12 @@ UNFOLD = {
                         "link": reverse_lazy("admin:app_image_changelist"),
                         "permission": lambda request: request.user.is_staff,
                     },
+                    {
+                        "title": "Фоновые задачи",
+                        "icon": "pending_actions",
+                        "link": reverse_lazy("admin:app_job_changelist"),
+                        "permission": lambda request: request.user.is_staff,
+                    },
                 ]
             },
             {
@@ -1,12 +1,17 @@
 # app/signals.py
 
-import sys
-import subprocess
 from django.db import transaction  # <--- НОВЫЙ ИМПОРТ
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Image
+from .models import Comment, Image, PointOfInterest, SearchableObject
+from .clusters import add_point, remove_point
+from .events import comment_event, image_channel, marker_channel, marker_event, publish
+from .embeddings import enqueue_embedding, needs_embedding
+from .fulltext import index_documents, unindex_documents
+from .vectors import get_vector_index
+from .versions import touch, version_bump
+from .jobs import enqueue_job
 import tifffile
 
 def process_image_task(image_id):
@@ -24,22 +29,19 @@ def process_image_task(image_id):
     try:
         with tifffile.TiffFile(instance.source_file.path) as tif:
             print(f"Файл {instance.source_file.path} успешно открыт как TIFF для обработки.")
+            # Размеры из заголовка нужны сразу: маркеры и тайлы "на лету" работают до конца нарезки
+            page = tif.pages[0]
+            Image.objects.filter(id=instance.id).update(width=page.imagewidth, height=page.imagelength, **version_bump())
     except Exception as e:
         print(f"ОШИБКА: Файл {instance.source_file.path} не является валидным TIFF. Ошибка: {e}")
         instance.status = 'FAILED'
         instance.save()
         return
 
-    # Запуск тяжелого процесса нарезки
-    command = [
-        sys.executable,
-        str(settings.BASE_DIR / "manage.py"),
-        "process_image",
-        str(instance.id)
-    ]
-    
-    print(f'Запуск фонового процесса: {" ".join(command)}')
-    subprocess.Popen(command)
+    # Ставим нарезку в очередь. Ее выполнит один из воркеров `manage.py run_workers`,
+    # поэтому одновременно идет не больше JOB_WORKER_CONCURRENCY тяжелых задач.
+    job = enqueue_job('process_image', image=instance)
+    print(f'Нарезка изображения {instance.id} поставлена в очередь (задача #{job.id}).')
 
 
 @receiver(post_save, sender=Image)
@@ -53,4 +55,159 @@ def start_image_processing(sender, instance, created, **kwargs):
         # --- ГЛАВНОЕ ИЗМЕНЕНИЕ ---
         # Мы говорим Django: "Когда текущая транзакция (сохранение модели и файла)
         # будет успешно завершена, вызови функцию process_image_task".
-        transaction.on_commit(lambda: process_image_task(instance.id))
\ No newline at end of file
+        transaction.on_commit(lambda: process_image_task(instance.id))
+
+
+# =====================================================================
+# Кластеры маркеров обновляются приращениями при каждом изменении точки
+# =====================================================================
+@receiver(pre_save, sender=PointOfInterest)
+def remember_point_position(sender, instance, **kwargs):
+    # Прежние координаты нужны, чтобы при перемещении вычесть точку из старых ячеек
+    instance._previous_position = (
+        PointOfInterest.objects.filter(id=instance.id).values_list('x', 'y', 'cell').first() if instance.id else None
+    )
+
+
+@receiver(post_save, sender=PointOfInterest)
+def update_clusters_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_position', None)
+    if previous is not None:
+        if previous == (instance.x, instance.y, instance.cell):
+            return
+        remove_point(instance.image_id, instance.id, *previous)
+    add_point(instance)
+
+
+@receiver(post_delete, sender=PointOfInterest)
+def update_clusters_on_delete(sender, instance, origin=None, **kwargs):
+    # Удаляется все изображение: его кластеры уходят каскадом, пересчитывать нечего
+    if isinstance(origin, Image) or getattr(origin, 'model', None) is Image:
+        return
+    remove_point(instance.image_id, instance.id, instance.x, instance.y, instance.cell)
+
+
+# =====================================================================
+# Штампы версий для ETag (app/versions.py): изображение меняется вместе со
+# своими маркерами (они встроены в его ответ), маркер — вместе с чатом
+# =====================================================================
+@receiver(post_save, sender=Image)
+def bump_image_version(sender, instance, **kwargs):
+    touch(Image, instance.id, instance)
+
+
+@receiver(post_save, sender=PointOfInterest)
+def bump_point_version_on_save(sender, instance, **kwargs):
+    touch(PointOfInterest, instance.id, instance)
+    touch(Image, instance.image_id)
+
+
+@receiver(post_delete, sender=PointOfInterest)
+def bump_image_version_on_point_delete(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Image) or getattr(origin, 'model', None) is Image:
+        return
+    touch(Image, instance.image_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_point_version_on_comment(sender, instance, **kwargs):
+    touch(PointOfInterest, instance.point_id)
+
+
+# =====================================================================
+# Живые события (app/events.py): новые сообщения чата и маркеры уходят
+# подписчикам только после коммита, когда их уже видят другие запросы
+# =====================================================================
+@receiver(post_save, sender=Comment)
+def publish_new_comment(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish(marker_channel(instance.point_id), comment_event(instance)))
+
+
+@receiver(post_save, sender=PointOfInterest)
+def publish_new_marker(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: publish(image_channel(instance.image_id), marker_event(instance, instance.image))
+        )
+
+
+# =====================================================================
+# Векторный индекс объектов поиска: изменившийся текст объекта ставит
+# в очередь пересчет эмбеддингов (app/embeddings.py), удаление объекта
+# сразу после коммита убирает его вектор из индекса (app/vectors.py)
+# =====================================================================
+@receiver(post_save, sender=SearchableObject)
+def embed_searchable_object(sender, instance, **kwargs):
+    if needs_embedding(instance):
+        transaction.on_commit(lambda: enqueue_embedding(instance.image))
+
+
+class VectorDeletes:
+    """Вектора объектов, удаленных в одной транзакции: после коммита — один delete() индекса."""
+
+    def __init__(self):
+        self.vector_ids = []
+
+    def __call__(self):
+        try:
+            get_vector_index().delete(self.vector_ids)
+        except Exception as e:
+            # Объекты уже удалены; вектор без объекта поиск отбрасывает
+            print(f"ОШИБКА: Не удалось удалить {len(self.vector_ids)} векторов из индекса: {e}")
+
+
+@receiver(post_delete, sender=SearchableObject)
+def unindex_searchable_object(sender, instance, using, **kwargs):
+    # Удаление тысяч объектов (каскадом вместе с изображением, из админки) не должно
+    # править файлы индекса тысячу раз: ключи копятся в одном обработчике on_commit.
+    # Общий обработчик — только в пределах той же точки сохранения: при ее откате
+    # он отбрасывается вместе с ключами объектов, которые на деле остались
+    connection = transaction.get_connection(using)
+    savepoint_ids = set(connection.savepoint_ids)
+    batch = next(
+        (
+            callback for sids, callback, robust in connection.run_on_commit
+            if isinstance(callback, VectorDeletes) and sids == savepoint_ids
+        ),
+        None,
+    )
+    # После delete() у экземпляра pk = None: ключ запоминаем сейчас
+    if batch is not None:
+        batch.vector_ids.append(instance.vector_id)
+        return
+    batch = VectorDeletes()
+    batch.vector_ids.append(instance.vector_id)
+    # Вне транзакции on_commit вызывает обработчик сразу, поэтому ключ добавлен до регистрации
+    transaction.on_commit(batch, using=using)
+
+
+# =====================================================================
+# Полнотекстовый поиск (app/fulltext.py): документ записи обновляется
+# в той же транзакции, что и сама запись
+# =====================================================================
+@receiver(post_save, sender=PointOfInterest)
+def index_marker_text(sender, instance, **kwargs):
+    index_documents('marker', [instance])
+
+
+@receiver(post_save, sender=Comment)
+def index_comment_text(sender, instance, **kwargs):
+    index_documents('comment', [instance])
+
+
+@receiver(post_save, sender=SearchableObject)
+def index_object_text(sender, instance, **kwargs):
+    index_documents('object', [instance])
+
+
+@receiver(post_delete, sender=PointOfInterest)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=SearchableObject)
+def unindex_text(sender, instance, origin=None, **kwargs):
+    # Документы удаляемого изображения уходят каскадом вместе с ним
+    if isinstance(origin, Image) or getattr(origin, 'model', None) is Image:
+        return
+    kind = {PointOfInterest: 'marker', Comment: 'comment', SearchableObject: 'object'}[sender]
+    unindex_documents(kind, [instance.pk])
@@ -0,0 +1,149 @@
+# app/spatial.py
+
+import math
+from django.db.models import F, Max, Min, Q, Value
+from django.db.models.functions import Coalesce
+
+# =====================================================================
+# Пространственный индекс маркеров
+# Нормированные координаты точки (x / ширина, y / высота) квантуются на
+# сетку 2^GRID_BITS x 2^GRID_BITS, номер ячейки — код Мортона (Z-порядок,
+# биты x и y через один). В Z-порядке любая ячейка грубой сетки — это
+# непрерывный отрезок номеров мелкой, поэтому прямоугольник видимой
+# области покрывается несколькими диапазонами по индексу (image, cell),
+# а точная проверка x/y отсекает лишнее по краям.
+# =====================================================================
+
+GRID_BITS = 16
+GRID_SIZE = 1 << GRID_BITS
+# Сколько ячеек прореживания приходится на ширину экрана (см. markers_in_bbox)
+THINNING_CELLS_PER_VIEW_BITS = 4
+
+
+def _spread_bits(value):
+    """0b1011 -> 0b1000101: биты значения через один (для кода Мортона)."""
+    value &= 0xFFFF
+    value = (value | (value << 8)) & 0x00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F
+    value = (value | (value << 2)) & 0x33333333
+    value = (value | (value << 1)) & 0x55555555
+    return value
+
+
+def morton_code(qx, qy):
+    return _spread_bits(qx) | (_spread_bits(qy) << 1)
+
+
+def quantize(value, bits=GRID_BITS):
+    """Нормированная координата [0, 1] -> номер ячейки сетки 2^bits."""
+    size = 1 << bits
+    return min(max(int(value * size), 0), size - 1)
+
+
+def cell_for(x, y, width, height):
+    """Ячейка точки (x, y) в пикселях изображения width x height; None, если размеры неизвестны."""
+    if not width or not height:
+        return None
+    return morton_code(quantize(x / width), quantize(y / height))
+
+
+def bbox_cell_ranges(min_x, min_y, max_x, max_y):
+    """
+    Покрывает нормированный прямоугольник ячейками сетки, чуть более крупными,
+    чем он сам (2-4 ячейки по каждой оси), и возвращает отрезки номеров
+    мелких ячеек [от, до), уже слитые там, где они идут подряд.
+    """
+    span = max(max_x - min_x, max_y - min_y, 1 / GRID_SIZE)
+    level = min(max(int(math.floor(-math.log2(span))) + 1, 0), GRID_BITS)
+    shift = 2 * (GRID_BITS - level)
+    ranges = []
+    for qy in range(quantize(min_y, level), quantize(max_y, level) + 1):
+        for qx in range(quantize(min_x, level), quantize(max_x, level) + 1):
+            code = morton_code(qx, qy)
+            ranges.append((code << shift, (code + 1) << shift))
+    ranges.sort()
+    merged = [list(ranges[0])]
+    for start, end in ranges[1:]:
+        if start == merged[-1][1]:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(item) for item in merged]
+
+
+def cell_ranges(image, bbox):
+    """Условие "ячейка записи изображения image в одном из отрезков, покрывающих bbox"."""
+    # image повторяется в каждом диапазоне: так планировщик (SQLite в том числе)
+    # проходит по индексу (image, cell) отдельным поиском на каждый отрезок
+    ranges = Q()
+    for start, end in bbox_cell_ranges(*bbox):
+        ranges |= Q(image=image, cell__gte=start, cell__lt=end)
+    return ranges
+
+
+def markers_in_bbox(image, bbox, zoom=None):
+    """
+    Точки изображения image внутри нормированного bbox = (min_x, min_y, max_x, max_y).
+    Если задан zoom (при zoom=z изображение занимает 2^z ширин экрана), на мелком
+    масштабе точки прореживаются: не больше одной на ячейку размером 1/16 экрана.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    width, height = image.width, image.height
+    queryset = image.points.model.objects.filter(cell_ranges(image, bbox)).filter(
+        x__gte=min_x * width, x__lte=max_x * width, y__gte=min_y * height, y__lte=max_y * height
+    )
+    if zoom is None:
+        return queryset
+    level = zoom + THINNING_CELLS_PER_VIEW_BITS
+    if level >= GRID_BITS:
+        return queryset
+    # В Z-порядке номер ячейки грубой сетки — это номер мелкой без младших бит
+    bucket_size = 1 << (2 * (GRID_BITS - level))
+    first_ids = (
+        queryset.order_by()
+        .values(bucket=F('cell') / bucket_size)
+        .annotate(first_id=Min('id'))
+        .values('first_id')
+    )
+    return queryset.model.objects.filter(id__in=first_ids)
+
+
+def objects_in_bbox(image, bbox):
+    """
+    Объекты поиска изображения image, чей прямоугольник (центр x, y, размер width x height)
+    пересекает нормированный bbox. Индекс (image, cell) построен по центрам, поэтому
+    bbox для диапазонов ячеек расширяется на половину самого большого объекта изображения
+    (максимумы берутся по индексам (image, width) и (image, height)), а точное пересечение
+    проверяется в том же запросе.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    width, height = image.width, image.height
+    objects = image.searchable_objects.model.objects
+    # По одному агрегату на запрос: SQLite берет MAX из индекса, только когда он единственный
+    half_width = (objects.filter(image=image).aggregate(value=Max('width'))['value'] or 0) / 2
+    half_height = (objects.filter(image=image).aggregate(value=Max('height'))['value'] or 0) / 2
+    expanded = (
+        max(min_x - half_width / width, 0.0), max(min_y - half_height / height, 0.0),
+        min(max_x + half_width / width, 1.0), min(max_y + half_height / height, 1.0),
+    )
+    return objects_overlapping(objects.filter(cell_ranges(image, expanded)), image, bbox)
+
+
+def objects_overlapping(queryset, image, bbox):
+    """Точная проверка пересечения прямоугольников объектов queryset с нормированным bbox, без индекса ячеек."""
+    min_x, min_y, max_x, max_y = bbox
+    width, height = image.width, image.height
+    # Сравниваем удвоенные координаты: края объекта x ± width/2 без дробей в SQL
+    object_width = Coalesce(F('width'), Value(0))
+    object_height = Coalesce(F('height'), Value(0))
+    return (
+        queryset
+        .alias(
+            left=2 * F('x') - object_width, right=2 * F('x') + object_width,
+            top=2 * F('y') - object_height, bottom=2 * F('y') + object_height,
+        )
+        .filter(
+            left__lte=2 * max_x * width, right__gte=2 * min_x * width,
+            top__lte=2 * max_y * height, bottom__gte=2 * min_y * height,
+        )
+    )
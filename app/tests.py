@@ -0,0 +1,1431 @@
+# app/tests.py
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+import pyvips
+import redis
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from .ai import AnswerCache, EchoClient, get_answer_cache
+from .bulk_import import import_rows
+from .clusters import rebuild_clusters
+from .embeddings import HashingEmbedder, embed_objects
+from .events import OVERFLOW, LocalBroker, RedisBroker, event_stream, publish
+from .fast_json import render_markers
+from .jobs import JOB_HANDLERS, claim_next_job, requeue_stale_jobs, retry_delay, run_job
+from .models import (
+    Comment, GeminiInteraction, Image, Job, MarkerCluster, PointOfInterest, SearchableObject, SearchDocument,
+)
+from .pagination import decode_cursor, encode_cursor, keyset_page, newest_first_page
+from .progress import ProgressRecorder, save_progress
+from .response_cache import api_cache, cache_stats
+from .tile_dedup import blob_path_for, dedup_file, tile_digest
+from .tile_cache import DiskLRU, MemoryLRU, TileCache
+from .tile_pack import TILE_NAME_RE, TilePack, build_pack_index, dedup_pack, open_pack
+from .tiling import TilingProgress, merge_regions, tile_options, tile_region, tile_resumable, tile_source, tiling_regions
+from .vectors import LocalVectorIndex, get_vector_index
+
+# =====================================================================
+# Бюджет запросов и планы выполнения для API
+# Каждый эндпоинт вызывается на данных из нескольких записей и должен
+# уложиться в фиксированное число запросов (N+1 сразу его превысит),
+# а ни один его запрос не должен читать таблицу целиком: для SQLite
+# проверяется EXPLAIN QUERY PLAN ("SCAN <таблица>" без индекса).
+# =====================================================================
+
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+class QueryRecorder:
+    """Запоминает SQL и параметры всех запросов (для EXPLAIN с теми же параметрами)."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class ApiQueryBudgetTests(TestCase):
+    markers = 5
+    comments = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Галактика', width=10_000, height=8_000, status='COMPLETED')
+        Image.objects.create(name='Туманность', width=5_000, height=5_000, status='COMPLETED')
+        Image.objects.create(name='В работе', status='PENDING')
+        cls.points = [
+            PointOfInterest.objects.create(image=cls.image, x=1_000 * i, y=700 * i, name=f'Точка {i}')
+            for i in range(cls.markers)
+        ]
+        cls.point = cls.points[0]
+        for i in range(cls.comments):
+            Comment.objects.create(point=cls.point, author_name='Автор', text=f'Сообщение {i}')
+
+    def setUp(self):
+        api_cache().clear()
+
+    def request(self, method, url, budget, **kwargs):
+        """Выполняет запрос, проверяет число запросов к БД и их планы; возвращает ответ."""
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder), self.assertNumQueries(budget):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content[:500])
+        self.assertNoFullScans(recorder.queries)
+        return response
+
+    def assertNoFullScans(self, queries):
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params or ())
+                for row in cursor.fetchall():
+                    match = FULL_SCAN.match(row[-1])
+                    if match and match.group(1).startswith('app_'):
+                        self.fail(f'Полный просмотр {match.group(1)}:\n{sql}')
+
+    # --- Чтение -----------------------------------------------------------
+
+    def test_gallery(self):
+        # Страница (она же штамп ETag) и оценка общего числа
+        response = self.request('get', '/api/gallery/?limit=1', 2)
+        page = response.json()
+        self.assertEqual((len(page['images']), page['total'], page['hasMore']), (1, 2, True))
+        # Следующая страница: оценка числа уже в кэше
+        response = self.request('get', f'/api/gallery/?limit=1&cursor={page["next"]}', 1)
+        self.assertEqual(response.json()['hasMore'], False)
+        self.assertNotEqual(response.json()['images'], page['images'])
+        response = self.request('get', '/api/gallery/?status=PENDING&name=В%20раб', 2)
+        self.assertEqual(response.json()['total'], 1)
+
+    @override_settings(API_CACHE_ENABLED=False)
+    def test_image_detail(self):
+        # Штамп версии, изображение, встроенные маркеры, их общее число
+        response = self.request('get', f'/api/images/{self.image.id}/', 4)
+        self.assertEqual(len(response.json()['markers']), self.markers)
+
+    @override_settings(API_CACHE_ENABLED=False)
+    def test_marker_detail(self):
+        # Штамп версии, маркер, последняя страница чата
+        response = self.request('get', f'/api/markers/{self.point.id}/', 3)
+        self.assertEqual(len(response.json()['chat']), self.comments)
+
+    def test_cached_image_detail(self):
+        self.client.get(f'/api/images/{self.image.id}/')
+        # Повтор из кэша ответов: только штамп версии
+        self.request('get', f'/api/images/{self.image.id}/', 1)
+
+    def test_not_modified(self):
+        etag = self.client.get(f'/api/markers/{self.point.id}/')['ETag']
+        response = self.request('get', f'/api/markers/{self.point.id}/', 1, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_chat_pages(self):
+        response = self.request('get', f'/api/markers/{self.point.id}/chat/?limit=2', 2)
+        page = response.json()
+        self.assertTrue(page['hasMore'])
+        self.request('get', f'/api/markers/{self.point.id}/chat/?before={page["before"]}&limit=2', 2)
+        self.request('get', f'/api/markers/{self.point.id}/chat/?since={page["since"]}', 2)
+
+    def test_viewport(self):
+        response = self.request('get', f'/api/images/{self.image.id}/markers/viewport/?bbox=0,0,0.25,0.25', 2)
+        self.assertEqual(len(response.json()['markers']), 3)
+        # С прореживанием по ячейкам
+        self.request('get', f'/api/images/{self.image.id}/markers/viewport/?bbox=0,0,1,1&zoom=0', 2)
+
+    def test_clusters(self):
+        response = self.request('get', f'/api/images/{self.image.id}/markers/clusters/?zoom=0', 2)
+        self.assertEqual(sum(cluster['count'] for cluster in response.json()['clusters']), self.markers)
+        # Крупный масштаб: сами маркеры
+        self.request('get', f'/api/images/{self.image.id}/markers/clusters/?zoom=10&bbox=0,0,0.1,0.1', 2)
+
+    def test_status(self):
+        self.request('get', f'/api/images/{self.image.id}/status/', 1)
+
+    # --- Запись -----------------------------------------------------------
+
+    def test_chat_message_create(self):
+        # Маркер, вставка сообщения, версия маркера, документ поиска
+        self.request(
+            'post', f'/api/markers/{self.point.id}/chat/', 4, data={'user': 'Гость', 'text': 'Привет'}
+        )
+
+    def test_marker_create(self):
+        # Изображение и вставка точки, затем сигналы: кластеры всех уровней одним UPDATE
+        # и одной вставкой, версии точки и изображения, документ поиска
+        self.request(
+            'post', f'/api/images/{self.image.id}/markers/', 14,
+            data={'title': 'Новая', 'description': '', 'x': 0.9, 'y': 0.9, 'user': 'Гость'},
+        )
+
+    def test_bulk_import(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        rows = 'x,y,title\n' + ''.join(f'{i * 10},{i * 10},Источник {i}\n' for i in range(50))
+        upload = io.BytesIO(rows.encode())
+        upload.name = 'catalogue.csv'
+        # Сессия и пользователь, изображение, вставка пачкой, документы поиска пачкой, число точек,
+        # пересчет кластеров (удаление и по вставке на уровень), версия изображения — от числа строк не зависит
+        response = self.request('post', f'/api/images/{self.image.id}/import/', 23, data={'file': upload})
+        self.assertEqual(response.json()['created'], 50)
+
+    # --- Админка ----------------------------------------------------------
+
+    def test_admin_changelists(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(User.objects.get(username='admin'))
+        # Число запросов списка не зависит от числа строк: __str__ точки читает изображение,
+        # и оно должно приходить JOIN-ом (select_related списка), а не запросом на строку
+        for url in ('/admin/app/pointofinterest/', '/admin/app/comment/'):
+            with CaptureQueriesContext(connection) as few:
+                self.client.get(url)
+            Comment.objects.create(point=self.points[-1], author_name='Автор', text='Еще')
+            PointOfInterest.objects.create(image=self.image, x=1, y=1, name='Еще')
+            with self.assertNumQueries(len(few.captured_queries)):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+
+# =====================================================================
+# Условные GET (app/versions.py) и кэш ответов (app/response_cache.py)
+# =====================================================================
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Галактика', width=1_000, height=1_000, status='COMPLETED')
+        cls.point = PointOfInterest.objects.create(image=cls.image, x=100, y=100, name='Точка')
+        cls.image_url = f'/api/images/{cls.image.id}/'
+        cls.marker_url = f'/api/markers/{cls.point.id}/'
+
+    def setUp(self):
+        api_cache().clear()
+
+    def assertChanged(self, url, etag):
+        """Запись изменилась: старый If-None-Match получает полный ответ с новым ETag."""
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        return response.json()
+
+    def test_comment_changes_marker_etag(self):
+        etag = self.client.get(self.marker_url)['ETag']
+        self.client.post(f'/api/markers/{self.point.id}/chat/', {'user': 'Гость', 'text': 'Привет'})
+        data = self.assertChanged(self.marker_url, etag)
+        self.assertEqual([message['text'] for message in data['chat']], ['Привет'])
+
+    def test_new_marker_changes_image_etag(self):
+        etag = self.client.get(self.image_url)['ETag']
+        self.client.post(
+            f'/api/images/{self.image.id}/markers/',
+            {'title': 'Новая', 'description': '', 'x': 0.5, 'y': 0.5, 'user': 'Гость'},
+        )
+        self.assertEqual(self.assertChanged(self.image_url, etag)['markersTotal'], 2)
+
+    def test_deleted_marker_changes_image_etag(self):
+        etag = self.client.get(self.image_url)['ETag']
+        self.point.delete()
+        self.assertEqual(self.assertChanged(self.image_url, etag)['markers'], [])
+
+    def test_rename_changes_image_etag(self):
+        etag = self.client.get(self.image_url)['ETag']
+        # Устаревший экземпляр: save() возвращает счетчику прежнее значение, но не время изменения
+        stale = Image.objects.get(id=self.image.id)
+        self.image.name = 'Первое имя'
+        self.image.save()
+        stale.name = 'Переименована'
+        stale.save()
+        self.assertEqual(self.assertChanged(self.image_url, etag)['name'], 'Переименована')
+
+    def test_deleted_image_is_not_served_as_not_modified(self):
+        etag = self.client.get(self.image_url)['ETag']
+        self.image.delete()
+        self.assertEqual(self.client.get(self.image_url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Галактика', width=1_000, height=1_000, status='COMPLETED')
+        cls.points = [
+            PointOfInterest.objects.create(image=cls.image, x=100 * i, y=100 * i, name=f'Точка {i}') for i in range(6)
+        ]
+
+    def setUp(self):
+        api_cache().clear()
+
+    def get_marker(self, point):
+        return self.client.get(f'/api/markers/{point.id}/').json()
+
+    def test_write_misses_old_entry(self):
+        point = self.points[0]
+        self.get_marker(point)
+        self.get_marker(point)
+        self.assertEqual(cache_stats()['marker'], {'hits': 1, 'misses': 1, 'hitRate': 0.5})
+        # Новая версия маркера — новый ключ: старая запись не читается и не нужна
+        point.name = 'Переименована'
+        point.save()
+        self.assertEqual(self.get_marker(point)['title'], 'Переименована')
+        self.assertEqual(self.get_marker(point)['title'], 'Переименована')
+        self.assertEqual(cache_stats()['marker'], {'hits': 2, 'misses': 2, 'hitRate': 0.5})
+
+    def test_stats_view(self):
+        self.get_marker(self.points[0])
+        self.get_marker(self.points[0])
+        self.client.get(f'/api/images/{self.image.id}/')
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, 403)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(User.objects.get(username='admin'))
+        stats = self.client.get('/api/cache/stats/').json()
+        self.assertEqual(stats['marker'], {'hits': 1, 'misses': 1, 'hitRate': 0.5})
+        self.assertEqual(stats['image'], {'hits': 0, 'misses': 1, 'hitRate': 0.0})
+        self.assertEqual(self.client.delete('/api/cache/stats/').status_code, 204)
+        stats = self.client.get('/api/cache/stats/').json()
+        self.assertEqual(stats['marker'], {'hits': 0, 'misses': 0, 'hitRate': None})
+
+    def test_entries_are_evicted(self):
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'api': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api-eviction',
+                'OPTIONS': {'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2},
+            },
+        }
+        with override_settings(CACHES=caches):
+            for point in self.points:
+                self.get_marker(point)
+            # Сверх MAX_ENTRIES вытесняются давние ответы, недавние остаются
+            self.get_marker(self.points[-1])
+            self.assertEqual(cache_stats()['marker']['hits'], 1)
+            self.get_marker(self.points[0])
+            self.assertEqual(cache_stats()['marker']['misses'], len(self.points) + 1)
+
+
+# =====================================================================
+# Полнотекстовый поиск (app/fulltext.py)
+# =====================================================================
+
+class FulltextSearchTests(TestCase):
+    request = ApiQueryBudgetTests.request
+    assertNoFullScans = ApiQueryBudgetTests.assertNoFullScans
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Небо', width=1_000, height=2_000, status='COMPLETED')
+        cls.other = Image.objects.create(name='Другое небо', width=1_000, height=1_000, status='COMPLETED')
+        cls.marker = PointOfInterest.objects.create(
+            image=cls.image, x=100, y=200, name='Туманность Ориона', description='Область звездообразования'
+        )
+        cls.point = PointOfInterest.objects.create(image=cls.image, x=500, y=500, name='Вега', description='')
+        cls.comment = Comment.objects.create(point=cls.point, author_name='Гость', text='Рядом видна тёмная туманность')
+        cls.object = SearchableObject.objects.create(
+            image=cls.image, name='M42', object_type='туманность', description='Диффузная туманность', x=300, y=400
+        )
+        PointOfInterest.objects.create(image=cls.other, x=1, y=1, name='Туманность Киля')
+        cls.url = f'/api/images/{cls.image.id}/search/'
+
+    def test_ranked_results_of_one_image(self):
+        # Изображение, поиск, координаты маркеров, сообщений и объектов
+        response = self.request('get', f'{self.url}?q=туман', 5)
+        results = response.json()['results']
+        self.assertEqual(
+            {(result['type'], result['id']) for result in results},
+            {('marker', str(self.marker.id)), ('comment', str(self.comment.id)), ('object', str(self.object.vector_id))},
+        )
+        # Совпадение в заголовке весит больше, чем в тексте
+        self.assertEqual(results[0]['type'], 'marker')
+        self.assertEqual([result['score'] for result in results], sorted((r['score'] for r in results), reverse=True))
+        comment = next(result for result in results if result['type'] == 'comment')
+        self.assertEqual((comment['markerId'], comment['x'], comment['y']), (self.point.id, 0.5, 0.25))
+        # Все слова обязательны, "ё" и "е" не различаются
+        response = self.client.get(f'{self.url}?q=темная туманность&type=comment,marker')
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.comment.id)])
+
+    def test_pages(self):
+        first = self.client.get(f'{self.url}?q=туманность&limit=2').json()
+        self.assertEqual((len(first['results']), first['next'], first['hasMore']), (2, 2, True))
+        second = self.client.get(f'{self.url}?q=туманность&limit=2&offset={first["next"]}').json()
+        self.assertEqual((len(second['results']), second['hasMore']), (1, False))
+        found = {(result['type'], result['id']) for result in first['results'] + second['results']}
+        self.assertEqual(len(found), 3)
+
+    def test_index_follows_changes(self):
+        self.marker.name = 'Пояс Ориона'
+        self.marker.save()
+        self.comment.delete()
+        self.object.delete()
+        response = self.client.get(f'{self.url}?q=туманность')
+        self.assertEqual(response.json()['results'], [])
+        response = self.client.get(f'{self.url}?q=пояс')
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.marker.id)])
+        # Массовый импорт пишет документы пачками
+        import_rows(self.image, io.StringIO('x,y,title\n10,10,Крабовидная туманность\n'), log=lambda message: None)
+        response = self.client.get(f'{self.url}?q=крабовидная')
+        self.assertEqual(len(response.json()['results']), 1)
+        # Удаление изображения уносит его документы
+        self.image.delete()
+        self.assertFalse(SearchDocument.objects.exclude(image=self.other).exists())
+
+    def test_errors(self):
+        for query in ('', 'q=', 'q=!!!', 'q=туман&type=image', 'q=туман&offset=-1'):
+            self.assertEqual(self.client.get(f'{self.url}?{query}').status_code, 400, query)
+        self.assertEqual(self.client.get('/api/images/0/search/?q=туман').status_code, 404)
+
+    def test_admin_search_uses_index(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(User.objects.get(username='admin'))
+        response = self.client.get('/admin/app/comment/?q=туманн')
+        self.assertEqual(list(response.context['cl'].result_list), [self.comment])
+        response = self.client.get('/admin/app/pointofinterest/?q=туманность')
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        response = self.client.get('/admin/app/searchableobject/?q=диффузная')
+        self.assertEqual(list(response.context['cl'].result_list), [self.object])
+
+    def test_admin_search_by_related_names(self):
+        # Названия изображения и точки не в индексе — их ищет icontains вместе с индексом
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(User.objects.get(username='admin'))
+        response = self.client.get('/admin/app/pointofinterest/?q=Другое')
+        self.assertEqual([point.name for point in response.context['cl'].result_list], ['Туманность Киля'])
+        response = self.client.get('/admin/app/comment/?q=Вега')
+        self.assertEqual(list(response.context['cl'].result_list), [self.comment])
+        PointOfInterest.objects.filter(id=self.point.id).update(owner_name='Галилей')
+        response = self.client.get('/admin/app/pointofinterest/?q=Галилей')
+        self.assertEqual(list(response.context['cl'].result_list), [self.point])
+
+    @override_settings(FULLTEXT_ADMIN_MAX=1)
+    def test_admin_search_warns_about_cap(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(User.objects.get(username='admin'))
+        response = self.client.get('/admin/app/pointofinterest/?q=туманность')
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        self.assertIn('показаны 1 лучших совпадений', ' '.join(str(message) for message in response.context['messages']))
+        response = self.client.get('/admin/app/pointofinterest/?q=Вега')
+        self.assertEqual(list(response.context['messages']), [])
+
+    def test_search_is_public(self):
+        self.client.logout()
+        response = self.client.get(f'{self.url}?q=туман')
+        self.assertEqual(response.status_code, 200)
+
+
+# =====================================================================
+# Локальный векторный индекс (app/vectors.py)
+# =====================================================================
+
+class LocalVectorIndexTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.index = LocalVectorIndex(self.path, dimensions=16)
+        rng = np.random.default_rng(1)
+        self.ids = [uuid.uuid4() for _ in range(300)]
+        self.vectors = rng.standard_normal((300, 16)).astype(np.float32)
+        self.index.upsert(zip(self.ids, self.vectors))
+
+    def test_exact_search(self):
+        results = self.index.search(self.vectors[7], k=3, exact=True)
+        self.assertEqual(results[0][0], self.ids[7])
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertGreaterEqual(results[1][1], results[2][1])
+
+    def test_upsert_replaces_and_delete_frees_slot(self):
+        self.index.upsert([(self.ids[0], self.vectors[1])])
+        self.index.delete([self.ids[1], uuid.uuid4()])
+        self.assertEqual(len(self.index), 299)
+        self.assertEqual(self.index.search(self.vectors[1], k=1)[0][0], self.ids[0])
+        # Свободный слот занимает новый вектор, файлы не растут
+        self.index.upsert([(uuid.uuid4(), self.vectors[2])])
+        self.assertEqual(self.index.refresh()['meta']['count'], 300)
+
+    def test_other_process_sees_writes(self):
+        reader = LocalVectorIndex(self.path, dimensions=16)
+        self.assertEqual(len(reader), 300)
+        new_id = uuid.uuid4()
+        self.index.upsert([(new_id, -self.vectors[5])])
+        self.assertEqual(reader.search(-self.vectors[5], k=1)[0][0], new_id)
+
+    def test_ivf(self):
+        lists = self.index.train(lists=8)
+        # Все списки — тот же ответ, что у точного перебора
+        for vector in self.vectors[:20]:
+            self.assertEqual(
+                self.index.search(vector, k=5, nprobe=lists), self.index.search(vector, k=5, exact=True)
+            )
+        # Новые вектора после обучения попадают в свои списки
+        new_id = uuid.uuid4()
+        self.index.upsert([(new_id, self.vectors[9] * 2)])
+        self.assertIn(new_id, [vector_id for vector_id, score in self.index.search(self.vectors[9], k=2, nprobe=2)])
+
+    def test_dimension_mismatch(self):
+        with self.assertRaises(ValueError):
+            LocalVectorIndex(self.path, dimensions=32).search(np.ones(32))
+
+
+# =====================================================================
+# Конвейер эмбеддингов (app/embeddings.py)
+# =====================================================================
+
+class CountingEmbedder(HashingEmbedder):
+    """Локальный эмбеддер, который запоминает размеры пачек."""
+    batches = []
+
+    def embed(self, texts, query=False):
+        self.batches.append(len(texts))
+        return super().embed(texts, query)
+
+
+@override_settings(EMBEDDER='app.tests.CountingEmbedder')
+class EmbeddingPipelineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Небо', width=100, height=100, status='COMPLETED')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        index_dir = override_settings(VECTOR_INDEX_DIR=directory.name)
+        index_dir.enable()
+        self.addCleanup(index_dir.disable)
+        CountingEmbedder.batches = []
+
+    def create_objects(self, count):
+        return SearchableObject.objects.bulk_create([
+            SearchableObject(image=self.image, name=f'Звезда {i}', description=f'Желтый карлик {i}', x=i, y=i)
+            for i in range(count)
+        ])
+
+    def test_only_changed_objects_are_embedded(self):
+        self.create_objects(25)
+        stats = embed_objects(batch_size=10, concurrency=2, log=lambda message: None)
+        self.assertEqual((stats['embedded'], stats['skipped']), (25, 0))
+        self.assertEqual(sorted(CountingEmbedder.batches), [5, 10, 10])
+        self.assertEqual(len(get_vector_index()), 25)
+
+        self.assertEqual(embed_objects(log=lambda message: None)['embedded'], 0)
+        SearchableObject.objects.filter(name='Звезда 3').update(description='Планетарная туманность')
+        stats = embed_objects(log=lambda message: None)
+        self.assertEqual((stats['embedded'], stats['skipped']), (1, 24))
+        self.assertEqual(embed_objects(force=True, log=lambda message: None)['embedded'], 25)
+
+    def test_deletes_in_one_transaction_are_batched(self):
+        objects = self.create_objects(6)
+        deleted = sorted(obj.vector_id for obj in objects[:4])
+        embed_objects(log=lambda message: None)
+        index = get_vector_index()
+        with mock.patch.object(LocalVectorIndex, 'delete', autospec=True, side_effect=LocalVectorIndex.delete) as delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                SearchableObject.objects.filter(pk__in=[obj.pk for obj in objects[:3]]).delete()
+                objects[3].delete()
+                # Откат точки сохранения отменяет и удаление вектора
+                with transaction.atomic():
+                    objects[4].delete()
+                    transaction.set_rollback(True)
+        self.assertEqual(delete.call_count, 1)
+        self.assertEqual(sorted(delete.call_args.args[1]), deleted)
+        self.assertEqual(len(index), 2)
+
+    def test_saves_queue_one_job_and_deletes_unindex(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            nebula = SearchableObject.objects.create(
+                image=self.image, name='Туманность Ориона', description='Яркая эмиссионная туманность', x=1, y=1
+            )
+            SearchableObject.objects.create(image=self.image, name='Вега', description='Звезда', x=2, y=2)
+        self.assertEqual(Job.objects.filter(kind='embed_objects', status='QUEUED').count(), 1)
+        self.assertTrue(run_job(claim_next_job('test')))
+
+        index = get_vector_index()
+        query = CountingEmbedder().embed(['туманности'], query=True)[0]
+        self.assertEqual(index.search(query, k=1)[0][0], nebula.vector_id)
+        # Сохранение без изменения текста задачу не ставит
+        nebula.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            nebula.save()
+        self.assertFalse(Job.objects.filter(status='QUEUED').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nebula.delete()
+        self.assertEqual(len(index), 1)
+
+
+# =====================================================================
+# Поиск объектов в видимой области (app/object_search.py)
+# =====================================================================
+
+@override_settings(EMBEDDER='app.embeddings.HashingEmbedder')
+class ObjectSearchTests(TestCase):
+    request = ApiQueryBudgetTests.request
+    assertNoFullScans = ApiQueryBudgetTests.assertNoFullScans
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Небо', width=1_000, height=2_000, status='COMPLETED')
+        objects = [
+            ('Туманность Ориона', 'Яркая эмиссионная туманность', 100, 200, None, None),
+            ('Вега', 'Белая звезда главной последовательности', 200, 300, None, None),
+            ('Туманность Кольцо', 'Планетарная туманность', 800, 1_600, None, None),
+            # Центр вне области, но сам объект в нее заходит
+            ('Галактика Андромеды', 'Спиральная галактика', 350, 200, 300, 100),
+            ('Альтаир', 'Белая звезда', 600, 200, 10, 10),
+        ]
+        cls.objects = {
+            name: SearchableObject.objects.create(
+                image=cls.image, name=name, description=description, x=x, y=y, width=width, height=height
+            )
+            for name, description, x, y, width, height in objects
+        }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        index_dir = override_settings(VECTOR_INDEX_DIR=directory.name)
+        index_dir.enable()
+        self.addCleanup(index_dir.disable)
+        embed_objects(log=lambda message: None)
+        self.url = f'/api/images/{self.image.id}/objects/search/'
+
+    def test_scoped_to_viewport(self):
+        # Изображение, наибольшие ширина и высота объектов, кандидаты в области, сами объекты
+        response = self.request('get', f'{self.url}?q=туманности&bbox=0,0,0.25,0.25', 5)
+        result = response.json()
+        names = [obj['name'] for obj in result['objects']]
+        self.assertEqual(names[0], 'Туманность Ориона')
+        self.assertEqual(sorted(names), ['Вега', 'Галактика Андромеды', 'Туманность Ориона'])
+        self.assertEqual((result['candidates'], result['prefiltered']), (3, True))
+        scores = [obj['score'] for obj in result['objects']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual((result['objects'][0]['x'], result['objects'][0]['y']), (0.1, 0.1))
+
+    def test_limit(self):
+        # Без bbox — все изображение
+        everything = self.client.get(f'{self.url}?q=звезда').json()['objects']
+        self.assertEqual(len(everything), 5)
+        response = self.client.get(f'{self.url}?q=звезда&limit=1')
+        self.assertEqual(response.json()['objects'], everything[:1])
+
+    @override_settings(OBJECT_SEARCH_PREFILTER_MAX=1)
+    def test_large_viewport_searches_whole_index(self):
+        response = self.client.get(f'{self.url}?q=туманности&bbox=0,0,0.25,0.25')
+        result = response.json()
+        self.assertFalse(result['prefiltered'])
+        self.assertEqual(result['objects'][0]['name'], 'Туманность Ориона')
+        self.assertNotIn('Туманность Кольцо', [obj['name'] for obj in result['objects']])
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}?q=x&bbox=0,0,2').status_code, 400)
+        self.assertEqual(self.client.get('/api/images/0/objects/search/?q=x').status_code, 404)
+
+
+# =====================================================================
+# Кэш ответов AI (app/ai.py)
+# =====================================================================
+
+class AnswerCacheTests(TestCase):
+
+    def test_lru_and_ttl(self):
+        cache = AnswerCache(max_entries=2, ttl=60)
+        for key in ('a', 'b', 'a', 'c'):
+            cache.get_or_compute(key, lambda: key.upper())
+        # "b" спрашивали давнее всех — его и вытеснил "c"
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.get_or_compute('b', lambda: 'B2'), ('B2', 'miss'))
+
+        cache = AnswerCache(max_entries=2, ttl=0.01)
+        cache.get_or_compute('a', lambda: 'A')
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_compute('a', lambda: 'A2'), ('A2', 'miss'))
+
+    def test_concurrent_misses_share_one_call(self):
+        cache = AnswerCache(max_entries=10, ttl=60)
+        calls = []
+        started = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return 'ответ'
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            leader = pool.submit(cache.get_or_compute, 'q', compute)
+            started.wait()
+            followers = [pool.submit(cache.get_or_compute, 'q', compute) for _ in range(4)]
+            outcomes = [leader.result()] + [future.result() for future in followers]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcome for answer, outcome in outcomes), ['coalesced'] * 4 + ['miss'])
+        self.assertEqual(cache.stats()['savedCalls'], 4)
+
+    def test_errors_are_shared_but_not_cached(self):
+        cache = AnswerCache(max_entries=10, ttl=60)
+
+        def fail():
+            raise RuntimeError('модель недоступна')
+
+        with self.assertRaises(RuntimeError):
+            cache.get_or_compute('q', fail)
+        self.assertEqual(cache.get_or_compute('q', lambda: 'ответ'), ('ответ', 'miss'))
+        self.assertEqual(cache.in_flight, {})
+
+
+@override_settings(AI_CLIENT='app.ai.EchoClient')
+class PointQuestionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('astronomer', password='secret')
+        cls.image = Image.objects.create(name='Небо', width=1_000, height=1_000, status='COMPLETED')
+        cls.point = PointOfInterest.objects.create(image=cls.image, x=100, y=200, name='Туманность Ориона')
+        cls.url = f'/api/markers/{cls.point.id}/ask/'
+
+    def setUp(self):
+        get_answer_cache().clear()
+        EchoClient.calls = 0
+        self.client.force_login(self.user)
+
+    def ask(self, prompt):
+        response = self.client.post(self.url, {'prompt': prompt})
+        self.assertEqual(response.status_code, 201, response.content[:500])
+        return response.json()
+
+    def test_repeated_question_is_answered_from_cache(self):
+        first = self.ask('Что это за объект?')
+        self.assertFalse(first['cached'])
+        # Регистр, пробелы и знак вопроса ключ не меняют
+        second = self.ask('  что   это за объект ')
+        self.assertEqual((second['cached'], second['answer']), (True, first['answer']))
+        self.assertEqual(EchoClient.calls, 1)
+        self.assertEqual(
+            list(GeminiInteraction.objects.order_by('id').values_list('cached', flat=True)), [False, True]
+        )
+        # Новое описание точки — другой контекст и новый вызов модели
+        self.point.description = 'Область звездообразования'
+        self.point.save()
+        self.assertFalse(self.ask('Что это за объект?')['cached'])
+        self.assertEqual(EchoClient.calls, 2)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(User.objects.get(username='admin'))
+        stats = self.client.get('/api/cache/stats/').json()['ai']
+        self.assertEqual((stats['hits'], stats['misses'], stats['hitRate'], stats['savedCalls']), (1, 2, 0.333, 1))
+
+    def test_errors(self):
+        self.assertEqual(self.client.post(self.url, {'prompt': ''}).status_code, 400)
+        self.assertEqual(self.client.post('/api/markers/0/ask/', {'prompt': 'Что это?'}).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.post(self.url, {'prompt': 'Что это?'}).status_code, 403)
+
+
+# =====================================================================
+# Очередь задач (app/jobs.py)
+# =====================================================================
+
+@override_settings(JOB_RETRY_BACKOFF=10, JOB_RETRY_BACKOFF_MAX=15)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.enterContext(mock.patch.dict(JOB_HANDLERS, {'test_ok': self.calls.append, 'test_fail': self.fail_job}))
+        # run_job сообщает о падениях в stdout
+        self.enterContext(redirect_stdout(io.StringIO()))
+
+    def fail_job(self, job):
+        raise RuntimeError(f'сбой {job.attempts}')
+
+    def test_claim_order(self):
+        later = Job.objects.create(kind='test_ok', run_after=timezone.now() - timedelta(seconds=1))
+        first = Job.objects.create(kind='test_ok', run_after=timezone.now() - timedelta(seconds=5))
+        Job.objects.create(kind='test_ok', run_after=timezone.now() + timedelta(hours=1))
+
+        job = claim_next_job('w1')
+        self.assertEqual((job.id, job.status, job.worker, job.attempts), (first.id, 'RUNNING', 'w1', 1))
+        # Взятую задачу второй воркер не получит, задачу из будущего — тоже
+        self.assertEqual(claim_next_job('w2').id, later.id)
+        self.assertIsNone(claim_next_job('w3'))
+        self.assertIsNone(claim_next_job('w1', id=first.id))
+
+        self.assertTrue(run_job(job))
+        first.refresh_from_db()
+        self.assertEqual((first.status, self.calls), ('DONE', [job]))
+        self.assertIsNotNone(first.finished_at)
+
+    def test_retry_with_backoff(self):
+        self.assertEqual([retry_delay(attempts) for attempts in (1, 2, 3)], [10, 15, 15])
+        created = Job.objects.create(kind='test_fail', max_attempts=3)
+        for attempt, delay in ((1, 10), (2, 15)):
+            started = timezone.now()
+            self.assertFalse(run_job(claim_next_job('w1')))
+            job = Job.objects.get(id=created.id)
+            self.assertEqual((job.status, job.worker, job.attempts), ('QUEUED', '', attempt))
+            self.assertIn(f'сбой {attempt}', job.last_error)
+            self.assertAlmostEqual((job.run_after - started).total_seconds(), delay, delta=1)
+            # До истечения задержки задачу не берут
+            self.assertIsNone(claim_next_job('w1'))
+            Job.objects.filter(id=job.id).update(run_after=timezone.now())
+
+        self.assertFalse(run_job(claim_next_job('w1')))
+        job = Job.objects.get(id=created.id)
+        self.assertEqual((job.status, job.attempts), ('FAILED', 3))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(claim_next_job('w1'))
+
+    def test_unknown_kind_and_stale_jobs(self):
+        Job.objects.create(kind='unknown', max_attempts=1)
+        self.assertFalse(run_job(claim_next_job('w1')))
+        self.assertIn('Неизвестный тип задачи', Job.objects.get().last_error)
+
+        stale = Job.objects.create(kind='test_ok')
+        claim_next_job('w1')
+        Job.objects.filter(id=stale.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        started = timezone.now()
+        self.assertEqual(requeue_stale_jobs(), 1)
+        # Упавший воркер — та же неудачная попытка: повтор с задержкой
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker), ('QUEUED', ''))
+        self.assertAlmostEqual((stale.run_after - started).total_seconds(), retry_delay(1), delta=1)
+        self.assertIsNone(claim_next_job('w2'))
+        Job.objects.filter(id=stale.id).update(run_after=timezone.now())
+        self.assertEqual(claim_next_job('w2').id, stale.id)
+
+    def test_stale_job_out_of_attempts_fails(self):
+        # Воркер, которого раз за разом убивает OOM, не должен получать задачу вечно
+        image = Image.objects.create(name='Большое', status='PROCESSING')
+        created = Job.objects.create(kind='process_image', image=image, max_attempts=2)
+        for _ in range(5):
+            Job.objects.filter(id=created.id).update(run_after=timezone.now())
+            if claim_next_job('w1') is None:
+                break
+            Job.objects.filter(id=created.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            requeue_stale_jobs()
+        job = Job.objects.get(id=created.id)
+        self.assertEqual((job.status, job.attempts), ('FAILED', 2))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIn('перестал подавать сигналы', job.last_error)
+        image.refresh_from_db()
+        self.assertEqual(image.status, 'FAILED')
+
+
+# =====================================================================
+# Нарезка на тайлы (app/tiling.py)
+# =====================================================================
+
+def tile_tree(prefix):
+    """{относительный путь: хэш содержимого} всех файлов результата нарезки."""
+    files = {}
+    for root, _, names in os.walk(f'{prefix}_files'):
+        for name in names:
+            if name.endswith('.xml'):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, f'{prefix}_files')] = hashlib.md5(f.read()).hexdigest()
+    with open(f'{prefix}.dzi') as f:
+        files['.dzi'] = f.read()
+    return files
+
+
+def noisy_gradient(width, height, seed=0):
+    """Шум поверх градиента: тайлы разные, а JPEG сжимает их как снимок, а не как чистый шум."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 64, (height, width, 3), dtype=np.uint8) + np.linspace(0, 190, width, dtype=np.uint8)[:, None]
+    return pyvips.Image.new_from_array(pixels).copy(interpretation='srgb')
+
+
+class TilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.image = noisy_gradient(903, 701)
+
+    def test_pyramid_tiff_can_be_tiled_again(self):
+        source = os.path.join(self.path, 'source.tif')
+        self.image.tiffsave(source, tile=True, pyramid=True, compression='deflate')
+        prefix = os.path.join(self.path, 'out', 'image')
+        os.makedirs(os.path.dirname(prefix))
+        self.assertEqual(tile_source(source, prefix, log=lambda message: None)['mode'], 'pyramid')
+        first = tile_tree(prefix)
+        self.assertEqual(tile_source(source, prefix, log=lambda message: None)['mode'], 'pyramid')
+        self.assertEqual(tile_tree(prefix), first)
+        self.assertIn('Width="903"', first['.dzi'])
+
+    def test_banded_tiling_matches_dzsave(self):
+        # Полосы с контрольными точками и dzsave дают одни и те же файлы, байт в байт
+        source = os.path.join(self.path, 'source.v')
+        self.image.write_to_file(source)
+        options = tile_options()
+        pyvips.Image.new_from_file(source).dzsave(os.path.join(self.path, 'dzsave'), **options)
+        tile_resumable(source, os.path.join(self.path, 'banded'), log=lambda message: None, **options)
+        self.assertEqual(tile_tree(os.path.join(self.path, 'banded')), tile_tree(os.path.join(self.path, 'dzsave')))
+
+    def test_region_tiling_matches_dzsave(self):
+        # Области разного размера (последние неполные) после сборки дают те же файлы, что dzsave
+        source = os.path.join(self.path, 'source.v')
+        self.image.write_to_file(source)
+        options = tile_options()
+        pyvips.Image.new_from_file(source).dzsave(os.path.join(self.path, 'dzsave'), **options)
+        prefix = os.path.join(self.path, 'regions')
+        regions = tiling_regions(self.image.width, self.image.height, region_tiles=2)
+        for region in reversed(regions):
+            tile_region(source, prefix, region, **options)
+        merge_regions(prefix, self.image.width, self.image.height, regions, log=lambda message: None, **options)
+        self.assertEqual(tile_tree(prefix), tile_tree(os.path.join(self.path, 'dzsave')))
+
+    def test_dedup_file_is_idempotent(self):
+        blob_dir = os.path.join(self.path, 'blobs')
+        tile, copy = os.path.join(self.path, 'tile.jpeg'), os.path.join(self.path, 'copy.jpeg')
+        for path in (tile, copy):
+            with open(path, 'wb') as f:
+                f.write(b'tile')
+        # Первый экземпляр сам становится файлом хранилища, повторный проход ничего не меняет
+        self.assertFalse(dedup_file(tile, blob_dir))
+        self.assertTrue(dedup_file(tile, blob_dir))
+        self.assertTrue(dedup_file(copy, blob_dir))
+        self.assertTrue(dedup_file(copy, blob_dir))
+        blob = blob_path_for(blob_dir, tile_digest(b'tile'), '.jpeg')
+        self.assertTrue(os.path.samefile(tile, blob) and os.path.samefile(copy, blob))
+        self.assertEqual(os.stat(blob).st_nlink, 3)
+        # Временных ссылок не осталось
+        self.assertEqual(sorted(os.listdir(self.path)), ['blobs', 'copy.jpeg', 'tile.jpeg'])
+
+    def test_pack_index_round_trip(self):
+        pack_path = os.path.join(self.path, 'image.zip')
+        # Справа пустое поле: одинаковые тайлы для dedup_pack
+        self.image.embed(0, 0, 1600, 701).dzsave(pack_path, container='zip', compression=0)
+        with zipfile.ZipFile(pack_path) as archive:
+            tiles = {
+                tuple(int(part) for part in match.groups()): archive.read(name)
+                for name in archive.namelist() if (match := TILE_NAME_RE.search(name))
+            }
+            dzi = next(archive.read(name) for name in archive.namelist() if name.endswith('.dzi'))
+
+        self.assertEqual(build_pack_index(pack_path), len(tiles))
+        pack = TilePack(pack_path)
+        self.assertEqual({key: pack.read(*key) for key in tiles}, tiles)
+        self.assertEqual(pack.read_dzi(), dzi)
+        self.assertIsNone(pack.read(99, 0, 0))
+
+        # После дедупликации дубликаты читаются по индексу из оставленного экземпляра
+        self.assertGreater(dedup_pack(pack_path), 0)
+        self.assertEqual(build_pack_index(pack_path), len(tiles))
+        pack = TilePack(pack_path)
+        self.assertEqual({key: pack.read(*key) for key in tiles}, tiles)
+
+    def test_open_pack_follows_new_index(self):
+        pack_path = os.path.join(self.path, 'image.zip')
+        self.image.dzsave(pack_path, container='zip', compression=0)
+        build_pack_index(pack_path)
+        open_pack(pack_path).read(0, 0, 0)
+        # Повторная нарезка: архив уже новый, индекс еще старый, и тайл просят как раз между ними
+        self.image.flip('horizontal').dzsave(pack_path, container='zip', compression=0, suffix='.png')
+        open_pack(pack_path)
+        build_pack_index(pack_path)
+        with zipfile.ZipFile(pack_path) as archive:
+            tiles = {
+                tuple(int(part) for part in match.groups()): archive.read(name)
+                for name in archive.namelist() if (match := TILE_NAME_RE.search(name))
+            }
+        pack = open_pack(pack_path)
+        self.assertEqual([key for key, data in tiles.items() if pack.read(*key) != data], [])
+
+
+# =====================================================================
+# Команда process_image
+# =====================================================================
+
+class ProcessImageTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name
+        self.enterContext(override_settings(
+            MEDIA_ROOT=self.media_root, TILE_DEDUP_DIR=os.path.join(self.media_root, 'tiles', '_blobs')
+        ))
+        self.enterContext(redirect_stdout(io.StringIO()))
+
+    def create_image(self, name, image, **fields):
+        os.makedirs(os.path.join(self.media_root, 'images'), exist_ok=True)
+        image.write_to_file(os.path.join(self.media_root, 'images', f'{name}.tif'))
+        return Image.objects.create(name=name, source_file=f'images/{name}.tif', **fields)
+
+    def process(self, image, **options):
+        output = io.StringIO()
+        call_command('process_image', image.id, stdout=output, **options)
+        return output.getvalue()
+
+    def test_resume_continues_only_banded_checkpoints(self):
+        image = self.create_image('small', pyvips.Image.black(600, 400, bands=3))
+        # Повтор задачи после сбоя до первой контрольной точки — обычная нарезка, не полосами
+        self.assertIn('(режим stream)', self.process(image, resume=True))
+        Image.objects.filter(id=image.id).update(
+            tiling_checkpoint={'rows_total': 2, 'rows_done': 0, 'levels_done': []}
+        )
+        self.assertIn('(режим checkpointed)', self.process(image, resume=True))
+
+    def test_retiling_keeps_shared_tiles(self):
+        first = self.create_image('first', noisy_gradient(600, 500), dedup_tiles=True)
+        second = self.create_image('second', noisy_gradient(600, 500), dedup_tiles=True)
+        self.process(first)
+        self.process(second)
+        shared = tile_tree(self.tiles_prefix(second))
+        second.refresh_from_db()
+        # Все тайлы второго изображения (кроме .dzi) — ссылки на тайлы первого
+        self.assertEqual(second.tiles_deduped, len(shared) - 1)
+
+        # Новый файл первого изображения: его тайлы пишутся заново, а не поверх общих файлов
+        noisy_gradient(600, 500, seed=1).write_to_file(first.source_file.path)
+        self.process(first)
+        self.assertEqual(tile_tree(self.tiles_prefix(second)), shared)
+        blob_dir = os.path.join(self.media_root, 'tiles', '_blobs')
+        for directory, _, names in os.walk(blob_dir):
+            for name in names:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    self.assertEqual(tile_digest(f.read()), os.path.splitext(name)[0])
+
+    def tiles_prefix(self, image):
+        return os.path.join(self.media_root, 'tiles', f'image_{image.id}', f'image_{image.id}')
+
+
+# =====================================================================
+# Прогресс нарезки (app/progress.py, /api/images/<id>/status/)
+# =====================================================================
+
+class TilingProgressTests(TestCase):
+
+    def test_throughput_and_eta(self):
+        clock = self.enterContext(mock.patch('app.tiling.time.monotonic', return_value=100.0))
+        progress = TilingProgress(1_000, bytes_probe=lambda: 4_096)
+        # 400 тайлов — от прошлой попытки: в процент входят, в скорость нет
+        progress.resume_from(400)
+        progress.add(100)
+        clock.return_value = 110.0
+        self.assertEqual(progress.state(), {
+            'progress_percent': 50.0, 'tiles_written': 500, 'tiles_per_second': 10.0,
+            'bytes_written': 4_096, 'eta_seconds': 50,
+        })
+        # Доля от libvips не уменьшается и пересчитывается в тайлы
+        progress.set_fraction(0.75)
+        progress.set_fraction(0.6)
+        clock.return_value = 135.0
+        state = progress.state()
+        # 350 тайлов этой попытки за 35 с — 10 в секунду, осталось 250
+        self.assertEqual((state['progress_percent'], state['tiles_written'], state['eta_seconds']), (75.0, 750, 25))
+        progress.finish()
+        state = progress.state()
+        self.assertEqual((state['progress_percent'], state['tiles_written'], state['eta_seconds']), (100.0, 1_000, None))
+
+    def test_recorder_throttles_snapshots(self):
+        saved = []
+        self.enterContext(mock.patch(
+            'app.progress.save_progress', side_effect=lambda image_id, state: saved.append((time.monotonic(), state))
+        ))
+        progress = TilingProgress(10_000)
+        started = time.monotonic()
+        with ProgressRecorder(1, progress, interval=0.1):
+            # Счетчики меняются постоянно, а в базу уходит не чаще раза в интервал
+            while time.monotonic() - started < 0.35:
+                progress.add(1)
+        periodic, final = saved[:-1], saved[-1]
+        self.assertIn(len(periodic), (2, 3))
+        times = [started] + [moment for moment, _ in periodic]
+        self.assertTrue(all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:])))
+        # При выходе — итоговый снимок
+        self.assertEqual(final[1]['tiles_written'], progress.tiles_written)
+
+    def test_status_view(self):
+        image = Image.objects.create(name='Нарезка', width=1_000, height=1_000, status='PROCESSING')
+        save_progress(image.id, {
+            'progress_percent': 42.5, 'tiles_written': 425, 'tiles_per_second': 12.5,
+            'bytes_written': 1_048_576, 'eta_seconds': 46,
+        })
+        data = self.client.get(f'/api/images/{image.id}/status/').json()
+        self.assertEqual(
+            {key: data[key] for key in ('status', 'progress_percent', 'tiles_written', 'tiles_per_second',
+                                        'bytes_written', 'eta_seconds')},
+            {'status': 'PROCESSING', 'progress_percent': 42.5, 'tiles_written': 425, 'tiles_per_second': 12.5,
+             'bytes_written': 1_048_576, 'eta_seconds': 46},
+        )
+        self.assertIsNotNone(data['progress_updated_at'])
+
+        progress = TilingProgress(1_000)
+        progress.finish()
+        save_progress(image.id, progress.state())
+        Image.objects.filter(id=image.id).update(status='COMPLETED')
+        data = self.client.get(f'/api/images/{image.id}/status/').json()
+        self.assertEqual(
+            (data['status'], data['progress_percent'], data['tiles_written'], data['eta_seconds']),
+            ('COMPLETED', 100.0, 1_000, None),
+        )
+
+
+# =====================================================================
+# Тайлы на лету (app/tile_render.py) и их кэш (app/tile_cache.py)
+# =====================================================================
+
+def decode_tile(data):
+    return pyvips.Image.new_from_buffer(data, '')
+
+
+def mean_difference(first, second):
+    """Средняя разница пикселей двух тайлов одного размера."""
+    return (first.cast('float') - second.cast('float')).abs().avg()
+
+
+class TileCacheTests(TestCase):
+
+    def test_memory_lru_evicts_by_bytes(self):
+        lru = MemoryLRU(10)
+        lru.set('a', b'aaaa')
+        lru.set('b', b'bbbb')
+        # Чтение освежает: вытесняется b, а не a
+        self.assertEqual(lru.get('a'), b'aaaa')
+        lru.set('c', b'cccc')
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (b'aaaa', None, b'cccc'))
+        self.assertEqual(lru.size, 8)
+        # Значение больше всего кэша не вытесняет остальное
+        lru.set('d', b'd' * 11)
+        self.assertEqual((lru.get('d'), lru.size), (None, 8))
+
+    def test_disk_lru_evicts_least_recently_used(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        lru = DiskLRU(directory.name, max_bytes=100, low_water=0.7)
+        for age, key in enumerate(('a/1.jpeg', 'b/1.jpeg', 'c/1.jpeg')):
+            lru.set(key, b'x' * 30)
+            os.utime(os.path.join(directory.name, key), (1_000 + age, 1_000 + age))
+        self.assertEqual(lru.get('a/1.jpeg'), b'x' * 30)
+        # 120 байт из 100: удаляются самые давние, пока не останется 70
+        lru.set('d/1.jpeg', b'x' * 30)
+        self.assertEqual([key for key in ('a/1.jpeg', 'b/1.jpeg', 'c/1.jpeg', 'd/1.jpeg') if lru.get(key)],
+                         ['a/1.jpeg', 'd/1.jpeg'])
+
+    def test_concurrent_misses_render_once(self):
+        cache = TileCache(memory_bytes=1024)
+        calls = []
+        started = threading.Event()
+
+        def render():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return b'tile'
+
+        def failing_render():
+            started.wait()
+            raise RuntimeError('сбой')
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: cache.get_or_render('k', render), range(8)))
+        self.assertEqual((results, len(calls)), ([b'tile'] * 8, 1))
+
+        # Ошибку рендера получают все ждавшие, следующий запрос рендерит заново
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(cache.get_or_render, 'other', failing_render) for _ in range(4)]
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result()
+        self.assertEqual(cache.get_or_render('other', lambda: b'again'), b'again')
+
+
+class DziViewTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.path))
+        self.enterContext(mock.patch('app.tile_render._tile_cache', TileCache(memory_bytes=64 * 1024 * 1024)))
+        self.enterContext(redirect_stdout(io.StringIO()))
+        os.makedirs(os.path.join(self.path, 'images'))
+        source = noisy_gradient(903, 701)
+        source.write_to_file(os.path.join(self.path, 'images', 'flat.tif'))
+        self.image = Image.objects.create(name='Плоский TIFF', source_file='images/flat.tif')
+        source.dzsave(os.path.join(self.path, 'dzsave'), **tile_options())
+        self.url = f'/dzi/{self.image.id}'
+
+    def reference(self, level, col, row):
+        with open(os.path.join(self.path, 'dzsave_files', str(level), f'{col}_{row}.jpeg'), 'rb') as f:
+            return f.read()
+
+    def tile(self, level, col, row):
+        response = self.client.get(f'{self.url}_files/{level}/{col}_{row}.jpeg')
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_tiles_match_dzsave_geometry(self):
+        response = self.client.get(f'{self.url}.dzi')
+        with open(os.path.join(self.path, 'dzsave.dzi')) as f:
+            self.assertEqual(response.content.decode(), f.read())
+        # Крайние тайлы (с перекрытием с одной стороны) и внутренние, на полном разрешении и ниже.
+        # Размеры совпадают точно, пиксели — с точностью до JPEG и фильтра уменьшения
+        # (на уровне 0 из одного пикселя resize и усреднение 2x2 по уровням расходятся сильнее)
+        for level, col, row in ((10, 0, 0), (10, 1, 1), (10, 3, 2), (9, 1, 0), (9, 1, 1), (6, 0, 0), (0, 0, 0)):
+            tile, reference = decode_tile(self.tile(level, col, row)), decode_tile(self.reference(level, col, row))
+            self.assertEqual((tile.width, tile.height), (reference.width, reference.height), (level, col, row))
+            if level:
+                self.assertLess(mean_difference(tile, reference), 4, (level, col, row))
+        self.assertEqual(self.client.get(f'{self.url}_files/10/4_0.jpeg').status_code, 404)
+        self.assertEqual(self.client.get(f'{self.url}_files/11/0_0.jpeg').status_code, 404)
+
+    def test_low_levels_from_cached_tiles(self):
+        for col in range(4):
+            for row in range(3):
+                self.tile(10, col, row)
+        # Уровень ниже собирается из тайлов уровня 10 в кэше, исходник не читается
+        with mock.patch('app.tile_render.SourceImage.page', side_effect=AssertionError('чтение исходника')):
+            for col, row in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                tile, reference = decode_tile(self.tile(9, col, row)), decode_tile(self.reference(9, col, row))
+                self.assertEqual((tile.width, tile.height), (reference.width, reference.height))
+                self.assertLess(mean_difference(tile, reference), 4)
+            # Для уровня 8 тайлов уровня 9 в кэше хватает, а уровня 7 — уже нет
+            self.tile(8, 0, 0)
+            with self.assertRaises(AssertionError):
+                self.tile(6, 0, 0)
+
+
+# =====================================================================
+# Кластеры маркеров (app/clusters.py)
+# =====================================================================
+
+class MarkerClusterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.image = Image.objects.create(name='Скопление', width=10_000, height=10_000, status='COMPLETED')
+        cls.points = [
+            PointOfInterest.objects.create(image=cls.image, x=97 * i % 10_000, y=61 * i % 10_000, name=f'Точка {i}')
+            for i in range(60)
+        ]
+
+    def cluster_rows(self):
+        return sorted(
+            MarkerCluster.objects.filter(image=self.image)
+            .values_list('level', 'cell', 'count', 'sum_x', 'sum_y', 'representative_id')
+        )
+
+    def test_increments_match_rebuild(self):
+        # Перенос точек в чужие ячейки (в том числе старшей, чем представитель) и удаление представителей
+        moved = self.points[40]
+        moved.x, moved.y = self.points[3].x + 1, self.points[3].y + 1
+        moved.save()
+        self.points[3].delete()
+        self.points[10].delete()
+        moved.x, moved.y = self.points[12].x, self.points[12].y
+        moved.save()
+        older = self.points[2]
+        older.x, older.y = self.points[50].x, self.points[50].y
+        older.save()
+        incremental = self.cluster_rows()
+        rebuild_clusters(self.image.id)
+        self.assertEqual(incremental, self.cluster_rows())
+
+    @override_settings(MARKER_CLUSTERS_VIEWPORT_LIMIT=5)
+    def test_clusters_per_response_are_capped(self):
+        url = f'/api/images/{self.image.id}/markers/clusters/?zoom=2'
+        data = self.client.get(url).json()
+        self.assertEqual((len(data['clusters']), data['truncated']), (5, True))
+        data = self.client.get(f'{url}&bbox=0,0,0.01,0.01').json()
+        self.assertEqual((len(data['clusters']), data['truncated']), (1, False))
+
+
+# =====================================================================
+# Курсоры постраничного вывода (app/pagination.py)
+# =====================================================================
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        image = Image.objects.create(name='Тред', width=100, height=100, status='COMPLETED')
+        cls.point = PointOfInterest.objects.create(image=image, x=1, y=1, name='Точка')
+        Comment.objects.bulk_create([
+            Comment(point=cls.point, author_name='Автор', text=f'Сообщение {i}') for i in range(7)
+        ])
+        # Сообщения с одинаковым временем: порядок внутри него задает id
+        moment = timezone.now().replace(microsecond=123456)
+        Comment.objects.filter(point=cls.point).update(created_at=moment)
+        cls.ids = list(Comment.objects.filter(point=cls.point).order_by('id').values_list('id', flat=True))
+
+    def test_cursor_round_trip(self):
+        comment = Comment.objects.get(id=self.ids[0])
+        cursor = encode_cursor(comment)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (comment.created_at, comment.id))
+        for broken in ('', 'не base64', base64.urlsafe_b64encode(b'2024-01-01|x').decode(), 'gA'):
+            with self.assertRaises(ValueError):
+                decode_cursor(broken)
+
+    def test_pages_with_equal_timestamps(self):
+        comments = Comment.objects.filter(point=self.point)
+        page = keyset_page(comments, limit=3)
+        seen = [comment.id for comment in page['items']]
+        while page['has_more']:
+            page = keyset_page(comments, before=page['before'], limit=3)
+            seen = [comment.id for comment in page['items']] + seen
+        self.assertEqual(seen, self.ids)
+
+        page = keyset_page(comments, since=encode_cursor(Comment.objects.get(id=self.ids[1])), limit=3)
+        self.assertEqual([comment.id for comment in page['items']], self.ids[2:5])
+        self.assertTrue(page['has_more'])
+
+        page = newest_first_page(comments, limit=4)
+        after = newest_first_page(comments, after=page['next'], limit=4)
+        self.assertEqual([comment.id for comment in page['items'] + after['items']], self.ids)
+        self.assertIsNone(after['next'])
+
+
+# =====================================================================
+# Быстрый рендеринг маркеров (app/fast_json.py)
+# =====================================================================
+
+class FastJsonTests(TestCase):
+
+    def test_same_bytes_as_json_renderer(self):
+        # Все нормированные координаты пикселей изображения шириной 100 003 и крайние случаи
+        width = 100_003
+        coordinates = (np.arange(width, dtype=np.float64) / width).tolist()
+        coordinates += [0.0, 1.0, 1e-4, 9.999e-5, 1e-5, 1.5e-7, 5e-324, 0.1 + 0.2, None]
+        titles = ['Точка', 'кавычка " и \\ слэш', 'строки\u2028\u2029', '"x":1e-05', '😀', '']
+        payload = {
+            'markers': [
+                {'id': i, 'x': x, 'y': coordinates[-i - 1], 'title': titles[i % len(titles)]}
+                for i, x in enumerate(coordinates)
+            ],
+            'truncated': False,
+        }
+        expected = JSONRenderer().render(payload)
+        self.assertEqual(render_markers(payload), expected)
+        self.assertEqual(
+            expected.decode(), json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+            .replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        )
+        with mock.patch('app.fast_json.orjson', None):
+            self.assertEqual(render_markers(payload), expected)
+
+
+# =====================================================================
+# Живые события (app/events.py)
+# =====================================================================
+
+def sse_event(number):
+    return {'id': f'e{number}', 'type': 'comment', 'data': {'text': f'Сообщение {number}'}}
+
+
+@override_settings(EVENTS_QUEUE_SIZE=3, EVENTS_KEEPALIVE=5, EVENTS_STREAM_TIMEOUT=5)
+class LocalBrokerTests(TestCase):
+
+    def test_overflow_replaces_oldest_event(self):
+        broker = LocalBroker()
+
+        async def scenario():
+            async with broker.subscribe('marker:1') as queue:
+                # Публикуют из потоков представлений, а не из цикла событий
+                publisher = threading.Thread(
+                    target=lambda: [broker.publish('marker:1', sse_event(i)) for i in range(5)]
+                )
+                publisher.start()
+                publisher.join()
+                broker.publish('marker:2', sse_event(99))
+                await asyncio.sleep(0.05)
+                items = [queue.get_nowait() for _ in range(queue.qsize())]
+            return items
+
+        items = asyncio.run(scenario())
+        # Очередь не растет: самые старые события вытеснены маркером переполнения
+        self.assertEqual(items, [sse_event(2), OVERFLOW, OVERFLOW])
+        self.assertEqual(dict(broker.subscribers), {})
+        # Публикация в канал без подписчиков и после закрытия цикла событий не падает
+        broker.publish('marker:1', sse_event(5))
+
+    def test_stream_closes_on_overflow(self):
+        async def scenario():
+            chunks = []
+            stream = event_stream('marker:7', lambda: [sse_event(0)])
+            chunks.append(await anext(stream))
+            chunks.append(await anext(stream))
+            for i in range(1, 6):
+                publish('marker:7', sse_event(i))
+            async for chunk in stream:
+                chunks.append(chunk)
+            return chunks
+
+        with mock.patch('app.events._broker', LocalBroker()):
+            chunks = asyncio.run(scenario())
+        # Пропущенное, затем уцелевшее в очереди до маркера переполнения; остальное клиент догонит по Last-Event-ID
+        self.assertEqual(chunks[0], 'retry: 3000\n\n')
+        self.assertEqual([chunk.split('\n')[0] for chunk in chunks[1:]], ['id: e0', 'id: e3'])
+
+
+class FakePubSub:
+    """Подписка redis-py: отдает сообщения (исключение — обрыв связи), затем ждет, пока ее не закроют."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.closed = threading.Event()
+
+    def subscribe(self, channel):
+        pass
+
+    def listen(self):
+        for message in self.messages:
+            if isinstance(message, Exception):
+                raise message
+            yield message
+        self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+class RedisBrokerTests(TestCase):
+
+    def test_listener_reconnects_after_connection_error(self):
+        message = {'type': 'message', 'data': json.dumps({'channel': 'marker:1', 'event': sse_event(1)})}
+        subscriptions = [FakePubSub([redis.ConnectionError('обрыв')]), FakePubSub([message])]
+        broker = RedisBroker()
+        broker.RECONNECT_DELAY = 0.01
+        broker.redis = mock.Mock(pubsub=lambda **kwargs: subscriptions.pop(0))
+
+        async def scenario():
+            async with broker.subscribe('marker:1') as queue:
+                return [await asyncio.wait_for(queue.get(), 5) for _ in range(2)]
+
+        with redirect_stdout(io.StringIO()) as output:
+            items = asyncio.run(scenario())
+        # Событий за время обрыва нет: поток подписчика закрывается, затем события идут снова
+        self.assertEqual(items, [OVERFLOW, sse_event(1)])
+        self.assertIn('Подписка на события Redis оборвалась', output.getvalue())
+        self.assertTrue(broker.listener.is_alive())
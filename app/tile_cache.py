@@ -0,0 +1,169 @@
+# app/tile_cache.py
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# =====================================================================
+# Ограниченный по размеру LRU-кэш отрендеренных тайлов
+# Два яруса: память процесса (быстро, мало) и диск (медленнее, много,
+# общий для всех процессов). При переполнении вытесняются давно не
+# запрашивавшиеся тайлы.
+# =====================================================================
+
+
+class MemoryLRU:
+    """LRU по суммарному размеру значений в байтах."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskLRU:
+    """
+    Тайлы в каталоге на диске. Время последнего доступа хранится в mtime файла;
+    когда объем превышает лимит, удаляются самые старые файлы, пока не
+    останется low_water от лимита.
+    """
+
+    def __init__(self, root, max_bytes, low_water=0.9):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _scan(self):
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Пишем во временный файл и переименовываем, чтобы другой процесс не прочитал половину тайла
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Пересчитываем по факту: каталог общий для нескольких процессов
+        entries = sorted(self._scan())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_water
+        for _, file_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= file_size
+            except FileNotFoundError:
+                pass
+        self._size = size
+
+
+class TileCache:
+    """Кэш тайлов: сначала память, затем диск; промах на диске поднимает тайл в память."""
+
+    def __init__(self, memory_bytes, disk_root=None, disk_bytes=0):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskLRU(disk_root, disk_bytes) if disk_root and disk_bytes else None
+        # Тайлы, которые сейчас рендерятся в этом процессе: ключ -> Future с результатом
+        self._rendering = {}
+        self._rendering_lock = threading.Lock()
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is None and self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.set(key, data)
+        return data
+
+    def set(self, key, data):
+        self.memory.set(key, data)
+        if self.disk is not None:
+            self.disk.set(key, data)
+
+    def get_or_render(self, key, render):
+        """
+        Тайл из кэша, при промахе — render(). Одновременные промахи по одному ключу
+        рендерят тайл один раз: первый запрос читает исходник, остальные ждут его
+        результат (или его исключение), а не декодируют ту же область параллельно.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+        with self._rendering_lock:
+            future = self._rendering.get(key)
+            leader = future is None
+            if leader:
+                future = self._rendering[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            # Пока ждали блокировку, тайл мог успеть отрендериться и уйти из списка
+            data = self.get(key)
+            if data is None:
+                data = render()
+                self.set(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._rendering_lock:
+                del self._rendering[key]
@@ -0,0 +1,77 @@
+# app/tile_dedup.py
+
+import hashlib
+import os
+
+# =====================================================================
+# Дедупликация тайлов по содержимому
+# Каждый уникальный тайл лежит один раз в общем хранилище
+# TILE_DEDUP_DIR/<2 символа хэша>/<хэш>.<формат>, а файлы в каталогах
+# изображений — жесткие ссылки на него. Раскладка <id>_files/<level>/...
+# не меняется, поэтому веб-сервер и .dzi ничего не знают о дедупликации.
+# Одинаковые тайлы (черное небо, поля без данных) из разных
+# изображений занимают место на диске один раз.
+# =====================================================================
+
+
+def tile_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def blob_path_for(blob_dir, digest, extension):
+    return os.path.join(blob_dir, digest[:2], f'{digest}{extension}')
+
+
+def dedup_file(path, blob_dir):
+    """
+    Заменяет тайл жесткой ссылкой на его копию в хранилище.
+    Возвращает True, если такое содержимое там уже было (тайл — дубликат).
+    """
+    with open(path, 'rb') as f:
+        digest = tile_digest(f.read())
+    blob_path = blob_path_for(blob_dir, digest, os.path.splitext(path)[1])
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    try:
+        # Первое появление содержимого: сам тайл становится копией в хранилище
+        os.link(path, blob_path)
+        return False
+    except FileExistsError:
+        pass
+    if os.path.samefile(path, blob_path):
+        # Уже ссылка (повторный проход после продолжения нарезки)
+        return True
+    temp_path = f'{path}.{os.getpid()}.link'
+    os.link(blob_path, temp_path)
+    os.replace(temp_path, path)
+    return True
+
+
+def dedup_tile_tree(files_dir, blob_dir):
+    """Проходит по <prefix>_files и дедуплицирует все тайлы. Возвращает число дубликатов."""
+    duplicates = 0
+    for directory, _, files in os.walk(files_dir):
+        for name in files:
+            if name.endswith('.xml'):
+                continue
+            if dedup_file(os.path.join(directory, name), blob_dir):
+                duplicates += 1
+    return duplicates
+
+
+def prune_blobs(blob_dir):
+    """
+    Удаляет из хранилища тайлы, на которые больше не ссылается ни одно
+    изображение (остались только в хранилище). Возвращает освобожденные байты.
+    """
+    freed = 0
+    for directory, _, files in os.walk(blob_dir):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_nlink == 1:
+                    os.remove(path)
+                    freed += stat.st_size
+            except FileNotFoundError:
+                continue
+    return freed
@@ -0,0 +1,177 @@
+# app/tile_pack.py
+
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+from django.conf import settings
+
+# =====================================================================
+# Упакованное хранение тайлов
+# Вместо миллионов отдельных JPEG все тайлы изображения лежат в одном
+# архиве (zip без сжатия, его пишет сам dzsave), а рядом — компактный
+# индекс "тайл -> (смещение, длина)". Тайл читается одним pread.
+# =====================================================================
+
+INDEX_MAGIC = b'TPI1'
+# level, col, row, offset, size
+INDEX_RECORD = struct.Struct('<HIIQI')
+# Особая запись индекса для дескриптора .dzi
+DZI_LEVEL = 0xFFFF
+
+TILE_NAME_RE = re.compile(r'_files/(\d+)/(\d+)_(\d+)\.\w+$')
+
+# Локальный заголовок zip: сигнатура ... длина имени (26), длина extra (28)
+LOCAL_HEADER = struct.Struct('<4s22xHH')
+# Служебный файл в архиве после дедупликации: {"имя дубликата": "имя оставленного тайла"}
+ALIASES_NAME = 'dedup.json'
+
+
+def pack_path_for(image_id):
+    return os.path.join(settings.MEDIA_ROOT, 'tiles', f'image_{image_id}.zip')
+
+
+def index_path_for(pack_path):
+    return f'{os.path.splitext(pack_path)[0]}.idx'
+
+
+def build_pack_index(pack_path):
+    """
+    Строит индекс для архива, записанного dzsave(..., container='zip').
+    Смещения данных берутся из локальных заголовков zip, поэтому потом
+    для чтения тайла не нужен ни zipfile, ни разбор центрального каталога.
+    Возвращает число проиндексированных тайлов.
+    """
+    records = []
+    by_name = {}
+    aliases = {}
+    with zipfile.ZipFile(pack_path) as archive, open(pack_path, 'rb') as f:
+        if ALIASES_NAME in archive.namelist():
+            aliases = json.loads(archive.read(ALIASES_NAME))
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{info.filename}: тайлы в архиве должны храниться без сжатия')
+            if info.filename.endswith('.dzi'):
+                key = (DZI_LEVEL, 0, 0)
+            else:
+                match = TILE_NAME_RE.search(info.filename)
+                if not match:
+                    continue
+                key = tuple(int(part) for part in match.groups())
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+            if signature != b'PK\x03\x04':
+                raise ValueError(f'{pack_path}: поврежден локальный заголовок {info.filename}')
+            data_offset = info.header_offset + 30 + name_length + extra_length
+            records.append(key + (data_offset, info.file_size))
+            by_name[info.filename] = (data_offset, info.file_size)
+
+    # Дубликаты указывают на те же байты, что и оставленный в архиве тайл
+    for alias, canonical in aliases.items():
+        match = TILE_NAME_RE.search(alias)
+        if match and canonical in by_name:
+            records.append(tuple(int(part) for part in match.groups()) + by_name[canonical])
+
+    records.sort()
+    index_path = index_path_for(pack_path)
+    with open(f'{index_path}.tmp', 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack('<Q', len(records)))
+        for record in records:
+            f.write(INDEX_RECORD.pack(*record))
+    os.replace(f'{index_path}.tmp', index_path)
+    return sum(1 for record in records if record[0] != DZI_LEVEL)
+
+
+def dedup_pack(pack_path):
+    """
+    Переписывает архив, оставляя по одному экземпляру одинаковых тайлов;
+    дубликаты записываются в dedup.json и разрешаются индексом.
+    Возвращает число убранных дубликатов. После нее нужен build_pack_index.
+    """
+    canonical_by_digest = {}
+    aliases = {}
+    temp_path = f'{pack_path}.dedup'
+    with zipfile.ZipFile(pack_path) as source, zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as target:
+        if ALIASES_NAME in source.namelist():
+            aliases.update(json.loads(source.read(ALIASES_NAME)))
+        for info in source.infolist():
+            if info.filename == ALIASES_NAME:
+                continue
+            data = source.read(info)
+            if TILE_NAME_RE.search(info.filename):
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                canonical = canonical_by_digest.setdefault(digest, info.filename)
+                if canonical != info.filename:
+                    aliases[info.filename] = canonical
+                    continue
+            target.writestr(info, data)
+        if aliases:
+            target.writestr(ALIASES_NAME, json.dumps(aliases))
+    os.replace(temp_path, pack_path)
+    return len(aliases)
+
+
+class TilePack:
+    """Открытый архив тайлов: индекс в памяти и файловый дескриптор для pread."""
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.index = {}
+        with open(index_path_for(pack_path), 'rb') as f:
+            if f.read(4) != INDEX_MAGIC:
+                raise ValueError(f'{pack_path}: неизвестный формат индекса')
+            (count,) = struct.unpack('<Q', f.read(8))
+            data = f.read(count * INDEX_RECORD.size)
+        for level, col, row, offset, size in INDEX_RECORD.iter_unpack(data):
+            self.index[(level, col, row)] = (offset, size)
+        self.fd = os.open(pack_path, os.O_RDONLY)
+
+    def read(self, level, col, row):
+        """Байты тайла или None, если такого тайла нет."""
+        entry = self.index.get((level, col, row))
+        if entry is None:
+            return None
+        offset, size = entry
+        return os.pread(self.fd, size, offset)
+
+    def read_dzi(self):
+        return self.read(DZI_LEVEL, 0, 0)
+
+    def __del__(self):
+        # Закрываем дескриптор, только когда архив больше никто не читает
+        if getattr(self, 'fd', None) is not None:
+            os.close(self.fd)
+
+
+# Открытые архивы кэшируются в процессе: индекс читается один раз, а при
+# перезаписи архива или индекса (новые inode/mtime) архив открывается заново.
+# При повторной нарезке архив переписывается раньше индекса: запрос между ними
+# получит новый архив со старым индексом, но только до build_pack_index —
+# новый индекс меняет ключ, и устаревшая пара больше не используется
+_open_packs = OrderedDict()
+_open_packs_lock = threading.Lock()
+MAX_OPEN_PACKS = 32
+
+
+def file_version(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def open_pack(pack_path):
+    key = (pack_path, file_version(pack_path), file_version(index_path_for(pack_path)))
+    with _open_packs_lock:
+        pack = _open_packs.get(key)
+        if pack is not None:
+            _open_packs.move_to_end(key)
+            return pack
+        pack = TilePack(pack_path)
+        _open_packs[key] = pack
+        while len(_open_packs) > MAX_OPEN_PACKS:
+            _open_packs.popitem(last=False)
+        return pack
@@ -0,0 +1,192 @@
+# app/tile_render.py
+
+import math
+import os
+import threading
+from collections import OrderedDict
+import pyvips
+from django.conf import settings
+from .tile_cache import TileCache
+from .tiling import DZI_TEMPLATE, PyramidLevel, dzi_level_sizes, half_band, nearest_pyramid_level, tiff_pyramid_levels
+
+# =====================================================================
+# Рендеринг тайлов Deep Zoom по запросу
+# Тайл вырезается из исходного файла в момент запроса, поэтому только что
+# загруженное изображение можно смотреть сразу, а уровни, которые никто
+# не открывает, вообще не считаются. Параметры сетки совпадают с dzsave.
+# =====================================================================
+
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+RENDER_FORMATS = {'jpeg': '.jpeg', 'jpg': '.jpeg', 'png': '.png', 'webp': '.webp', 'avif': '.avif'}
+
+
+class SourceImage:
+    """Открытый исходный файл: размеры, уровни DZI и готовые обзоры (для пирамидальных TIFF)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = os.stat(path).st_mtime_ns
+        header = pyvips.Image.new_from_file(path)
+        self.width = header.width
+        self.height = header.height
+        self.max_level, self.level_sizes = dzi_level_sizes(self.width, self.height)
+        self.levels = tiff_pyramid_levels(path) or [PyramidLevel(self.width, self.height, {})]
+        self._pages = {}
+
+    def level_size(self, level):
+        return self.level_sizes[self.max_level - level]
+
+    def page(self, pyramid_level):
+        key = tuple(sorted(pyramid_level.load_options.items()))
+        page = self._pages.get(key)
+        if page is None:
+            page = pyvips.Image.new_from_file(self.path, access='random', **pyramid_level.load_options)
+            self._pages[key] = page
+        return page
+
+    def dzi(self, fmt='jpeg'):
+        return DZI_TEMPLATE.format(
+            format=fmt, overlap=TILE_OVERLAP, tile_size=TILE_SIZE, width=self.width, height=self.height
+        )
+
+
+_sources = OrderedDict()
+_sources_lock = threading.Lock()
+MAX_OPEN_SOURCES = 16
+
+
+def open_source(path):
+    """Открытые источники кэшируются в процессе; замена файла (новый mtime) открывает его заново."""
+    key = (path, os.stat(path).st_mtime_ns)
+    with _sources_lock:
+        source = _sources.get(key)
+        if source is not None:
+            _sources.move_to_end(key)
+            return source
+    source = SourceImage(path)
+    with _sources_lock:
+        _sources[key] = source
+        while len(_sources) > MAX_OPEN_SOURCES:
+            _sources.popitem(last=False)
+    return source
+
+
+def tile_bounds(source, level, col, row):
+    """Прямоугольник тайла на уровне level с учетом перекрытия (как у dzsave) или None."""
+    if level < 0 or level > source.max_level or col < 0 or row < 0:
+        return None
+    level_width, level_height = source.level_size(level)
+    left = col * TILE_SIZE - (TILE_OVERLAP if col > 0 else 0)
+    top = row * TILE_SIZE - (TILE_OVERLAP if row > 0 else 0)
+    if left >= level_width or top >= level_height:
+        return None
+    right = min(level_width, (col + 1) * TILE_SIZE + TILE_OVERLAP)
+    bottom = min(level_height, (row + 1) * TILE_SIZE + TILE_OVERLAP)
+    return left, top, right, bottom
+
+
+def render_tile(source, level, col, row, fmt='jpeg', quality=75):
+    """Байты тайла в формате fmt или None, если тайл вне изображения."""
+    bounds = tile_bounds(source, level, col, row)
+    if bounds is None:
+        return None
+    left, top, right, bottom = bounds
+    tile_width, tile_height = right - left, bottom - top
+    level_width, level_height = source.level_size(level)
+
+    # Берем ближайший не меньший обзор, чтобы на мелких уровнях не читать полное разрешение
+    page = source.page(nearest_pyramid_level(source.levels, level_width, level_height))
+    scale_x = page.width / level_width
+    scale_y = page.height / level_height
+    src_left = math.floor(left * scale_x)
+    src_top = math.floor(top * scale_y)
+    src_right = min(page.width, math.ceil(right * scale_x))
+    src_bottom = min(page.height, math.ceil(bottom * scale_y))
+    region = page.crop(src_left, src_top, src_right - src_left, src_bottom - src_top)
+
+    if (region.width, region.height) != (tile_width, tile_height):
+        region = region.resize(tile_width / region.width, vscale=tile_height / region.height)
+        region = region.gravity('north-west', tile_width, tile_height, extend='copy')
+    return encode_tile(region, fmt, quality)
+
+
+def encode_tile(region, fmt, quality):
+    suffix = RENDER_FORMATS[fmt]
+    if suffix in ('.jpeg', '.webp', '.avif'):
+        return region.write_to_buffer(suffix, Q=quality)
+    return region.write_to_buffer(suffix)
+
+
+def page_scale(source, level):
+    """Во сколько раз ближайший обзор исходника крупнее уровня level (1 — есть уровень нужного размера)."""
+    level_width, level_height = source.level_size(level)
+    return nearest_pyramid_level(source.levels, level_width, level_height).width / level_width
+
+
+def compose_from_children(cache, image_id, source, level, col, row, fmt='jpeg', quality=75):
+    """
+    Тайл уровня level, собранный из закэшированных тайлов уровня level + 1 и уменьшенный
+    усреднением 2x2, как у dzsave; None, если какого-то из них в кэше нет.
+    """
+    bounds = tile_bounds(source, level, col, row)
+    if bounds is None or level >= source.max_level:
+        return None
+    left, top, right, bottom = bounds
+    child_width, child_height = source.level_size(level + 1)
+    region_left, region_top = 2 * left, 2 * top
+    region_right, region_bottom = min(child_width, 2 * right), min(child_height, 2 * bottom)
+    region = None
+    for child_row in range(region_top // TILE_SIZE, (region_bottom - 1) // TILE_SIZE + 1):
+        for child_col in range(region_left // TILE_SIZE, (region_right - 1) // TILE_SIZE + 1):
+            data = cache.get(tile_key(image_id, source, level + 1, child_col, child_row, fmt, quality))
+            if data is None:
+                return None
+            child = pyvips.Image.new_from_buffer(data, '')
+            child_left, child_top, _, _ = tile_bounds(source, level + 1, child_col, child_row)
+            # Из каждого тайла берем только его собственные пиксели (без перекрытия) внутри области
+            x0, x1 = max(child_col * TILE_SIZE, region_left), min((child_col + 1) * TILE_SIZE, region_right)
+            y0, y1 = max(child_row * TILE_SIZE, region_top), min((child_row + 1) * TILE_SIZE, region_bottom)
+            if region is None:
+                region = pyvips.Image.black(region_right - region_left, region_bottom - region_top, bands=child.bands)
+                region = region.cast(child.format).copy(interpretation=child.interpretation)
+            region = region.insert(child.crop(x0 - child_left, y0 - child_top, x1 - x0, y1 - y0),
+                                   x0 - region_left, y0 - region_top)
+    return half_band(region)
+
+
+_tile_cache = None
+
+
+def get_tile_cache():
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache(
+            memory_bytes=settings.TILE_CACHE_MEMORY_BYTES,
+            disk_root=settings.TILE_CACHE_DIR,
+            disk_bytes=settings.TILE_CACHE_DISK_BYTES,
+        )
+    return _tile_cache
+
+
+def tile_key(image_id, source, level, col, row, fmt, quality):
+    return f'image_{image_id}/{source.version}/q{quality}/{level}/{col}_{row}.{fmt}'
+
+
+def get_tile(image_id, source, level, col, row, fmt='jpeg', quality=75):
+    """Тайл из кэша; при промахе рендерится и кладется в кэш."""
+    if tile_bounds(source, level, col, row) is None:
+        return None
+    cache = get_tile_cache()
+
+    def render():
+        # Ближайший обзор не меньше уровня level + 1 (у плоского TIFF — полное разрешение):
+        # мелкий тайл пришлось бы считать из всей его области. Если тайлы уровнем крупнее
+        # уже в кэше (изображение рассматривали ближе), собираем тайл из них, не читая исходник
+        if level < source.max_level and page_scale(source, level) > 1.5:
+            region = compose_from_children(cache, image_id, source, level, col, row, fmt, quality)
+            if region is not None:
+                return encode_tile(region, fmt, quality)
+        return render_tile(source, level, col, row, fmt, quality)
+
+    return cache.get_or_render(tile_key(image_id, source, level, col, row, fmt, quality), render)
@@ -0,0 +1,692 @@
+# app/tiling.py
+
+import math
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import pyvips
+import tifffile
+from django.conf import settings
+
+# =====================================================================
+# Нарезка изображений на тайлы Deep Zoom (DZI)
+# =====================================================================
+
+# Загрузчики libvips, которые умеют отдавать изображение строго сверху вниз
+# (access='sequential'). Остальные форматы (например, FITS, который хранит
+# строки снизу вверх) нарезаются через временную копию в формате .v
+SEQUENTIAL_LOADERS = {
+    'tiffload', 'jpegload', 'pngload', 'vipsload', 'webpload',
+    'heifload', 'jxlload', 'ppmload', 'radload', 'csvload', 'matrixload',
+}
+
+TILING_MODES = ('auto', 'stream', 'copy')
+
+DZI_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"
+  Format="{format}"
+  Overlap="{overlap}"
+  TileSize="{tile_size}"
+  >
+  <Size 
+    Height="{height}"
+    Width="{width}"
+  />
+</Image>
+'''
+
+# Уровень готовой пирамиды внутри TIFF: размеры и параметры загрузки для pyvips
+# ({} — полное разрешение, {'page': n} — отдельная страница, {'subifd': n} — SubIFD)
+PyramidLevel = namedtuple('PyramidLevel', ['width', 'height', 'load_options'])
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS текущего процесса в мегабайтах. На Linux берем VmHWM: ru_maxrss
+    достается дочернему процессу от родителя, и у воркеров и процессов бенчмарка
+    показывал бы пик родителя. Иначе — ru_maxrss (на Linux в килобайтах).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def count_tiles(width, height, tile_size=254):
+    """Сколько тайлов будет во всей пирамиде DZI."""
+    _, sizes = dzi_level_sizes(width, height)
+    return sum(math.ceil(w / tile_size) * math.ceil(h / tile_size) for w, h in sizes)
+
+
+class TilingProgress:
+    """
+    Счетчики прогресса нарезки. Обновляются либо точно (add — тайлы, записанные
+    своим кодом), либо по сигналу eval из libvips (watch — пока работает dzsave,
+    тогда число тайлов оценивается по доле выполненной работы).
+    Снимок state() безопасно читать из другого потока.
+    """
+
+    def __init__(self, total_tiles, bytes_probe=None):
+        self.total_tiles = max(total_tiles, 1)
+        self.bytes_probe = bytes_probe
+        self.started = time.monotonic()
+        self.tiles_written = 0
+        self.bytes_written = 0
+        self.fraction = 0.0
+        # Тайлы, записанные прошлыми попытками (при продолжении с контрольной точки)
+        self.tiles_before = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.tiles_before = self.tiles_written = self.bytes_written = 0
+            self.fraction = 0.0
+
+    def resume_from(self, tiles):
+        """Тайлы, записанные прошлыми попытками: входят в процент, но не в скорость."""
+        with self._lock:
+            self.tiles_before = self.tiles_written = tiles
+            self.fraction = tiles / self.total_tiles
+
+    def add(self, tiles, nbytes=0):
+        with self._lock:
+            self.tiles_written += tiles
+            self.bytes_written += nbytes
+            self.fraction = min(self.tiles_written / self.total_tiles, 1.0)
+
+    def set_fraction(self, fraction):
+        with self._lock:
+            self.fraction = max(self.fraction, min(fraction, 1.0))
+            self.tiles_written = max(self.tiles_written, round(self.total_tiles * self.fraction))
+
+    def watch(self, image, start=0.0, end=1.0):
+        """Подписывается на прогресс libvips для image; его доля работы — от start до end."""
+        image.set_progress(True)
+
+        def on_eval(_image, progress):
+            self.set_fraction(start + (end - start) * progress.percent / 100)
+
+        image.signal_connect('eval', on_eval)
+        return image
+
+    def finish(self):
+        with self._lock:
+            self.fraction = 1.0
+            self.tiles_written = max(self.tiles_written, self.total_tiles)
+
+    def state(self):
+        with self._lock:
+            fraction = self.fraction
+            tiles_written = self.tiles_written
+            tiles_this_run = tiles_written - self.tiles_before
+            bytes_written = self.bytes_written
+        if self.bytes_probe is not None:
+            bytes_written = self.bytes_probe()
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        tiles_per_second = tiles_this_run / elapsed
+        eta = None
+        if 0 < fraction < 1 and tiles_per_second > 0:
+            eta = round((self.total_tiles - tiles_written) / tiles_per_second)
+        return {
+            'progress_percent': round(fraction * 100, 1),
+            'tiles_written': tiles_written,
+            'tiles_per_second': round(tiles_per_second, 1),
+            'bytes_written': bytes_written,
+            'eta_seconds': eta,
+        }
+
+
+def output_bytes_probe(output_prefix):
+    """
+    Функция, возвращающая, сколько байт уже записал dzsave. Архив просто меряется;
+    для каталога с тайлами обходить миллионы файлов дорого, поэтому берется
+    прирост занятого места на файловой системе — приблизительно, зато бесплатно.
+    """
+    if output_prefix.endswith('.zip'):
+        return lambda: os.path.getsize(output_prefix) if os.path.exists(output_prefix) else 0
+    output_dir = os.path.dirname(output_prefix)
+    used_before = shutil.disk_usage(output_dir).used
+    return lambda: max(shutil.disk_usage(output_dir).used - used_before, 0)
+
+
+def tile_options(tile_format='jpeg', quality=75, skip_blanks=False):
+    """
+    Параметры dzsave для формата тайлов: suffix вида '.webp[Q=80]' и, если нужно,
+    пропуск пустых тайлов — тех, что не отличаются от фона больше чем на порог.
+    """
+    options = {'suffix': f'.{tile_format}[Q={quality}]'}
+    if skip_blanks:
+        options['skip_blanks'] = settings.TILING_BLANK_THRESHOLD
+        options['background'] = [settings.TILING_BLANK_BACKGROUND]
+    return options
+
+
+def source_loader(source_path):
+    """Имя загрузчика libvips для файла, например 'tiffload'."""
+    return pyvips.Image.new_from_file(source_path).get('vips-loader')
+
+
+def supports_sequential(source_path):
+    return source_loader(source_path) in SEQUENTIAL_LOADERS
+
+
+def make_thumbnail(source_path, thumbnail_path, size=512):
+    # Image.thumbnail открывает файл сам и использует shrink-on-load / уменьшенные
+    # страницы пирамиды, поэтому не мешает последовательному чтению при нарезке
+    thumbnail_image = pyvips.Image.thumbnail(source_path, size, height=size, crop='centre')
+    thumbnail_image.write_to_file(thumbnail_path)
+
+
+def clear_tiles(output_prefix):
+    """Удаляет результат (возможно, частичный) предыдущей нарезки."""
+    if output_prefix.endswith('.zip'):
+        if os.path.exists(output_prefix):
+            os.remove(output_prefix)
+        return
+    shutil.rmtree(f'{output_prefix}_files', ignore_errors=True)
+    shutil.rmtree(f'{output_prefix}_partial', ignore_errors=True)
+    if os.path.exists(f'{output_prefix}.dzi'):
+        os.remove(f'{output_prefix}.dzi')
+
+
+def count_tile_files(files_dir):
+    """Сколько тайлов реально лежит в <prefix>_files (пустые могли быть пропущены)."""
+    return sum(
+        1 for _, _, files in os.walk(files_dir) for name in files if not name.endswith('.xml')
+    )
+
+
+def tile_streaming(source_path, output_prefix, log=print, progress=None, **dz_options):
+    """Нарезка за один проход: источник читается последовательно, без промежуточной копии."""
+    image = pyvips.Image.new_from_file(source_path, access='sequential')
+    if progress:
+        progress.watch(image)
+    log(f'Потоковая нарезка {source_path} -> {output_prefix}')
+    image.dzsave(output_prefix, **dz_options)
+
+
+def tile_with_copy(source_path, output_prefix, log=print, progress=None, **dz_options):
+    """
+    Запасной путь для форматов без последовательного чтения: изображение сначала
+    "нормализуется" во временный файл .v, и уже он нарезается на тайлы.
+    """
+    fd, temp_vips_file = tempfile.mkstemp(suffix='.v', dir=settings.TILING_SCRATCH_DIR)
+    os.close(fd)
+    try:
+        log(f'Создаю временный файл для нормализации: {temp_vips_file}')
+        pyvips.Image.new_from_file(source_path).write_to_file(temp_vips_file)
+        image = pyvips.Image.new_from_file(temp_vips_file)
+        if progress:
+            progress.watch(image)
+        image.dzsave(output_prefix, **dz_options)
+    finally:
+        if os.path.exists(temp_vips_file):
+            os.remove(temp_vips_file)
+            log(f'Временный файл {temp_vips_file} удален.')
+
+
+# =====================================================================
+# Переиспользование готовых уровней пирамидальных TIFF / COG
+# =====================================================================
+def tiff_pyramid_levels(source_path):
+    """
+    Находит уровни пирамиды (обзоры) внутри TIFF с помощью tifffile.
+    Возвращает список PyramidLevel от полного разрешения к самому мелкому;
+    пустой список — если файл не TIFF или в нем только одно разрешение.
+    """
+    try:
+        with tifffile.TiffFile(source_path) as tif:
+            series = tif.series[0]
+            # Стеки, многоканальные OME и т.п. не трогаем: там уровни не являются обзорами одного кадра
+            if series.axes not in ('YX', 'YXS') or len(series.levels) < 2:
+                return []
+            page_by_offset = {page.offset: index for index, page in enumerate(tif.pages)}
+            levels = []
+            for number, level in enumerate(series.levels):
+                height, width = level.shape[:2]
+                keyframe = level.keyframe
+                if number == 0:
+                    load_options = {}
+                elif keyframe.offset in page_by_offset:
+                    # Обзоры как отдельные страницы (COG, tiffsave pyramid=True)
+                    load_options = {'page': page_by_offset[keyframe.offset]}
+                else:
+                    # Обзоры в SubIFD (OME-TIFF, tiffsave subifd=True)
+                    index = keyframe.index
+                    load_options = {'subifd': index[-1] if isinstance(index, tuple) else index}
+                levels.append(PyramidLevel(width, height, load_options))
+            return levels
+    except Exception:
+        return []
+
+
+def dzi_level_sizes(width, height):
+    """Размеры уровней Deep Zoom от самого крупного (номер max_level) до 1x1 (номер 0)."""
+    max_level = math.ceil(math.log2(max(width, height)))
+    return max_level, [
+        (math.ceil(width / 2 ** shrink), math.ceil(height / 2 ** shrink))
+        for shrink in range(max_level + 1)
+    ]
+
+
+def nearest_pyramid_level(levels, width, height):
+    """Самый мелкий уровень пирамиды, который еще не меньше нужного размера."""
+    # Допуск в 1 px: обзоры обычно округляют размеры вниз, а уровни DZI — вверх
+    candidates = [level for level in levels if level.width + 1 >= width and level.height + 1 >= height]
+    return min(candidates, key=lambda level: level.width)
+
+
+def pyramid_level_image(source_path, levels, level_width, level_height):
+    """Изображение уровня DZI нужного размера из ближайшего не меньшего уровня пирамиды."""
+    source = nearest_pyramid_level(levels, level_width, level_height)
+    access = 'sequential' if source is levels[0] else 'random'
+    image = pyvips.Image.new_from_file(source_path, access=access, **source.load_options)
+    if (image.width, image.height) != (level_width, level_height):
+        image = image.resize(level_width / image.width, vscale=level_height / image.height)
+        # resize округляет размеры; доводим до точного размера уровня
+        image = image.gravity('north-west', level_width, level_height, extend='copy')
+    return image, source
+
+
+def save_single_level(image, files_dir, level_number, scratch_dir, **dz_options):
+    """Нарезает одно изображение как уровень level_number готовой пирамиды."""
+    scratch_prefix = os.path.join(scratch_dir, str(level_number))
+    image.dzsave(scratch_prefix, depth='one', properties=False, **dz_options)
+    target = os.path.join(files_dir, str(level_number))
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(os.path.join(f'{scratch_prefix}_files', '0'), target)
+
+
+def tile_from_pyramid(source_path, output_prefix, levels, log=print, progress=None, **dz_options):
+    """
+    Строит пирамиду Deep Zoom по уровням: каждый уровень DZI берется из ближайшего
+    не меньшего обзора TIFF и при необходимости дожимается resize. Из полного
+    разрешения считается только то, для чего подходящего обзора нет.
+    """
+    full = levels[0]
+    max_level, sizes = dzi_level_sizes(full.width, full.height)
+    files_dir = f'{output_prefix}_files'
+    scratch_dir = tempfile.mkdtemp(prefix='dzlevel_', dir=os.path.dirname(output_prefix))
+    os.makedirs(files_dir, exist_ok=True)
+    total_tiles = count_tiles(full.width, full.height)
+    done_tiles = 0
+    try:
+        for shrink, (level_width, level_height) in enumerate(sizes):
+            level_number = max_level - shrink
+            image, source = pyramid_level_image(source_path, levels, level_width, level_height)
+            level_tiles = math.ceil(level_width / 254) * math.ceil(level_height / 254)
+            if progress:
+                progress.watch(image, done_tiles / total_tiles, (done_tiles + level_tiles) / total_tiles)
+            done_tiles += level_tiles
+            # Все уровни, и верхний тоже, пишутся в черновой каталог и заменяют прежние целиком:
+            # повторная нарезка в тот же префикс не упирается в непустой каталог уровня
+            save_single_level(image, files_dir, level_number, scratch_dir, **dz_options)
+            log(f'Уровень {level_number} ({level_width}x{level_height}) построен из {source.width}x{source.height}')
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    write_dzi(output_prefix, full.width, full.height, 254, 1, tile_file_suffix(dz_options).lstrip('.'))
+
+
+# =====================================================================
+# Возобновляемая нарезка с контрольными точками
+# Верхний (самый дорогой) уровень пишется полосами по одному ряду тайлов,
+# после каждой полосы сохраняется контрольная точка. Для плоских файлов
+# каждая полоса заодно уменьшается вдвое и складывается в <prefix>_partial/,
+# из этих половинок потом строятся все нижние уровни. Для пирамидальных
+# TIFF нижние уровни берутся из обзоров, с контрольной точкой на уровень.
+# После падения нарезка продолжается с первой незавершенной полосы.
+# =====================================================================
+def tile_file_suffix(dz_options):
+    # '.jpeg[Q=80]' -> '.jpeg'
+    return dz_options.get('suffix', '.jpeg').split('[')[0]
+
+
+def row_tile_paths(level_dir, row, width, tile_size, suffix):
+    columns = math.ceil(width / tile_size)
+    return [os.path.join(level_dir, f'{col}_{row}{suffix}') for col in range(columns)]
+
+
+def valid_tile(path, allow_missing=False):
+    """
+    Тайл записан целиком: файл непустой, а JPEG заканчивается маркером EOI.
+    allow_missing — при пропуске пустых тайлов отсутствие файла нормально.
+    """
+    if allow_missing and not os.path.exists(path):
+        return True
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return False
+        if path.endswith(('.jpeg', '.jpg')):
+            with open(path, 'rb') as f:
+                f.seek(-2, os.SEEK_END)
+                return f.read(2) == b'\xff\xd9'
+        return True
+    except OSError:
+        return False
+
+
+def is_blank_tile(tile, threshold, background):
+    """Та же проверка, что у dzsave(skip_blanks=...): все пиксели в пределах порога от фона."""
+    return (tile - background).abs().max() <= threshold
+
+
+def write_tile_row(image, level_dir, row, executor, tile_size, overlap, dz_options, columns=None):
+    """
+    Пишет один ряд тайлов уровня (или только тайлы columns — диапазон номеров столбцов).
+    Возвращает полосу без перекрытия (для уменьшения), число обработанных тайлов
+    (с пропущенными пустыми) и размер записанных в байтах.
+    """
+    width, height = image.width, image.height
+    columns = columns or range(math.ceil(width / tile_size))
+    top = row * tile_size - (overlap if row > 0 else 0)
+    bottom = min(height, (row + 1) * tile_size + overlap)
+    band_left = columns[0] * tile_size - (overlap if columns[0] > 0 else 0)
+    band_right = min(width, columns[-1] * tile_size + tile_size + overlap)
+    # Полоса целиком в памяти: тайлы режутся из нее без повторного декодирования источника
+    band = image.crop(band_left, top, band_right - band_left, bottom - top).copy_memory()
+
+    suffix = dz_options.get('suffix', '.jpeg')
+    extension = tile_file_suffix(dz_options)
+    skip_blanks = dz_options.get('skip_blanks', -1)
+    background = dz_options.get('background', [0])
+    futures = []
+    paths = []
+    for col in columns:
+        left = col * tile_size - (overlap if col > 0 else 0)
+        right = min(width, (col + 1) * tile_size + overlap)
+        tile = band.crop(left - band_left, 0, right - left, band.height)
+        path = os.path.join(level_dir, f'{col}_{row}{extension}')
+        # Файл мог остаться от прошлой попытки (пустой тайл — с другими настройками). Его
+        # удаляем, а не перезаписываем: после дедупликации это жесткая ссылка на общий файл
+        if os.path.lexists(path):
+            os.remove(path)
+        if skip_blanks >= 0 and is_blank_tile(tile, skip_blanks, background):
+            continue
+        paths.append(path)
+        # Без метаданных источника (EXIF и т. п.), как пишет тайлы dzsave
+        futures.append(executor.submit(tile.write_to_file, path + suffix[len(extension):], strip=True))
+    for future in futures:
+        future.result()
+
+    core_top = row * tile_size - top
+    core_height = min(height, (row + 1) * tile_size) - row * tile_size
+    core_left = columns[0] * tile_size - band_left
+    core_width = min(width, (columns[-1] + 1) * tile_size) - columns[0] * tile_size
+    written_bytes = sum(os.path.getsize(path) for path in paths)
+    return band.crop(core_left, core_top, core_width, core_height), len(columns), written_bytes
+
+
+def directory_bytes(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def half_band(band):
+    """Уменьшение полосы вдвое усреднением 2x2, как dzsave строит следующий уровень."""
+    pad_width = band.width + band.width % 2
+    pad_height = band.height + band.height % 2
+    if (pad_width, pad_height) != (band.width, band.height):
+        band = band.gravity('north-west', pad_width, pad_height, extend='copy')
+    # shrink над целыми отбрасывает дробную часть среднего, а dzsave его округляет:
+    # ошибка в 1 накапливалась по уровням и после JPEG давала заметную разницу
+    return (band.cast('float').shrink(2, 2) + 0.5).cast(band.format)
+
+
+def save_lower_levels(half, files_dir, max_level, scratch_dir, progress=None, **dz_options):
+    """
+    Строит уровни max_level-1..0 из уже уменьшенного вдвое верхнего уровня half
+    (склеенного из половинок полос или областей) одним вызовом dzsave.
+    """
+    scratch_prefix = os.path.join(scratch_dir, 'lower')
+    half.dzsave(scratch_prefix, properties=False, **dz_options)
+    for level_number in range(max_level):
+        target = os.path.join(files_dir, str(level_number))
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(os.path.join(f'{scratch_prefix}_files', str(level_number)), target)
+        if progress:
+            # Тайлы уже посчитаны по сигналу eval, здесь — только их размер
+            progress.add(0, directory_bytes(target))
+
+
+def write_dzi(output_prefix, width, height, tile_size, overlap, fmt):
+    with open(f'{output_prefix}.dzi', 'w') as f:
+        f.write(DZI_TEMPLATE.format(format=fmt, overlap=overlap, tile_size=tile_size, width=width, height=height))
+
+
+def tile_resumable(source_path, output_prefix, checkpoint=None, on_checkpoint=None, levels=None,
+                   tile_size=254, overlap=1, log=print, progress=None, **dz_options):
+    """
+    Нарезка с контрольными точками. checkpoint — словарь, сохраненный прошлой попыткой
+    (пустой — начать заново); on_checkpoint(checkpoint) вызывается после каждого шага.
+    levels — уровни пирамиды TIFF, если нижние уровни нужно брать из обзоров.
+    """
+    checkpoint = dict(checkpoint or {})
+    on_checkpoint = on_checkpoint or (lambda state: None)
+    image = pyvips.Image.new_from_file(source_path, access='random')
+    width, height = image.width, image.height
+    max_level, sizes = dzi_level_sizes(width, height)
+    rows = math.ceil(height / tile_size)
+    extension = tile_file_suffix(dz_options)
+
+    files_dir = f'{output_prefix}_files'
+    partial_dir = f'{output_prefix}_partial'
+    top_dir = os.path.join(files_dir, str(max_level))
+    os.makedirs(top_dir, exist_ok=True)
+    os.makedirs(partial_dir, exist_ok=True)
+
+    if not checkpoint:
+        checkpoint = {'rows_total': rows, 'rows_done': 0, 'levels_done': []}
+        on_checkpoint(checkpoint)
+
+    # --- 1. Верхний уровень полосами. Уже записанные ряды перепроверяем ---
+    rows_done = checkpoint['rows_done']
+    allow_missing = dz_options.get('skip_blanks', -1) >= 0
+    for row in range(rows_done):
+        half_path = os.path.join(partial_dir, f'half_{row}.v')
+        tiles_ok = all(
+            valid_tile(path, allow_missing) for path in row_tile_paths(top_dir, row, width, tile_size, extension)
+        )
+        if not tiles_ok or (not levels and not os.path.exists(half_path)):
+            log(f'Ряд {row} записан не полностью, продолжаю с него.')
+            rows_done = row
+            break
+    if rows_done:
+        log(f'Продолжаю нарезку: готово {rows_done} из {rows} рядов верхнего уровня.')
+    columns = math.ceil(width / tile_size)
+    if progress:
+        progress.resume_from(rows_done * columns)
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for row in range(rows_done, rows):
+            core, tiles, written_bytes = write_tile_row(image, top_dir, row, executor, tile_size, overlap, dz_options)
+            if progress:
+                progress.add(tiles, written_bytes)
+            if not levels:
+                half_band(core).write_to_file(os.path.join(partial_dir, f'half_{row}.v'))
+            checkpoint['rows_done'] = row + 1
+            on_checkpoint(checkpoint)
+    log(f'Уровень {max_level} ({width}x{height}) готов.')
+
+    # --- 2. Нижние уровни ---
+    top_share = rows * columns / count_tiles(width, height, tile_size)
+    scratch_dir = tempfile.mkdtemp(prefix='dzlevel_', dir=partial_dir)
+    try:
+        if levels:
+            for shrink, (level_width, level_height) in enumerate(sizes[1:], start=1):
+                level_number = max_level - shrink
+                if level_number in checkpoint['levels_done']:
+                    continue
+                level_image, source = pyramid_level_image(source_path, levels, level_width, level_height)
+                save_single_level(level_image, files_dir, level_number, scratch_dir, **dz_options)
+                if progress:
+                    progress.add(
+                        math.ceil(level_width / tile_size) * math.ceil(level_height / tile_size),
+                        directory_bytes(os.path.join(files_dir, str(level_number)))
+                    )
+                checkpoint['levels_done'].append(level_number)
+                on_checkpoint(checkpoint)
+                log(f'Уровень {level_number} ({level_width}x{level_height}) построен из {source.width}x{source.height}')
+        elif max_level > 0 and checkpoint['levels_done'] != list(range(max_level)):
+            halves = [pyvips.Image.new_from_file(os.path.join(partial_dir, f'half_{row}.v')) for row in range(rows)]
+            # arrayjoin выравнивает ячейки по самой большой, последняя полоса ниже — обрезаем лишнее
+            half = pyvips.Image.arrayjoin(halves, across=1).crop(0, 0, *sizes[1])
+            if progress:
+                progress.watch(half, top_share, 1.0)
+            save_lower_levels(half, files_dir, max_level, scratch_dir, progress, **dz_options)
+            checkpoint['levels_done'] = list(range(max_level))
+            on_checkpoint(checkpoint)
+            log(f'Уровни {max_level - 1}..0 построены из уменьшенных полос.')
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    write_dzi(output_prefix, width, height, tile_size, overlap, extension.lstrip('.'))
+    shutil.rmtree(partial_dir, ignore_errors=True)
+
+
+# =====================================================================
+# Распределенная нарезка
+# Верхний уровень делится на области, выровненные по сетке тайлов
+# (region_tiles x region_tiles тайлов). Каждую область независимо режет
+# свой воркер — в том числе на другой машине с общим MEDIA_ROOT: пишет ее
+# тайлы прямо в <prefix>_files/<max_level>/ и уменьшенную вдвое копию
+# в <prefix>_partial/region_<x>_<y>.v. Когда готовы все области, из
+# половинок склеивается следующий уровень и строятся остальные.
+# =====================================================================
+def tiling_regions(width, height, region_tiles, tile_size=254):
+    """Области верхнего уровня: {'x', 'y', 'columns': [от, до), 'rows': [от, до)} в номерах тайлов."""
+    columns = math.ceil(width / tile_size)
+    rows = math.ceil(height / tile_size)
+    regions = []
+    for y, row in enumerate(range(0, rows, region_tiles)):
+        for x, col in enumerate(range(0, columns, region_tiles)):
+            regions.append({
+                'x': x,
+                'y': y,
+                'columns': [col, min(col + region_tiles, columns)],
+                'rows': [row, min(row + region_tiles, rows)],
+            })
+    return regions
+
+
+def region_half_path(output_prefix, region):
+    return os.path.join(f'{output_prefix}_partial', f'region_{region["x"]}_{region["y"]}.v')
+
+
+def tile_region(source_path, output_prefix, region, tile_size=254, overlap=1, **dz_options):
+    """
+    Режет одну область верхнего уровня. Возвращает (число тайлов, байт записано).
+    Повторный запуск просто перезаписывает область, поэтому задачу можно повторять.
+    """
+    image = pyvips.Image.new_from_file(source_path, access='random')
+    max_level, _ = dzi_level_sizes(image.width, image.height)
+    top_dir = os.path.join(f'{output_prefix}_files', str(max_level))
+    os.makedirs(top_dir, exist_ok=True)
+    os.makedirs(f'{output_prefix}_partial', exist_ok=True)
+
+    columns = range(*region['columns'])
+    halves = []
+    tiles = written_bytes = 0
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for row in range(*region['rows']):
+            core, row_tiles, row_bytes = write_tile_row(
+                image, top_dir, row, executor, tile_size, overlap, dz_options, columns=columns
+            )
+            halves.append(half_band(core))
+            tiles += row_tiles
+            written_bytes += row_bytes
+
+    # Половинка появляется под своим именем только целиком: по ней сборка понимает, что область готова
+    half_path = region_half_path(output_prefix, region)
+    pyvips.Image.arrayjoin(halves, across=1).write_to_file(f'{half_path}.tmp.v')
+    os.replace(f'{half_path}.tmp.v', half_path)
+    return tiles, written_bytes
+
+
+def merge_regions(output_prefix, width, height, regions, tile_size=254, overlap=1, log=print, progress=None,
+                  **dz_options):
+    """Собирает нижние уровни из половинок всех областей и пишет .dzi."""
+    max_level, sizes = dzi_level_sizes(width, height)
+    files_dir = f'{output_prefix}_files'
+    partial_dir = f'{output_prefix}_partial'
+    if max_level > 0:
+        across = max(region['x'] for region in regions) + 1
+        ordered = sorted(regions, key=lambda region: (region['y'], region['x']))
+        halves = [pyvips.Image.new_from_file(region_half_path(output_prefix, region)) for region in ordered]
+        # Как и у полос: arrayjoin выравнивает ячейки по самой большой, лишнее справа и снизу обрезаем
+        half = pyvips.Image.arrayjoin(halves, across=across).crop(0, 0, *sizes[1])
+        if progress:
+            top_share = math.ceil(width / tile_size) * math.ceil(height / tile_size) / count_tiles(width, height, tile_size)
+            progress.watch(half, top_share, 1.0)
+        scratch_dir = tempfile.mkdtemp(prefix='dzlevel_', dir=partial_dir)
+        try:
+            save_lower_levels(half, files_dir, max_level, scratch_dir, progress, **dz_options)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        log(f'Уровни {max_level - 1}..0 собраны из {len(regions)} областей.')
+    write_dzi(output_prefix, width, height, tile_size, overlap, tile_file_suffix(dz_options).lstrip('.'))
+    shutil.rmtree(partial_dir, ignore_errors=True)
+
+
+def tile_source(source_path, output_prefix, mode='auto', reuse_pyramid=True, log=print, progress=None, **dz_options):
+    """
+    Нарезает файл на тайлы по префиксу output_prefix (получатся <prefix>.dzi и <prefix>_files/).
+
+    mode:
+      'stream' — только потоковая нарезка;
+      'copy'   — всегда через временную копию .v (старое поведение);
+      'auto'   — потоково, если формат это позволяет, иначе (или при ошибке
+                 последовательного чтения) через копию.
+
+    Если reuse_pyramid и файл — пирамидальный TIFF, нижние уровни строятся из его
+    готовых обзоров (кроме режима 'copy' и упаковки в архив: output_prefix
+    вида '<...>.zip' отдается dzsave целиком, одним файлом).
+
+    Возвращает словарь с фактическим путем, временем и пиковым RSS.
+    """
+    if mode not in TILING_MODES:
+        raise ValueError(f'Неизвестный режим нарезки: {mode}')
+
+    started = time.monotonic()
+    used = mode
+
+    packed = output_prefix.endswith('.zip')
+    levels = tiff_pyramid_levels(source_path) if reuse_pyramid and mode != 'copy' and not packed else []
+    if levels:
+        log(f'Найдена готовая пирамида TIFF: {len(levels)} уровней, переиспользую обзоры.')
+        tile_from_pyramid(source_path, output_prefix, levels, log=log, progress=progress, **dz_options)
+        used = 'pyramid'
+    elif mode == 'auto':
+        used = 'stream' if supports_sequential(source_path) else 'copy'
+        if used == 'copy':
+            log(f'Загрузчик {source_loader(source_path)} не поддерживает последовательное чтение, нарезаю через копию.')
+
+    if used == 'stream':
+        try:
+            tile_streaming(source_path, output_prefix, log=log, progress=progress, **dz_options)
+        except pyvips.Error as e:
+            if mode == 'stream':
+                raise
+            # Например, "out of order read": файл нельзя прочитать строго сверху вниз
+            log(f'Потоковая нарезка не удалась ({e}). Повторяю через временную копию.')
+            clear_tiles(output_prefix)
+            if progress:
+                progress.reset()
+            used = 'copy'
+
+    if used == 'copy':
+        tile_with_copy(source_path, output_prefix, log=log, progress=progress, **dz_options)
+
+    return {
+        'mode': used,
+        'wall_time': time.monotonic() - started,
+        'peak_rss_mb': peak_rss_mb(),
+    }
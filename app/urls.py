@@ -20,9 +20,45 @@ urlpatterns = [
     path('api/markers/<int:marker_id>/chat/', views.ChatMessageCreateView.as_view(), name='chat-message-create'),
     # 5. Создание маркера
     path('api/images/<int:image_id>/markers/', views.MarkerCreateView.as_view(), name='marker-create'),
+    # 5a. Маркеры в видимой области: ?bbox=min_x,min_y,max_x,max_y (нормированные 0..1)&zoom=<z>
+    path('api/images/<int:image_id>/markers/viewport/', views.MarkerViewportView.as_view(), name='marker-viewport'),
+    # 5b. Кластеры маркеров для мелкого масштаба: ?zoom=<z>&bbox=...
+    path('api/images/<int:image_id>/markers/clusters/', views.MarkerClusterView.as_view(), name='marker-clusters'),
+    # 5c. Массовый импорт маркеров/объектов поиска из CSV/NDJSON
+    path('api/images/<int:image_id>/import/', views.BulkImportView.as_view(), name='bulk-import'),
+    # 5d. Поиск объектов в видимой области по смыслу: ?q=<текст>&bbox=...&limit=<n>
+    path('api/images/<int:image_id>/objects/search/', views.ObjectSearchView.as_view(), name='object-search'),
+    # 5e. Полнотекстовый поиск по маркерам, чату и объектам: ?q=<текст>&type=marker,comment,object&offset=<n>&limit=<n>
+    path('api/images/<int:image_id>/search/', views.FulltextSearchView.as_view(), name='fulltext-search'),
     
-    # Вспомогательный эндпоинт для DZI
-    # path('dzi/<int:image_id>/', views.DziView.as_view(), name='dzi-view'),
+    # 6. Тайлы из упакованного архива
+    path('api/tiles/<int:image_id>.dzi', views.PackedTileView.as_view(), name='packed-dzi'),
+    path(
+        'api/tiles/<int:image_id>_files/<int:level>/<int:col>_<int:row>.<str:fmt>',
+        views.PackedTileView.as_view(),
+        name='packed-tile'
+    ),
+
+    # 7. Тайлы "на лету" из исходного файла
+    path('dzi/<int:image_id>.dzi', views.DziView.as_view(), name='dzi-view'),
+    path(
+        'dzi/<int:image_id>_files/<int:level>/<int:col>_<int:row>.<str:fmt>',
+        views.DziView.as_view(),
+        name='dzi-tile'
+    ),
+
+    # 8. Статус и прогресс нарезки (для опроса клиентом)
+    path('api/images/<int:id>/status/', views.ImageStatusView.as_view(), name='image-status'),
+
+    # 9. Попадания/промахи кэша ответов API (GET), сброс счетчиков (DELETE)
+    path('api/cache/stats/', views.ApiCacheStatsView.as_view(), name='api-cache-stats'),
+
+    # 10. Живые события (SSE): новые сообщения чата маркера и новые маркеры изображения
+    path('api/markers/<int:marker_id>/events/', views.marker_events, name='marker-events'),
+    path('api/images/<int:image_id>/events/', views.image_events, name='image-events'),
+
+    # 11. Вопрос AI о маркере (POST {"prompt": ...}; ответы кэшируются)
+    path('api/markers/<int:marker_id>/ask/', views.PointQuestionView.as_view(), name='point-question'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,367 @@
+# app/vectors.py
+
+import fcntl
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# =====================================================================
+# Векторный поиск объектов (SearchableObject)
+# Вектор объекта хранится под его vector_id в бэкенде VECTOR_BACKEND:
+# LocalVectorIndex — файлы в VECTOR_INDEX_DIR, отображенные в память
+# (поиск без сети, работает и в тестах), UpstashVectorIndex — Upstash Vector.
+# Сходство — косинусное: вектора хранятся нормированными, и оценка —
+# скалярное произведение. Точный поиск перебирает все вектора одним
+# умножением матрицы на вектор; для больших каталогов индекс можно
+# обучить (IVF, manage.py train_vector_index): вектора делятся на списки
+# по ближайшему центру, и поиск смотрит только VECTOR_IVF_NPROBE
+# ближайших к запросу списков. Вектора считает конвейер эмбеддингов
+# (app/embeddings.py), удаления объектов убирают их вектора сигналами.
+# =====================================================================
+
+# Векторов за одно умножение при обучении и разметке IVF (ограничивает временную память)
+CHUNK_SIZE = 65536
+# Точек выборки k-means на один список IVF
+TRAIN_POINTS_PER_LIST = 64
+
+
+def normalize(matrix):
+    """Строки float32 единичной длины (нулевые остаются нулевыми)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def top_k(scores, k):
+    """Номера k наибольших оценок по убыванию."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+def split_ids(vector_ids):
+    """UUID -> массив (n, 2) uint64: старшая и младшая половины."""
+    ids = np.empty((len(vector_ids), 2), dtype=np.uint64)
+    for row, vector_id in enumerate(vector_ids):
+        value = uuid.UUID(str(vector_id)).int
+        ids[row] = (value >> 64, value & 0xFFFFFFFFFFFFFFFF)
+    return ids
+
+
+def join_id(row):
+    return uuid.UUID(int=(int(row[0]) << 64) | int(row[1]))
+
+
+class LocalVectorIndex:
+    """
+    Индекс в каталоге path:
+    vectors.f32 — матрица слотов x dimensions (нормированные вектора),
+    ids.u64 — vector_id слота двумя uint64 (нули — свободный слот),
+    lists.i32 — номер списка IVF слота + 1 (0 — вне списков), centroids.npy — центры IVF,
+    meta.json — размерность, занятые слоты, емкость, поколение.
+    Запись идет под файловой блокировкой (процессов может быть несколько);
+    читатели переоткрывают файлы, когда meta.json заменяется новым поколением.
+    """
+
+    def __init__(self, path=None, dimensions=None):
+        self.path = str(path or settings.VECTOR_INDEX_DIR)
+        self.dimensions = dimensions or settings.VECTOR_DIMENSIONS
+        self.lock = threading.Lock()
+        self.signature = None
+        self.state = None
+        # vector_id -> слот и свободные слоты; нужны только для записи, строятся по ids
+        self.slots = None
+        self.free = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    # --- Состояние ----------------------------------------------------
+
+    def refresh(self):
+        """Переоткрывает файлы, если другой процесс (или этот) записал новое поколение."""
+        try:
+            stat = os.stat(self.file('meta.json'))
+            signature = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if signature == self.signature and self.state is not None:
+            return self.state
+        if signature is None:
+            meta = {'dimensions': self.dimensions, 'count': 0, 'capacity': 0, 'generation': 0, 'lists': 0}
+        else:
+            with open(self.file('meta.json')) as f:
+                meta = json.load(f)
+        if meta['dimensions'] != self.dimensions:
+            raise ValueError(
+                f'Индекс {self.path} построен для векторов размерности {meta["dimensions"]}, '
+                f'а VECTOR_DIMENSIONS = {self.dimensions}: его нужно построить заново.'
+            )
+        state = {
+            'meta': meta, 'vectors': None, 'ids': None, 'lists': None, 'centroids': None,
+            'inverted': None, 'lookup': None,
+        }
+        if meta['capacity']:
+            capacity = meta['capacity']
+            state['vectors'] = np.memmap(self.file('vectors.f32'), np.float32, 'r+', shape=(capacity, self.dimensions))
+            state['ids'] = np.memmap(self.file('ids.u64'), np.uint64, 'r+', shape=(capacity, 2))
+            state['lists'] = np.memmap(self.file('lists.i32'), np.int32, 'r+', shape=(capacity,))
+        if meta['lists']:
+            state['centroids'] = np.load(self.file('centroids.npy'))
+        self.signature = signature
+        self.state = state
+        self.slots = self.free = None
+        return state
+
+    def __len__(self):
+        state = self.refresh()
+        count = state['meta']['count']
+        return int(np.count_nonzero(state['ids'][:count].any(axis=1))) if count else 0
+
+    @contextmanager
+    def writing(self):
+        """Запись: блокировка процесса и файла, свежее состояние, в конце — новое поколение meta.json."""
+        with self.lock, open(self.file('lock'), 'a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self.refresh()
+                if self.slots is None:
+                    self.index_slots(state)
+                yield state
+                for name in ('vectors', 'ids', 'lists'):
+                    if state[name] is not None:
+                        state[name].flush()
+                meta = state['meta']
+                meta['generation'] += 1
+                temporary = self.file('meta.json.tmp')
+                with open(temporary, 'w') as f:
+                    json.dump(meta, f)
+                os.replace(temporary, self.file('meta.json'))
+                stat = os.stat(self.file('meta.json'))
+                # Свое поколение перечитывать не нужно; списки IVF и поиск слотов для чтения пересоберутся
+                self.signature = (stat.st_ino, stat.st_mtime_ns)
+                state['inverted'] = state['lookup'] = None
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def index_slots(self, state):
+        count = state['meta']['count']
+        self.slots, self.free = {}, []
+        if not count:
+            return
+        ids = np.asarray(state['ids'][:count])
+        for slot in np.flatnonzero(~ids.any(axis=1)):
+            self.free.append(int(slot))
+        for slot in np.flatnonzero(ids.any(axis=1)):
+            self.slots[join_id(ids[slot])] = int(slot)
+
+    def grow(self, state, needed):
+        """Расширяет файлы (новые слоты — нули) и переоткрывает их с новой емкостью."""
+        meta = state['meta']
+        capacity = max(1024, meta['capacity'] * 2, needed)
+        for name, row_bytes in (('vectors.f32', 4 * self.dimensions), ('ids.u64', 16), ('lists.i32', 4)):
+            with open(self.file(name), 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        meta['capacity'] = capacity
+        state['vectors'] = np.memmap(self.file('vectors.f32'), np.float32, 'r+', shape=(capacity, self.dimensions))
+        state['ids'] = np.memmap(self.file('ids.u64'), np.uint64, 'r+', shape=(capacity, 2))
+        state['lists'] = np.memmap(self.file('lists.i32'), np.int32, 'r+', shape=(capacity,))
+
+    # --- Запись -------------------------------------------------------
+
+    def upsert(self, items):
+        """items — пары (vector_id, вектор); уже известные vector_id перезаписываются."""
+        items = dict((uuid.UUID(str(vector_id)), vector) for vector_id, vector in items)
+        if not items:
+            return
+        vector_ids = list(items)
+        matrix = normalize(np.stack([np.asarray(items[vector_id], dtype=np.float32) for vector_id in vector_ids]))
+        if matrix.shape[1] != self.dimensions:
+            raise ValueError(f'Ожидаются вектора размерности {self.dimensions}, получено {matrix.shape[1]}.')
+        with self.writing() as state:
+            meta = state['meta']
+            slots = []
+            for vector_id in vector_ids:
+                slot = self.slots.get(vector_id)
+                if slot is None:
+                    if self.free:
+                        slot = self.free.pop()
+                    else:
+                        slot = meta['count']
+                        meta['count'] += 1
+                    self.slots[vector_id] = slot
+                slots.append(slot)
+            if meta['count'] > meta['capacity']:
+                self.grow(state, meta['count'])
+            slots = np.array(slots)
+            state['vectors'][slots] = matrix
+            state['ids'][slots] = split_ids(vector_ids)
+            if state['centroids'] is not None:
+                state['lists'][slots] = np.argmax(matrix @ state['centroids'].T, axis=1) + 1
+
+    def delete(self, vector_ids):
+        with self.writing() as state:
+            slots = []
+            for vector_id in vector_ids:
+                slot = self.slots.pop(uuid.UUID(str(vector_id)), None)
+                if slot is not None:
+                    slots.append(slot)
+            if not slots:
+                return
+            slots = np.array(slots)
+            state['vectors'][slots] = 0
+            state['ids'][slots] = 0
+            state['lists'][slots] = 0
+            self.free.extend(int(slot) for slot in slots)
+
+    def train(self, lists=None, iterations=10, seed=0):
+        """
+        Обучает IVF: сферический k-means на выборке векторов, затем каждому слоту —
+        номер ближайшего центра. lists по умолчанию — корень из числа векторов.
+        Возвращает число списков.
+        """
+        rng = np.random.default_rng(seed)
+        with self.writing() as state:
+            count = state['meta']['count']
+            alive = np.flatnonzero(state['ids'][:count].any(axis=1)) if count else np.array([], dtype=np.int64)
+            if not len(alive):
+                raise ValueError('Индекс пуст: обучать IVF не на чем.')
+            lists = min(lists or max(1, int(np.sqrt(len(alive)))), len(alive))
+            sample = np.sort(rng.choice(alive, min(len(alive), lists * TRAIN_POINTS_PER_LIST), replace=False))
+            data = np.asarray(state['vectors'][sample])
+            centroids = data[rng.choice(len(data), lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, data)
+                # Опустевший список получает случайную точку выборки
+                empty = np.flatnonzero(np.bincount(assignment, minlength=lists) == 0)
+                sums[empty] = data[rng.choice(len(data), len(empty))]
+                centroids = normalize(sums)
+            for start in range(0, count, CHUNK_SIZE):
+                block = np.asarray(state['vectors'][start:start + CHUNK_SIZE])
+                alive_block = state['ids'][start:start + CHUNK_SIZE].any(axis=1)
+                state['lists'][start:start + CHUNK_SIZE] = np.where(
+                    alive_block, np.argmax(block @ centroids.T, axis=1) + 1, 0
+                )
+            temporary = self.file('centroids.tmp.npy')
+            np.save(temporary, centroids)
+            os.replace(temporary, self.file('centroids.npy'))
+            state['centroids'] = centroids
+            state['meta']['lists'] = lists
+        return lists
+
+    # --- Поиск --------------------------------------------------------
+
+    def inverted_lists(self, state):
+        """Слоты, упорядоченные по списку IVF, и границы списков (строятся раз на поколение)."""
+        if state['inverted'] is None:
+            count = state['meta']['count']
+            lists = np.asarray(state['lists'][:count])
+            order = np.argsort(lists, kind='stable')
+            bounds = np.searchsorted(lists[order], np.arange(state['meta']['lists'] + 2))
+            state['inverted'] = (order, bounds)
+        return state['inverted']
+
+    def slots_for(self, state, vector_ids):
+        """Слоты векторов vector_ids (отсутствующие в индексе пропускаются), по возрастанию."""
+        if state['lookup'] is None:
+            # Слоты, отсортированные по vector_id: поиск половинным делением по старшей половине
+            ids = np.asarray(state['ids'][:state['meta']['count']])
+            order = np.lexsort((ids[:, 1], ids[:, 0]))
+            state['lookup'] = (order, ids[order, 0], ids[order, 1])
+        order, high, low = state['lookup']
+        wanted = split_ids(vector_ids)
+        slots = []
+        for (wanted_high, wanted_low), position in zip(wanted, np.searchsorted(high, wanted[:, 0])):
+            while position < len(high) and high[position] == wanted_high:
+                if low[position] == wanted_low:
+                    slots.append(order[position])
+                    break
+                position += 1
+        return np.sort(np.array(slots, dtype=np.int64))
+
+    def search(self, vector, k=10, exact=False, nprobe=None, candidates=None):
+        """
+        k ближайших по косинусу: список (vector_id, оценка) по убыванию оценки.
+        С обученным IVF смотрятся только nprobe ближайших списков (exact=True — полный перебор).
+        candidates — vector_id, среди которых искать (например, найденные по видимой области):
+        оцениваются только их вектора, точно.
+        """
+        state = self.refresh()
+        count = state['meta']['count']
+        if not count:
+            return []
+        query = normalize(vector)
+        if candidates is not None:
+            candidates = self.slots_for(state, list(candidates))
+            scores = state['vectors'][candidates] @ query
+        elif state['centroids'] is not None and not exact:
+            order, bounds = self.inverted_lists(state)
+            nprobe = min(nprobe or settings.VECTOR_IVF_NPROBE, len(state['centroids']))
+            probes = top_k(state['centroids'] @ query, nprobe) + 1
+            candidates = np.sort(np.concatenate([order[bounds[probe]:bounds[probe + 1]] for probe in probes]))
+            scores = state['vectors'][candidates] @ query
+        else:
+            candidates = np.flatnonzero(state['ids'][:count].any(axis=1))
+            scores = (state['vectors'][:count] @ query)[candidates]
+        best = top_k(scores, k)
+        ids = state['ids'][candidates[best]]
+        return [(join_id(row), float(score)) for row, score in zip(ids, scores[best])]
+
+
+class UpstashVectorIndex:
+    """Upstash Vector (UPSTASH_VECTOR_REST_URL / UPSTASH_VECTOR_REST_TOKEN): каждая операция — запрос по сети."""
+
+    def __init__(self):
+        from upstash_vector import Index
+        self.index = Index(url=settings.UPSTASH_VECTOR_REST_URL, token=settings.UPSTASH_VECTOR_REST_TOKEN)
+
+    def upsert(self, items):
+        vectors = [(str(vector_id), normalize(vector).tolist()) for vector_id, vector in items]
+        if vectors:
+            self.index.upsert(vectors=vectors)
+
+    def delete(self, vector_ids):
+        ids = [str(vector_id) for vector_id in vector_ids]
+        if ids:
+            self.index.delete(ids=ids)
+
+    def search(self, vector, k=10, exact=False, nprobe=None, candidates=None):
+        query = normalize(vector)
+        if candidates is None:
+            results = self.index.query(vector=query.tolist(), top_k=k)
+            return [(uuid.UUID(result.id), result.score) for result in results]
+        # Кандидаты заданы: их вектора — одним запросом, оценки считаем сами
+        fetched = [
+            result for result in self.index.fetch(ids=[str(vector_id) for vector_id in candidates], include_vectors=True)
+            if result is not None
+        ]
+        if not fetched:
+            return []
+        scores = normalize([result.vector for result in fetched]) @ query
+        return [(uuid.UUID(fetched[i].id), float(scores[i])) for i in top_k(scores, k)]
+
+    def train(self, lists=None, iterations=10, seed=0):
+        raise NotImplementedError('Upstash Vector строит индекс сам.')
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index():
+    # Один экземпляр на бэкенд и каталог: тесты подменяют VECTOR_INDEX_DIR через override_settings
+    key = (settings.VECTOR_BACKEND, str(settings.VECTOR_INDEX_DIR))
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = import_string(settings.VECTOR_BACKEND)()
+        return _indexes[key]
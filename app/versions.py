@@ -0,0 +1,106 @@
+# app/versions.py
+
+import hashlib
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .gallery import gallery_page
+from .models import Image, PointOfInterest
+
+# =====================================================================
+# Версии данных для условных GET (ETag / Last-Modified)
+# У Image и PointOfInterest есть штамп (version, modified_at), который
+# сигналы (app/signals.py) увеличивают при любом изменении самой записи
+# или того, что встроено в ее ответ API: маркеров изображения, сообщений
+# чата маркера. Проверка If-None-Match стоит одного запроса за штампом,
+# без сериализации; при совпадении отдается 304 без тела.
+# =====================================================================
+
+
+def version_bump():
+    """Поля для .update(): следующая версия записи и время изменения."""
+    return {'version': F('version') + 1, 'modified_at': timezone.now()}
+
+
+def touch(model, pk, instance=None):
+    """Увеличивает версию записи; instance (если передан) получает новый штамп, чтобы повторный save() его не откатил."""
+    model.objects.filter(pk=pk).update(**version_bump())
+    if instance is not None:
+        instance.refresh_from_db(fields=['version', 'modified_at'])
+
+
+def format_etag(*parts):
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def request_stamp(request, key, load):
+    """
+    Штамп для ETag и Last-Modified одного запроса: condition() спрашивает их
+    отдельными функциями, а в базу ходим один раз.
+    """
+    stamps = request.__dict__.setdefault('_version_stamps', {})
+    if key not in stamps:
+        stamps[key] = load()
+    return stamps[key]
+
+
+def gallery_stamp(request):
+    def load():
+        # Штамп страницы, а не всей галереи: сводка по архиву стоила бы прохода по всем изображениям.
+        # Страница все равно нужна для ответа (gallery_page считает ее один раз на запрос).
+        try:
+            page = gallery_page(request)
+        except ValueError:
+            # Неверные параметры: без валидаторов, представление ответит 400
+            return None, None
+        rows = ':'.join(
+            f'{image.id}.{image.version}.{int(image.modified_at.timestamp() * 1e6)}' for image in page['items']
+        )
+        digest = hashlib.sha1(rows.encode()).hexdigest()[:16]
+        # Last-Modified у страницы нет: после удаления изображения на нее сдвигаются более старые,
+        # и максимум modified_at может уменьшиться — изменение видно только по ETag
+        return format_etag('gallery', page['total'], int(page['has_more']), digest), None
+    return request_stamp(request, 'gallery', load)
+
+
+def image_stamp(request, id):
+    def load():
+        images = Image.objects.exclude(status='FAILED') if settings.TILES_ON_DEMAND else Image.objects.filter(status='COMPLETED')
+        row = images.filter(id=id).values_list('version', 'modified_at').first()
+        if row is None:
+            # Нет такого изображения: без валидаторов, представление само ответит 404
+            return None, None
+        # Время изменения в ETag обязательно: save() устаревшего экземпляра может
+        # вернуть счетчику прежнее значение, а момент изменения при этом новый
+        return format_etag('image', id, row[0], int(row[1].timestamp() * 1e6)), row[1]
+    return request_stamp(request, ('image', id), load)
+
+
+def marker_stamp(request, id):
+    def load():
+        row = PointOfInterest.objects.filter(id=id).values_list('version', 'modified_at').first()
+        if row is None:
+            return None, None
+        return format_etag('marker', id, row[0], int(row[1].timestamp() * 1e6)), row[1]
+    return request_stamp(request, ('marker', id), load)
+
+
+# Функции для django.views.decorators.http.condition
+def gallery_etag(request, *args, **kwargs):
+    return gallery_stamp(request)[0]
+
+
+def image_etag(request, id, **kwargs):
+    return image_stamp(request, id)[0]
+
+
+def image_last_modified(request, id, **kwargs):
+    return image_stamp(request, id)[1]
+
+
+def marker_etag(request, id, **kwargs):
+    return marker_stamp(request, id)[0]
+
+
+def marker_last_modified(request, id, **kwargs):
+    return marker_stamp(request, id)[1]
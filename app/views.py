@@ -4,9 +4,32 @@ from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.http import HttpResponse, Http404 
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
 from django.conf import settings
+import mimetypes
 import os
 from .models import Image, PointOfInterest, Comment
+from .ai import ask_about_point, get_answer_cache
+from .tile_pack import open_pack, pack_path_for
+from .response_cache import cache_stats, cached_response, reset_stats
+from .bulk_import import COORDINATE_MODES, IMPORT_KINDS, format_for, import_rows, text_stream
+from .clusters import clusters_in_bbox, level_for_zoom
+from .events import (
+    comment_event, event_stream, image_channel, marker_channel, marker_event, missed_page, sse_response
+)
+from .fast_json import render_markers
+from .fulltext import locate_documents, query_terms, search_documents
+from .gallery import gallery_page
+from .object_search import search_objects
+from .pagination import keyset_page, page_size
+from .spatial import markers_in_bbox
+from .tile_render import RENDER_FORMATS, get_tile, open_source
+from .versions import (
+    gallery_etag, image_etag, image_last_modified, marker_etag, marker_last_modified
+)
 from .serializers import (
     GalleryImageSerializer, 
     ImageDetailSerializer,
@@ -14,35 +37,88 @@ from .serializers import (
     MarkerCreateSerializer,
     MarkerSerializer,
     ChatMessageSerializer,
-    ChatMessageCreateSerializer
+    ChatMessageCreateSerializer,
+    ImageStatusSerializer,
+    MarkerClusterSerializer,
+    ObjectSearchResultSerializer,
+    PointQuestionSerializer,
+    GeminiInteractionSerializer,
+    serialize_markers,
+    serialize_search_results
 )
 
 # ... (GalleryListView, ImageDetailView, MarkerDetailView, ChatMessageCreateView - без изменений) ...
 # (Я скрыл их для краткости, но они должны быть в вашем файле)
-# 1. API для галереи
-class GalleryListView(generics.ListAPIView):
-    queryset = Image.objects.filter(status='COMPLETED')
-    serializer_class = GalleryImageSerializer
+# Ответы 1-3 отдаются с ETag/Last-Modified из штампов версий (app/versions.py):
+# если клиент прислал If-None-Match с текущим ETag, возвращается 304 без сериализации.
+# 1. API для галереи: страницы от новых к старым (app/gallery.py)
+# ?cursor=<next из прошлого ответа>, ?limit= (не больше GALLERY_PAGE_MAX_SIZE),
+# ?status= (по умолчанию COMPLETED), ?name= — начало названия.
+# total — оценка общего числа (обновляется раз в GALLERY_TOTAL_TTL секунд).
+@method_decorator(condition(etag_func=gallery_etag), name='get')
+class GalleryListView(APIView):
     permission_classes = [permissions.AllowAny]
 
+    def get(self, request):
+        try:
+            page = gallery_page(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'images': GalleryImageSerializer(page['items'], many=True, context={'request': request}).data,
+            'next': page['next'],
+            'hasMore': page['has_more'],
+            'total': page['total'],
+        })
+
 # 2. API для деталей изображения
+@method_decorator(condition(etag_func=image_etag, last_modified_func=image_last_modified), name='get')
+@method_decorator(cached_response('image', image_etag), name='get')
 class ImageDetailView(generics.RetrieveAPIView):
-    queryset = Image.objects.filter(status='COMPLETED')
     serializer_class = ImageDetailSerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = 'id'
 
+    def get_queryset(self):
+        # С тайлами "на лету" изображение можно смотреть, не дожидаясь конца нарезки
+        if settings.TILES_ON_DEMAND:
+            return Image.objects.exclude(status='FAILED')
+        return Image.objects.filter(status='COMPLETED')
+
 # 3. API для деталей маркера
+@method_decorator(condition(etag_func=marker_etag, last_modified_func=marker_last_modified), name='get')
+@method_decorator(cached_response('marker', marker_etag), name='get')
 class MarkerDetailView(generics.RetrieveAPIView):
     queryset = PointOfInterest.objects.all()
     serializer_class = MarkerDetailSerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = 'id'
 
-# 4. API для создания сообщения в чате
+# 4. API чата маркера: отправка сообщения (POST) и чтение страницами (GET)
+# GET ?before=<курсор> — сообщения старше курсора, ?since=<курсор> — только новые,
+# без курсоров — последняя страница; ?limit= — размер страницы (не больше CHAT_PAGE_MAX_SIZE)
 class ChatMessageCreateView(generics.CreateAPIView):
     serializer_class = ChatMessageCreateSerializer
     permission_classes = [permissions.AllowAny]
+
+    def get(self, request, marker_id):
+        point = get_object_or_404(PointOfInterest, id=marker_id)
+        try:
+            page = keyset_page(
+                point.comments.all(),
+                before=request.query_params.get('before'),
+                since=request.query_params.get('since'),
+                limit=page_size(request.query_params.get('limit')),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'messages': ChatMessageSerializer(page['items'], many=True).data,
+            'before': page['before'],
+            'since': page['since'],
+            'hasMore': page['has_more'],
+        })
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['point'] = PointOfInterest.objects.get(id=self.kwargs['marker_id'])
@@ -87,4 +163,290 @@ class MarkerCreateView(generics.CreateAPIView):
         # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
 
         headers = self.get_success_headers(response_serializer.data)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
\ No newline at end of file
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+# 5a. API маркеров в видимой области
+# Вместо всех точек изображения отдаются только попавшие в bbox, выбранные по
+# пространственному индексу (image, cell). С zoom на мелком масштабе точки прореживаются.
+class MarkerViewportView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def parse_viewport(self, request):
+        """bbox (нормированный, обрезанный до [0, 1]) и zoom из параметров запроса; ValueError при ошибке."""
+        try:
+            bbox = [float(value) for value in request.query_params.get('bbox', '0,0,1,1').split(',')]
+            zoom = request.query_params.get('zoom')
+            zoom = int(zoom) if zoom is not None else None
+        except ValueError:
+            raise ValueError('bbox — четыре числа через запятую, zoom — целое.')
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3] or (zoom is not None and zoom < 0):
+            raise ValueError('Ожидается bbox=min_x,min_y,max_x,max_y и zoom >= 0.')
+        return [min(max(value, 0.0), 1.0) for value in bbox], zoom
+
+    def get(self, request, image_id):
+        image = get_object_or_404(Image, id=image_id)
+        if not image.width or not image.height:
+            return Response({'error': 'Размеры изображения еще не определены.'}, status=status.HTTP_409_CONFLICT)
+        try:
+            bbox, zoom = self.parse_viewport(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return self.markers_response(request, image, bbox, zoom)
+
+    def markers_response(self, request, image, bbox, zoom):
+        limit = settings.MARKERS_VIEWPORT_LIMIT
+        markers = serialize_markers(markers_in_bbox(image, bbox, zoom)[:limit + 1], image.width, image.height)
+        payload = {
+            'markers': markers[:limit],
+            'truncated': len(markers) > limit,
+        }
+        if request.accepted_renderer.format == 'json':
+            # Большой список: рендерим сами быстрым кодировщиком (те же байты, что у DRF)
+            return HttpResponse(render_markers(payload), content_type='application/json')
+        return Response(payload)
+
+
+# 5b. API кластеров маркеров для мелкого масштаба
+# Кластеры (число, центр, точка-представитель) заранее посчитаны по ячейкам сетки
+# и обновляются при добавлении точек, здесь они только читаются в пределах bbox.
+# Ответ растет с размером видимой области, а не с общим числом маркеров.
+class MarkerClusterView(MarkerViewportView):
+
+    def get(self, request, image_id):
+        image = get_object_or_404(Image, id=image_id)
+        if not image.width or not image.height:
+            return Response({'error': 'Размеры изображения еще не определены.'}, status=status.HTTP_409_CONFLICT)
+        try:
+            bbox, zoom = self.parse_viewport(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if zoom is None:
+            return Response({'error': 'Параметр zoom обязателен.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        level = level_for_zoom(zoom)
+        if level > settings.MARKER_CLUSTER_MAX_LEVEL:
+            # Крупный масштаб: кластеров на этом уровне нет, отдаем сами маркеры
+            return self.markers_response(request, image, bbox, zoom)
+
+        # Вся картинка на мелком уровне — до 4^MAX_LEVEL ячеек: как и маркеры, отдаем не больше лимита
+        limit = settings.MARKER_CLUSTERS_VIEWPORT_LIMIT
+        clusters = list(clusters_in_bbox(image, level, bbox).select_related('representative')[:limit + 1])
+        context = {'image_width': image.width, 'image_height': image.height}
+        return Response({
+            'zoom': zoom,
+            'clusters': MarkerClusterSerializer(clusters[:limit], many=True, context=context).data,
+            'truncated': len(clusters) > limit,
+        })
+
+
+# 5c. API массового импорта маркеров/объектов поиска (только для персонала)
+# POST multipart: file — CSV или NDJSON; kind=markers|objects, coords=pixel|normalized,
+# format=csv|ndjson (по умолчанию по расширению файла). Большие каталоги удобнее
+# грузить командой manage.py bulk_import — запрос ждет окончания импорта.
+class BulkImportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, image_id):
+        image = get_object_or_404(Image, id=image_id)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Нужен файл в поле file.'}, status=status.HTTP_400_BAD_REQUEST)
+        kind = request.data.get('kind', 'markers')
+        coords = request.data.get('coords', 'pixel')
+        if kind not in IMPORT_KINDS or coords not in COORDINATE_MODES:
+            return Response(
+                {'error': f'kind — одно из {IMPORT_KINDS}, coords — одно из {COORDINATE_MODES}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        fmt = request.data.get('format') or format_for(upload.name)
+        try:
+            stats = import_rows(image, text_stream(upload), kind=kind, fmt=fmt, coords=coords, log=lambda message: None)
+        except ValueError as e:
+            # В том числе UnicodeDecodeError: файл не в UTF-8
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'rows': stats['rows'],
+            'created': stats['created'],
+            'invalid': stats['invalid'],
+            'errors': stats['errors'],
+            'seconds': stats['seconds'],
+            'rowsPerSecond': stats['rows_per_second'],
+        }, status=status.HTTP_201_CREATED)
+
+
+# 5d. API поиска объектов в видимой области по смыслу описания (app/object_search.py)
+# ?q=<текст>&bbox=min_x,min_y,max_x,max_y (нормированные 0..1)&limit=<n>
+class ObjectSearchView(MarkerViewportView):
+
+    def get(self, request, image_id):
+        image = get_object_or_404(Image, id=image_id)
+        if not image.width or not image.height:
+            return Response({'error': 'Размеры изображения еще не определены.'}, status=status.HTTP_409_CONFLICT)
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'Параметр q обязателен.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            bbox, zoom = self.parse_viewport(request)
+            limit = page_size(
+                request.query_params.get('limit'), settings.OBJECT_SEARCH_LIMIT, settings.OBJECT_SEARCH_MAX_LIMIT
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = search_objects(image, bbox, text, limit)
+        context = {'image_width': image.width, 'image_height': image.height}
+        return Response({
+            'objects': ObjectSearchResultSerializer(result['objects'], many=True, context=context).data,
+            'candidates': result['candidates'],
+            'prefiltered': result['prefiltered'],
+        })
+
+
+# 5e. API полнотекстового поиска по маркерам, сообщениям чата и объектам изображения (app/fulltext.py)
+# ?q=<текст>&type=marker,comment,object&offset=<n>&limit=<n>; результаты — от лучших к худшим
+class FulltextSearchView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, image_id):
+        image = get_object_or_404(Image, id=image_id)
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'Параметр q обязателен.'}, status=status.HTTP_400_BAD_REQUEST)
+        kinds = [kind for kind in request.query_params.get('type', '').split(',') if kind]
+        try:
+            offset = int(request.query_params.get('offset') or 0)
+            if offset < 0:
+                raise ValueError('offset не может быть отрицательным.')
+            limit = page_size(
+                request.query_params.get('limit'), settings.FULLTEXT_PAGE_SIZE, settings.FULLTEXT_PAGE_MAX_SIZE
+            )
+            # Лишний документ показывает, есть ли следующая страница
+            documents = search_documents(text, image_id=image.id, kinds=kinds, limit=limit + 1, offset=offset)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        has_more = len(documents) > limit
+        return Response({
+            'results': serialize_search_results(locate_documents(documents[:limit]), image, query_terms(text)),
+            'next': offset + limit if has_more else None,
+            'hasMore': has_more,
+        })
+
+
+# 6. Тайлы из упакованного архива (Image.tile_storage == 'pack')
+# URL повторяют раскладку dzsave: <id>.dzi и <id>_files/<level>/<col>_<row>.<format>,
+# поэтому OpenSeadragon сам строит адреса тайлов по адресу дескриптора.
+class PackedTileView(View):
+    # Тайлы неизменяемы до повторной нарезки, браузер может их кэшировать
+    cache_control = 'public, max-age=86400'
+
+    def get_pack(self, image_id):
+        pack_path = pack_path_for(image_id)
+        if not os.path.exists(pack_path):
+            raise Http404('Архив тайлов не найден')
+        return open_pack(pack_path)
+
+    def get(self, request, image_id, level=None, col=None, row=None, fmt=None):
+        pack = self.get_pack(image_id)
+        if level is None:
+            data = pack.read_dzi()
+            content_type = 'application/xml'
+        else:
+            data = pack.read(level, col, row)
+            content_type = mimetypes.guess_type(f'tile.{fmt}')[0] or 'application/octet-stream'
+        if data is None:
+            raise Http404('Тайл не найден')
+        response = HttpResponse(data, content_type=content_type)
+        response['Cache-Control'] = self.cache_control
+        return response
+
+
+# 7. Тайлы "на лету" из исходного файла
+# Та же раскладка URL, что и у PackedTileView. Отрендеренные тайлы попадают
+# в ограниченный LRU-кэш (память + диск).
+class DziView(View):
+    cache_control = 'public, max-age=3600'
+
+    def get(self, request, image_id, level=None, col=None, row=None, fmt='jpeg'):
+        image = get_object_or_404(Image, id=image_id)
+        if not image.source_file or not os.path.exists(image.source_file.path):
+            raise Http404('Исходный файл изображения не найден')
+        source = open_source(image.source_file.path)
+
+        if level is None:
+            # Формат и качество те же, что выбраны для нарезки этого изображения
+            response = HttpResponse(source.dzi(image.tile_format), content_type='application/xml')
+        else:
+            if fmt not in RENDER_FORMATS:
+                raise Http404('Неподдерживаемый формат тайла')
+            data = get_tile(image.id, source, level, col, row, fmt, image.tile_quality)
+            if data is None:
+                raise Http404('Тайл вне изображения')
+            response = HttpResponse(data, content_type=mimetypes.guess_type(f'tile.{fmt}')[0])
+        response['Cache-Control'] = self.cache_control
+        return response
+
+
+# 8. Статус обработки изображения
+# Легкий ответ для частого опроса: только статус и прогресс нарезки, без маркеров
+class ImageStatusView(generics.RetrieveAPIView):
+    queryset = Image.objects.only('id', 'status', *ImageStatusSerializer.Meta.fields)
+    serializer_class = ImageStatusSerializer
+    permission_classes = [permissions.AllowAny]
+    lookup_field = 'id'
+
+
+# 9. Статистика кэша ответов API (только для персонала)
+# С кэшем в памяти счетчики свои у каждого процесса; с Redis — общие.
+class ApiCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        # Кэш ответов AI (app/ai.py) всегда свой у процесса
+        return Response({**cache_stats(), 'ai': get_answer_cache().stats()})
+
+    def delete(self, request):
+        reset_stats()
+        get_answer_cache().clear(stats_only=True)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# 10. Живые события (Server-Sent Events, только под ASGI) вместо опроса:
+# по маркеру — новые сообщения чата, по изображению — новые маркеры.
+# Пропущенное досылается с курсора из заголовка Last-Event-ID (переподключение
+# EventSource) или параметра ?since= (например, chatPage.since из деталей маркера).
+async def marker_events(request, marker_id):
+    if not await PointOfInterest.objects.filter(id=marker_id).aexists():
+        raise Http404('Маркер не найден')
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    missed = missed_page(Comment.objects.filter(point_id=marker_id), since, comment_event)
+    return sse_response(event_stream(marker_channel(marker_id), missed))
+
+
+async def image_events(request, image_id):
+    image = await Image.objects.filter(id=image_id).only('id', 'width', 'height').afirst()
+    if image is None:
+        raise Http404('Изображение не найдено')
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    missed = missed_page(
+        PointOfInterest.objects.filter(image_id=image_id), since, lambda point: marker_event(point, image)
+    )
+    return sse_response(event_stream(image_channel(image_id), missed))
+
+
+# 11. Вопрос AI о маркере (app/ai.py): POST {"prompt": "..."} -> ответ модели,
+# повторный вопрос о той же точке отвечается из кэша (cached: true)
+class PointQuestionView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, marker_id):
+        point = get_object_or_404(PointOfInterest.objects.select_related('image'), id=marker_id)
+        serializer = PointQuestionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            interaction = ask_about_point(point, serializer.validated_data['prompt'], request.user)
+        except Exception as e:
+            print(f"ОШИБКА: Модель не ответила на вопрос о маркере {point.id}: {e}")
+            return Response({'error': 'Модель недоступна, попробуйте позже.'}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(GeminiInteractionSerializer(interaction).data, status=status.HTTP_201_CREATED)